@@ -0,0 +1,73 @@
+"""Inverted index of the transactions touching each account.
+
+The index is built once per loaded ledger and maps every account, and every
+account subtree, to the sorted positions of the transactions which post to it.
+Selecting the transactions of a set of accounts is then a merge of these
+position lists instead of a scan of all postings.
+"""
+
+import collections
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from beancount.core import account, data
+
+# Suffix of an account name which selects the account and all its descendants,
+# e.g. "Expenses:Home:*".
+SUBTREE_SUFFIX = ":*"
+
+
+class AccountIndex:
+    """Index a list of transactions by the accounts they post to."""
+
+    def __init__(self, txns: Sequence[data.Transaction]):
+        self.txns = txns
+        exact = collections.defaultdict(list)
+        subtree = collections.defaultdict(list)
+        for position, txn in enumerate(txns):
+            accounts = {posting.account for posting in txn.postings}
+            for name in accounts:
+                exact[name].append(position)
+            for name in {
+                parent for name in accounts for parent in account.parents(name)
+            }:
+                subtree[name].append(position)
+        self.exact: Dict[str, np.ndarray] = _to_arrays(exact)
+        self.subtree: Dict[str, np.ndarray] = _to_arrays(subtree)
+
+    def positions(self, accounts: Iterable[str]) -> np.ndarray:
+        """Return the sorted positions of the transactions touching any of
+        `accounts`. Names ending with ":*" select a whole subtree."""
+        lists = []
+        for name in accounts:
+            if name.endswith(SUBTREE_SUFFIX):
+                found = self.subtree.get(name[: -len(SUBTREE_SUFFIX)])
+            else:
+                found = self.exact.get(name)
+            if found is not None:
+                lists.append(found)
+        if not lists:
+            return np.zeros(0, dtype=np.int64)
+        if len(lists) == 1:
+            return lists[0]
+        return np.unique(np.concatenate(lists))
+
+    def select(
+        self,
+        accounts: Iterable[str],
+        span: Optional[Tuple[int, int]] = None,
+    ) -> List[data.Transaction]:
+        """Return the transactions touching any of `accounts`, optionally
+        restricted to a [start, stop) span of positions."""
+        positions = self.positions(accounts)
+        if span is not None:
+            lo, hi = np.searchsorted(positions, span)
+            positions = positions[lo:hi]
+        return [self.txns[position] for position in positions.tolist()]
+
+
+def _to_arrays(lists: Dict[str, List[int]]) -> Dict[str, np.ndarray]:
+    return {
+        name: np.array(positions, dtype=np.int64)
+        for name, positions in lists.items()
+    }
@@ -0,0 +1,78 @@
+"""Compiled, memoized account rollup mappings.
+
+A mapping rolls up every account matching a source regexp (anchored at the
+start of the account name, as with `re.match`) into a destination account.
+The first matching mapping wins.
+"""
+
+import logging
+import re
+from typing import Dict, Iterable, List, Optional, Pattern, Tuple, Union
+
+Rule = Tuple[Union[str, Pattern], str]
+
+# Numbered backreferences and conditionals change meaning once a pattern is
+# embedded in a larger one.
+NUMBERED_REFERENCE = re.compile(r"\\\d|\(\?\(\d")
+
+
+class AccountMapper:
+    """Map account names through a list of (source regexp, dest) rules.
+
+    All source regexps are compiled into a single alternation so that an
+    unseen account costs one regexp match, and every account is remembered
+    afterwards so that a posting costs one dict lookup.
+    """
+
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules: List[Tuple[Pattern, str]] = [
+            (re.compile(source) if isinstance(source, str) else source, dest)
+            for source, dest in rules
+        ]
+        self.cache: Dict[str, str] = {}
+        self.regexp: Optional[Pattern] = None
+        if self.rules and not any(
+            NUMBERED_REFERENCE.search(regexp.pattern)
+            or regexp.flags & ~re.UNICODE
+            for regexp, _ in self.rules
+        ):
+            try:
+                self.regexp = re.compile(
+                    "|".join(
+                        "(?P<_r{}>{})".format(index, regexp.pattern)
+                        for index, (regexp, _) in enumerate(self.rules)
+                    )
+                )
+            except re.error:
+                # Clashing group names in the sources.
+                logging.debug("Cannot combine account mappings, using a list")
+
+    @classmethod
+    def from_config(cls, config, defaults: Iterable[Rule] = ()):
+        """Build a mapper from the `mappings` of an IncomeExpenseConfig."""
+        rules = [(mapping.source, mapping.dest) for mapping in config.mappings]
+        return cls(rules + list(defaults))
+
+    def __len__(self) -> int:
+        return len(self.rules)
+
+    def __call__(self, account: str) -> str:
+        try:
+            return self.cache[account]
+        except KeyError:
+            mapped = self.cache[account] = self._match(account)
+            return mapped
+
+    def _match(self, account: str) -> str:
+        if self.regexp is not None:
+            match = self.regexp.match(account)
+            if match is None:
+                return account
+            # The wrapping group of a rule closes after any group nested in
+            # it, so it is the last group matched.
+            return self.rules[int(match.lastgroup[2:])][1]
+        # Without a combined regexp, try the rules one at a time.
+        for regexp, dest in self.rules:
+            if regexp.match(account):
+                return dest
+        return account
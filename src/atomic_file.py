@@ -0,0 +1,52 @@
+"""Atomic writes of output files.
+
+A file is written to a temporary file in the same directory, which is then
+renamed over it, so that readers never see a partly written file. The
+temporary file is given the mode of a newly created file under the current
+umask, rather than the private mode of `tempfile.mkstemp`.
+"""
+
+import contextlib
+import os
+import pickle
+import tempfile
+from os import path
+from typing import Any, Iterator
+
+
+def _umask() -> int:
+    """Return the umask of the process."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+@contextlib.contextmanager
+def atomic_output(filename: str, suffix: str = "") -> Iterator[str]:
+    """Yield the path of a temporary file to write, renamed to `filename` if
+    the block completes and removed otherwise. The directory is created if
+    needed.
+
+    Args:
+      filename: The file to write.
+      suffix: The suffix of the temporary file, e.g. an extension from which
+        a writer infers the format.
+    """
+    dirname = path.dirname(path.abspath(filename))
+    os.makedirs(dirname, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix=suffix)
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.chmod(tmp_path, 0o666 & ~_umask())
+        os.replace(tmp_path, filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def write_pickle(filename: str, payload: Any):
+    """Pickle a payload to a file atomically."""
+    with atomic_output(filename) as tmp_path:
+        with open(tmp_path, "wb") as outfile:
+            pickle.dump(payload, outfile, protocol=pickle.HIGHEST_PROTOCOL)
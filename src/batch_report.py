@@ -0,0 +1,221 @@
+"""Render many income vs expenses reports from a single load of the ledger.
+
+Each line of a jobs file describes one report, as whitespace separated
+columns:
+
+  CONFIG START-DATE END-DATE OUTPUT-DIR
+
+where a date of "-" means the default (the first entry of the ledger, or
+today). Blank lines and lines starting with "#" are ignored.
+
+The ledger is loaded, and its price map and indexes built, only once. The
+reports are then computed concurrently in a process pool, and their charts,
+or PDFs, rendered in a final stage which skips those whose data did not
+change.
+"""
+import argparse
+import concurrent.futures
+import datetime
+import logging
+import shlex
+from typing import List, NamedTuple, Optional, Sequence, Tuple
+
+from beancount.core.number import Decimal
+
+from chart_render import ChartJob, render_charts
+from compute_income_vs_expenses import (DECIMAL_PRECISION, ReportLedger,
+                                        prepare_ledger, read_config,
+                                        run_report)
+from ledger_cache import load_ledger
+from table_export import FORMATS as EXPORT_FORMATS
+from table_export import parse_formats
+from worker_pool import fork_pool, set_worker_state, worker_count, worker_state
+
+Job = NamedTuple(
+    "Job",
+    [
+        ("config", str),
+        ("start_date", Optional[datetime.date]),
+        ("end_date", Optional[datetime.date]),
+        ("output", str),
+    ],
+)
+
+
+def read_jobs(filename: str) -> List[Job]:
+    """Read a list of jobs from a file."""
+
+    def parse_date(string: str) -> Optional[datetime.date]:
+        return None if string == "-" else datetime.date.fromisoformat(string)
+
+    jobs = []
+    with open(filename, "r") as infile:
+        for lineno, line in enumerate(infile, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            fields = shlex.split(line)
+            if len(fields) != 4:
+                raise ValueError(
+                    "{}:{}: expected 4 columns, got {}".format(
+                        filename, lineno, len(fields)
+                    )
+                )
+            config, start, end, output = fields
+            start_date, end_date = parse_date(start), parse_date(end)
+            jobs.append(Job(config, start_date, end_date, output))
+    return jobs
+
+
+def _run_job(
+    job: Job,
+    Q: Decimal,
+    use_snapshots: bool,
+    pdf: bool,
+    page_rows: Optional[int],
+    export_formats: Sequence[str],
+) -> Tuple[str, List[ChartJob]]:
+    charts: List[ChartJob] = []
+    run_report(
+        worker_state(),
+        job.config,
+        job.output,
+        job.start_date,
+        job.end_date,
+        Q,
+        use_snapshots,
+        charts=charts,
+        pdf=pdf,
+        page_rows=page_rows,
+        export_formats=export_formats,
+    )
+    return job.output, charts
+
+
+def run_jobs(
+    ledger: ReportLedger,
+    jobs: List[Job],
+    Q: Decimal,
+    max_workers: Optional[int] = None,
+    use_snapshots: bool = True,
+    pdf: bool = False,
+    page_rows: Optional[int] = None,
+    export_formats: Sequence[str] = (),
+):
+    """Run all the jobs on a loaded ledger, in parallel if possible."""
+    charts: List[ChartJob] = []
+    options = (use_snapshots, pdf, page_rows, export_formats)
+
+    def done(output: str, job_charts: List[ChartJob]):
+        logging.info("Rendered %s", output)
+        charts.extend(job_charts)
+
+    workers = worker_count(max_workers, len(jobs))
+    if workers <= 1:
+        set_worker_state(ledger)
+        for job in jobs:
+            done(*_run_job(job, Q, *options))
+        render_charts(charts, max_workers)
+        return
+
+    # Forked workers inherit the ledger instead of unpickling a copy of it.
+    with fork_pool(workers, ledger) as executor:
+        futures = [
+            executor.submit(_run_job, job, Q, *options) for job in jobs
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            done(*future.result())
+    render_charts(charts, max_workers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+
+    parser.add_argument("ledger", help="Beancount ledger file")
+    parser.add_argument(
+        "jobs", nargs="+", help="Files listing the reports to render."
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Verbose mode"
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        action="store",
+        type=int,
+        help="Number of worker processes. Default is the number of CPUs.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        help="Directory for the parsed ledger cache.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always parse the ledger from scratch.",
+    )
+    parser.add_argument(
+        "--no-snapshots",
+        action="store_true",
+        help="Recompute every month instead of reusing unchanged ones.",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Keep only a compact store of the postings after loading, and "
+        "free the entries. Snapshots are not used.",
+    )
+    parser.add_argument(
+        "--pdf",
+        "--pdfs",
+        action="store_true",
+        help="Render each report as a PDF in its output directory.",
+    )
+    parser.add_argument(
+        "--page-rows",
+        action="store",
+        type=int,
+        help="Split HTML tables longer than this in pages of their own.",
+    )
+    parser.add_argument(
+        "--export",
+        action="store",
+        type=parse_formats,
+        default=(),
+        help="Also export the tables in these comma-separated formats, out "
+        "of {}.".format(",".join(EXPORT_FORMATS)),
+    )
+
+    args = parser.parse_args()
+    if args.verbose:
+        logging.basicConfig(
+            level=logging.DEBUG, format="%(levelname)-8s: %(message)s"
+        )
+        logging.getLogger("matplotlib.font_manager").disabled = True
+
+    jobs = [job for filename in args.jobs for job in read_jobs(filename)]
+    if not jobs:
+        return
+
+    logging.info("Reading ledger: %s", args.ledger)
+    entries, _, options_map = load_ledger(
+        args.ledger, args.cache_dir, not args.no_cache
+    )
+    # Build the prefix sums of the trends before the workers fork.
+    configs = [] if args.pdf else [read_config(job.config) for job in jobs]
+    ledger = prepare_ledger(entries, options_map, args.compact, configs)
+    del entries
+    run_jobs(
+        ledger,
+        jobs,
+        Decimal(DECIMAL_PRECISION),
+        args.workers,
+        not args.no_snapshots,
+        args.pdf,
+        args.page_rows,
+        args.export,
+    )
+
+
+if __name__ == "__main__":
+    main()
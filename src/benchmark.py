@@ -0,0 +1,305 @@
+"""Time each stage of the report pipelines on a synthetic ledger.
+
+A ledger is generated from the given spec (see synthetic_ledger.py) and each
+stage is run a few times in isolation, from loading to rendering and the net
+worth computation for every period type. The best and median times of each
+stage are written as JSON along with the spec and the git revision, so that
+runs can be compared with --compare.
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from os import path
+from typing import Any, Callable, Dict, Optional
+
+from beancount import loader
+from beancount.core import prices
+from beancount.core.number import Decimal
+
+import networth_report
+from account_mapping import AccountMapper
+from compute_income_vs_expenses import (DECIMAL_PRECISION, compute_trends,
+                                        draw_inc_vs_expenses, prepare_ledger,
+                                        prune_date_range,
+                                        prune_non_budget_transactions,
+                                        range_index, read_config, write_html)
+from ledger_cache import load_ledger
+from monthly_expenses import (MAPS, accumulate_balances, compute_tables,
+                              fold_periods, reduce_balances)
+from networth_engine import BalanceCheckpoints, compute_net_worths
+from olap_cube import LEVELS
+from price_converter import PriceConverter
+from range_query import RangeIndex
+from synthetic_ledger import (add_spec_arguments, end_date, generate_ledger,
+                              spec_from_args)
+
+# Bump this whenever the stages or the layout of the results change.
+RESULTS_VERSION = 6
+
+
+class Timer:
+    """Run and time stages, keeping the timings of each."""
+
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.stages: Dict[str, Dict[str, Any]] = {}
+
+    def run(self, name: str, func: Callable[[], Any]) -> Any:
+        times = []
+        for _ in range(self.repeat):
+            start = time.perf_counter()
+            value = func()
+            times.append(time.perf_counter() - start)
+        self.stages[name] = {
+            "best": min(times),
+            "median": statistics.median(times),
+            "runs": len(times),
+        }
+        logging.info("%-32s %9.4fs", name, min(times))
+        return value
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=path.dirname(path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(spec, workdir: str, repeat: int) -> Dict[str, Any]:
+    """Generate a ledger in `workdir` and time every stage on it."""
+    timer = Timer(repeat)
+    filename = timer.run("generate", lambda: generate_ledger(workdir, spec))
+    config = read_config(path.join(workdir, "config.pbtxt"))
+    Q = Decimal(DECIMAL_PRECISION)
+
+    # Loading, from scratch and from the pickled cache.
+    entries, _, options_map = timer.run(
+        "load", lambda: loader.load_file(filename)
+    )
+    cache_dir = path.join(workdir, "cache")
+    load_ledger(filename, cache_dir)
+    timer.run("load_cached", lambda: load_ledger(filename, cache_dir))
+
+    timer.run("build_price_map", lambda: prices.build_price_map(entries))
+    ledger = timer.run(
+        "prepare_ledger", lambda: prepare_ledger(entries, options_map)
+    )
+    acctypes = ledger.acctypes
+
+    # Filtering, over the whole ledger but its first and last months.
+    start = datetime.date(spec.start_year, 2, 1)
+    end = end_date(spec) - datetime.timedelta(days=31)
+    timer.run(
+        "prune_date_range",
+        lambda: prune_date_range(ledger.txn_index, start, end),
+    )
+    span = ledger.txn_index.span(start, end)
+    pruned = timer.run(
+        "prune_non_budget_transactions",
+        lambda: prune_non_budget_transactions(
+            ledger.account_index, config, span
+        ),
+    )
+
+    # Aggregation, and conversion of the aggregated balances.
+    mapper = AccountMapper.from_config(config, MAPS)
+    types = {acctypes.income, acctypes.expenses}
+    balances, _ = timer.run(
+        "aggregate", lambda: accumulate_balances(pruned, types, mapper)
+    )
+    month = LEVELS["month"]
+
+    def convert():
+        converter = PriceConverter(ledger.price_map)
+        for acctype in types:
+            reduce_balances(
+                fold_periods(balances[acctype], month), month, converter
+            )
+
+    timer.run("convert", convert)
+    tables = timer.run(
+        "compute_tables",
+        lambda: compute_tables(
+            pruned, acctypes, ledger.price_map, Q, types, mapper=mapper
+        ),
+    )
+    income = tables[(acctypes.income, "month")]
+    expenses = tables[(acctypes.expenses, "month")]
+
+    # The same on a compact posting store.
+    compact = timer.run(
+        "prepare_ledger_compact",
+        lambda: prepare_ledger(entries, options_map, compact=True),
+    )
+    compact_pruned = prune_non_budget_transactions(
+        compact.account_index, config, compact.txn_index.span(start, end)
+    )
+    timer.run(
+        "compute_tables_compact",
+        lambda: compute_tables(
+            compact_pruned, acctypes, ledger.price_map, Q, types, mapper=mapper
+        ),
+    )
+
+    # Range queries over prefix sums.
+    # The trends only query the prefix sums kept with the ledger.
+    timer.run("range_index", lambda: RangeIndex(compact_pruned))
+    range_index(ledger, config)
+    timer.run("compute_trends", lambda: compute_trends(ledger, config, end, Q))
+
+    # Rendering.
+    outdir = path.join(workdir, "report")
+    timer.run(
+        "render_html",
+        lambda: write_html(
+            outdir, "Benchmark", start, end, income, expenses, chart=False
+        ),
+    )
+    timer.run(
+        "render_chart",
+        lambda: draw_inc_vs_expenses(
+            path.join(outdir, "chart.svg"), start, end, income, expenses
+        ),
+    )
+
+    # Net worth, for every period type, up to the end of the ledger.
+    currencies = options_map["operating_currency"]
+    grids = {}
+    for period in networth_report.PERIODS:
+        grids[period] = dates = [
+            date
+            for date in networth_report.period_dates(entries, None, period)
+            if date <= end_date(spec)
+        ]
+        timer.run(
+            "net_worth_{}".format(period),
+            lambda: compute_net_worths(
+                entries, acctypes, ledger.price_map, dates, currencies
+            ),
+        )
+
+    # Daily net worth in a process pool, by date chunk and currency.
+    timer.run(
+        "net_worth_daily_parallel",
+        lambda: compute_net_worths(
+            entries,
+            acctypes,
+            ledger.price_map,
+            grids["daily"],
+            currencies,
+            max_workers=None,
+        ),
+    )
+
+    # Net worth at a single date, from the monthly balance checkpoints.
+    checkpoints = timer.run(
+        "build_checkpoints",
+        lambda: BalanceCheckpoints.from_entries(entries, acctypes),
+    )
+    middle = start + (end - start) / 2
+    timer.run(
+        "net_worth_at_date",
+        lambda: compute_net_worths(
+            entries,
+            acctypes,
+            ledger.price_map,
+            [middle],
+            currencies,
+            checkpoints=checkpoints,
+        ),
+    )
+
+    return {
+        "version": RESULTS_VERSION,
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": _git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "spec": spec._asdict(),
+        "entries": len(entries),
+        "repeat": repeat,
+        "stages": timer.stages,
+    }
+
+
+def compare(baseline: Dict[str, Any], results: Dict[str, Any]):
+    """Print the times of the stages of two runs side by side."""
+    print("{:<32} {:>10} {:>10} {:>8}".format("stage", "base", "new", "ratio"))
+    for name, stage in results["stages"].items():
+        base = baseline["stages"].get(name)
+        if base is None:
+            print("{:<32} {:>10} {:>10.4f}".format(name, "-", stage["best"]))
+            continue
+        print(
+            "{:<32} {:>10.4f} {:>10.4f} {:>8.2f}".format(
+                name, base["best"], stage["best"], stage["best"] / base["best"]
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        default="benchmark.json",
+        help="File to write the results to.",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store",
+        help="Results of an earlier run to compare with.",
+    )
+    parser.add_argument(
+        "--repeat",
+        action="store",
+        type=int,
+        default=3,
+        help="Number of runs of each stage.",
+    )
+    parser.add_argument(
+        "--workdir",
+        action="store",
+        help="Directory for the generated ledger. Default is a temporary one.",
+    )
+    add_spec_arguments(parser)
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="%(levelname)-8s: %(message)s"
+    )
+    logging.getLogger("matplotlib.font_manager").disabled = True
+
+    spec = spec_from_args(args)
+    if args.workdir:
+        results = run_benchmarks(spec, args.workdir, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            results = run_benchmarks(spec, workdir, args.repeat)
+
+    with open(args.output, "w") as outfile:
+        json.dump(results, outfile, indent=2)
+    if args.compare:
+        with open(args.compare) as infile:
+            compare(json.load(infile), results)
+
+
+if __name__ == "__main__":
+    main()
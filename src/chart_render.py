@@ -0,0 +1,106 @@
+"""Render stage for charts, skipping those whose inputs did not change.
+
+A chart is described by a job: the file to write, a module-level drawing
+function and its arguments. The digest of a chart hashes the drawing function
+and its pickled arguments, which include the data and the style, and is kept
+in a sidecar file next to the chart. Charts whose digest matches the one on
+disk are skipped, and the others rendered in a process pool, since matplotlib
+is not thread-safe.
+"""
+
+import hashlib
+import logging
+import pickle
+from os import path
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+from atomic_file import atomic_output
+from profiling import stage
+from worker_pool import fork_pool, worker_count
+
+# Bump this whenever the way charts are drawn changes in a way that is not
+# reflected in the arguments of the drawing functions.
+CHART_VERSION = 1
+
+# Suffix of the sidecar file holding the digest of a chart.
+DIGEST_SUFFIX = ".sha256"
+
+ChartJob = NamedTuple(
+    "ChartJob",
+    [
+        ("filename", str),
+        # Called as draw(outfile, *args) to save the chart to `outfile`.
+        ("draw", Callable[..., None]),
+        ("args", Tuple[Any, ...]),
+    ],
+)
+
+
+def chart_digest(job: ChartJob) -> str:
+    """Hash the drawing function and the arguments of a chart."""
+    hasher = hashlib.sha256()
+    hasher.update(
+        "{}\0{}.{}\0".format(
+            CHART_VERSION, job.draw.__module__, job.draw.__qualname__
+        ).encode("utf-8")
+    )
+    hasher.update(pickle.dumps(job.args, protocol=4))
+    return hasher.hexdigest()
+
+
+def is_current(job: ChartJob, digest: str) -> bool:
+    """Check if the chart on disk was rendered from the same inputs."""
+    if not path.exists(job.filename):
+        return False
+    try:
+        with open(job.filename + DIGEST_SUFFIX, "r") as infile:
+            return infile.read().strip() == digest
+    except OSError:
+        return False
+
+
+def render_chart(job: ChartJob, digest: Optional[str] = None) -> str:
+    """Draw a chart to its file, atomically, and record its digest."""
+    digest = digest or chart_digest(job)
+    # Keep the extension so that matplotlib can infer the output format.
+    suffix = path.splitext(job.filename)[1]
+    with atomic_output(job.filename, suffix) as tmp_path:
+        job.draw(tmp_path, *job.args)
+    with open(job.filename + DIGEST_SUFFIX, "w") as outfile:
+        print(digest, file=outfile)
+    return job.filename
+
+
+def render_charts(
+    jobs: List[ChartJob], max_workers: Optional[int] = None
+) -> List[str]:
+    """Render the charts whose inputs changed, in parallel if possible.
+
+    Returns the filenames of the charts which were rendered.
+    """
+    with stage("plot"):
+        return _render_charts(jobs, max_workers)
+
+
+def _render_charts(
+    jobs: List[ChartJob], max_workers: Optional[int]
+) -> List[str]:
+    pending = []
+    for job in jobs:
+        digest = chart_digest(job)
+        if is_current(job, digest):
+            logging.info("Chart unchanged: %s", job.filename)
+        else:
+            pending.append((job, digest))
+
+    workers = worker_count(max_workers, len(pending))
+    if workers <= 1:
+        return [render_chart(job, digest) for job, digest in pending]
+
+    # Forked workers inherit the already imported modules.
+    with fork_pool(workers) as executor:
+        futures = [
+            executor.submit(render_chart, job, digest)
+            for job, digest in pending
+        ]
+        return [future.result() for future in futures]
@@ -0,0 +1,114 @@
+"""Check that the report modules import quickly and without matplotlib.
+
+Each module is imported in a fresh interpreter under `python -X importtime`.
+The check fails if a module pulls in the plotting stack at import time, or if
+its cumulative import time exceeds the budget. The best of a few runs is kept
+to smooth out noise. The same check runs under pytest, in
+tests/test_import_time.py.
+"""
+
+import argparse
+import logging
+import subprocess
+import sys
+from os import path
+from typing import Dict, List
+
+MODULES = [
+    "compute_income_vs_expenses",
+    "networth_report",
+    "batch_report",
+    "report_server",
+]
+
+# Top-level packages which must only be imported when a chart is drawn.
+FORBIDDEN = ("matplotlib",)
+
+DEFAULT_BUDGET_MS = 500.0
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """Return the cumulative import time, in microseconds, of every module
+    imported by importing `module`."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=path.dirname(path.abspath(__file__)),
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.partition(":")[2].split("|")
+        if cumulative.strip().isdigit():
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def check_module(module: str, budget_ms: float, repeat: int) -> List[str]:
+    """Return the list of problems with importing a module."""
+    errors = []
+    best_ms = None
+    for _ in range(repeat):
+        times = import_times(module)
+        forbidden = sorted(
+            name for name in times if name.split(".")[0] in FORBIDDEN
+        )
+        if forbidden:
+            errors.append(
+                "{} imports {} at import time".format(module, forbidden[0])
+            )
+            break
+        total_ms = times[module] / 1000.0
+        best_ms = total_ms if best_ms is None else min(best_ms, total_ms)
+    if best_ms is not None:
+        logging.info("%s: %.0f ms", module, best_ms)
+        if best_ms > budget_ms:
+            errors.append(
+                "{} takes {:.0f} ms to import, over the budget of {:.0f} "
+                "ms".format(module, best_ms, budget_ms)
+            )
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        default=MODULES,
+        help="Modules to check. Default is all the report CLIs.",
+    )
+    parser.add_argument(
+        "--budget-ms",
+        action="store",
+        type=float,
+        default=DEFAULT_BUDGET_MS,
+        help="Maximum cumulative import time of each module.",
+    )
+    parser.add_argument(
+        "--repeat",
+        action="store",
+        type=int,
+        default=3,
+        help="Number of runs per module, keeping the fastest.",
+    )
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.INFO, format="%(levelname)-8s: %(message)s"
+    )
+
+    errors = []
+    for module in args.modules:
+        errors.extend(check_module(module, args.budget_ms, args.repeat))
+    for error in errors:
+        logging.error("%s", error)
+    sys.exit(1 if errors else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,32 +1,92 @@
 """Calculate Income vs expenses
 """
 import argparse
-import collections
 import datetime
 import io
 import logging
 import os
 from functools import partial
 from os import path
-from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from typing import (IO, Any, Dict, Iterator, List, NamedTuple, Optional,
+                    Sequence, Tuple, Union)
 
-import matplotlib.dates as mdates
-import matplotlib.pyplot as plt
 import numpy as np
-from beancount import loader
-from beancount.core import (account_types, convert, data, display_context,
-                            getters, inventory, prices)
+from beancount.core import account, data, display_context, prices
 from beancount.core.number import Decimal
 from beancount.parser import options, printer
 from google.protobuf import text_format
 
+from account_index import SUBTREE_SUFFIX, AccountIndex
+from account_mapping import AccountMapper
+from chart_render import ChartJob, render_charts
+from date_index import DateIndex, Span
 from income_expense_config_pb2 import IncomeExpenseConfig
-from monthly_expenses import compute_monthly_expenses, compute_monthly_income
+from ledger_cache import Ledger, load_ledger
+from monthly_expenses import MAPS, compute_tables
+from olap_cube import LEVELS, period_start
+from pivot_table import PivotTable
+from plotting import load_pyplot
+from posting_store import PostingStore, to_decimal
+from price_converter import PriceConverter
+from profiling import add_profile_arguments, profiled, stage
+from range_query import RangeIndex, months_before
+from snapshot_store import SnapshotStore
+from table_export import FORMATS as EXPORT_FORMATS
+from table_export import export_table, parse_formats
+from table_writer import paginate, write_table
+from watch import run_watch
 
 Date = datetime.date
 Month = str
 
-plt.style.use("fivethirtyeight")
+CHART_STYLE = "fivethirtyeight"
+
+# Layout of the pages of PDF reports: US letter, landscape.
+PDF_PAGE_SIZE = (11, 8.5)
+PDF_ROWS_PER_PAGE = 40
+PDF_COLUMNS_PER_PAGE = 13
+PDF_FONT_SIZE = 6
+
+DECIMAL_PRECISION = "0.00"
+
+# The windows of the trailing monthly averages of the reports, in months.
+TRAILING_MONTHS = (3, 6, 12)
+
+# The depth of the accounts of the trend tables, e.g. Expenses:Food.
+TREND_DEPTH = 2
+
+# A loaded ledger, with the price map and indexes shared by all reports. A
+# compact ledger has no entries, and a posting store as both indexes.
+ReportLedger = NamedTuple(
+    "ReportLedger",
+    [
+        ("entries", data.Entries),
+        ("options_map", Dict[str, Any]),
+        ("acctypes", Any),
+        ("price_map", prices.PriceMap),
+        ("txn_index", Union[DateIndex, PostingStore]),
+        ("account_index", Union[AccountIndex, PostingStore]),
+        # The date of the first entry, where reports start by default.
+        ("first_date", Date),
+        # The prefix sums of the budget transactions, by budget accounts, see
+        # `range_index`.
+        ("range_indexes", Dict[Tuple[str, ...], RangeIndex]),
+    ],
+)
+
+Table = NamedTuple("Table", [("header", List[str]), ("rows", List[List[Any]])])
+
+# The tables of a report, by (account type, granularity), and the trend
+# tables with their headings.
+Report = NamedTuple(
+    "Report",
+    [
+        ("start_date", Date),
+        ("end_date", Date),
+        ("tables", Dict[Tuple[str, str], PivotTable]),
+        ("trends", List[Tuple[str, Table]]),
+    ],
+)
 
 
 def read_config(
@@ -69,12 +129,81 @@ def main():
         type=datetime.date.fromisoformat,
         help="The end date to compute to.",
     )
+    parser.add_argument(
+        "-g",
+        "--granularity",
+        action="store",
+        choices=list(LEVELS),
+        default="month",
+        help="The period of the columns of the tables. Default is month.",
+    )
+    parser.add_argument(
+        "--depth",
+        action="store",
+        type=int,
+        help="Roll the accounts up to their ancestors with at most this many "
+        "components, e.g. 2 for Expenses:Food.",
+    )
     parser.add_argument(
         "--pdf",
         "--pdfs",
         action="store_true",
-        help="Render as PDFs. Default is HTML directories.",
+        help="Render as a PDF in the output directory. Default is HTML.",
+    )
+    parser.add_argument(
+        "--no-chart",
+        action="store_true",
+        help="Only render the tables, without loading the plotting library.",
+    )
+    parser.add_argument(
+        "--page-rows",
+        action="store",
+        type=int,
+        help="Split HTML tables longer than this in pages of their own.",
+    )
+    parser.add_argument(
+        "--export",
+        action="store",
+        type=parse_formats,
+        default=(),
+        help="Also export the tables in these comma-separated formats, out "
+        "of {}.".format(",".join(EXPORT_FORMATS)),
     )
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        help="Directory for the parsed ledger cache.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always parse the ledger from scratch.",
+    )
+    parser.add_argument(
+        "--no-snapshots",
+        action="store_true",
+        help="Recompute every month instead of reusing unchanged ones.",
+    )
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Keep only a compact store of the postings after loading, and "
+        "free the entries. Snapshots are not used.",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and re-render whenever the ledger or config change.",
+    )
+    parser.add_argument(
+        "--interval",
+        action="store",
+        type=float,
+        default=0.5,
+        help="Polling interval in seconds for --watch, when file change "
+        "notifications are unavailable.",
+    )
+    add_profile_arguments(parser)
 
     args = parser.parse_args()
     if args.verbose:
@@ -84,68 +213,339 @@ def main():
         logging.getLogger("matplotlib.font_manager").disabled = True
 
     # TODO:make this configurable
-    decimal_precison = "0.00"
-    Q = Decimal(decimal_precison)
+    Q = Decimal(DECIMAL_PRECISION)
+
+    def load() -> Ledger:
+        logging.info("Reading ledger: %s", args.ledger)
+        with stage("load"):
+            return load_ledger(args.ledger, args.cache_dir, not args.no_cache)
+
+    def render(ledger: Ledger):
+        entries, _, options_map = ledger
+        configs = [] if args.pdf else [read_config(args.config)]
+        report_ledger = prepare_ledger(
+            entries, options_map, args.compact, configs
+        )
+        # Let the entries be freed if they were compacted.
+        del ledger, entries
+        run_report(
+            report_ledger,
+            args.config,
+            args.output,
+            args.start_date,
+            args.end_date,
+            Q,
+            use_snapshots=not args.no_snapshots,
+            chart=not args.no_chart,
+            pdf=args.pdf,
+            page_rows=args.page_rows,
+            export_formats=args.export,
+            granularity=args.granularity,
+            depth=args.depth,
+        )
 
-    # Load the example file.
-    logging.info("Reading ledger: %s", args.ledger)
-    entries, _, options_map = loader.load_file(args.ledger)
-    # accounts = getters.get_accounts(entries)
-    dcontext = options_map["dcontext"]
-    acctypes = options.get_account_types(options_map)
-    price_map = prices.build_price_map(entries)
+    with profiled(args):
+        if args.watch:
+            run_watch(args.ledger, load, render, args.interval, [args.config])
+        else:
+            render(load())
 
-    # Figure out start and end date.
-    start_date = args.start_date or entries[0].date
-    end_date = args.end_date or datetime.date.today()
 
-    # Load, filter and expand the configuration.
-    config = read_config(args.config)
-    os.makedirs(args.output, exist_ok=True)
-    with open(path.join(args.output, "config.pbtxt"), "w") as efile:
+def prepare_ledger(
+    entries: data.Entries,
+    options_map: Dict[str, Any],
+    compact: bool = False,
+    configs: Sequence[IncomeExpenseConfig] = (),
+) -> ReportLedger:
+    """Build the price map and indexes shared by all reports on a ledger.
+
+    If `compact` is true, the transactions are extracted to a posting store
+    and the returned ledger does not reference the entries, so that they can
+    be freed. The prefix sums of the trend tables of `configs` are built up
+    front, e.g. before the ledger is shared with worker processes.
+    """
+    # accounts = getters.get_accounts(entries)
+    with stage("price_map"):
+        price_map = prices.build_price_map(entries)
+    with stage("index"):
+        if compact:
+            txn_index = account_index = PostingStore.from_entries(entries)
+            logging.info(
+                "Compacted %d postings into %d bytes",
+                len(txn_index),
+                txn_index.nbytes,
+            )
+        else:
+            txn_index = DateIndex(list(data.filter_txns(entries)))
+            account_index = AccountIndex(txn_index.entries)
+    ledger = ReportLedger(
+        [] if compact else entries,
+        options_map,
+        options.get_account_types(options_map),
+        price_map,
+        txn_index,
+        account_index,
+        entries[0].date,
+        {},
+    )
+    for config in configs:
+        range_index(ledger, config)
+    return ledger
+
+
+def range_index(
+    ledger: ReportLedger, config: IncomeExpenseConfig
+) -> RangeIndex:
+    """Return the prefix sums of the budget transactions of a ledger, built
+    once per set of budget accounts and kept with the ledger."""
+    key = tuple(config.budget_accounts)
+    index = ledger.range_indexes.get(key)
+    if index is None:
+        with stage("prune"):
+            txns = prune_non_budget_transactions(ledger.account_index, config)
+        with stage("index"):
+            if not isinstance(txns, PostingStore):
+                txns = PostingStore.from_entries(txns)
+            index = ledger.range_indexes[key] = RangeIndex(txns)
+    return index
+
+
+def run_report(
+    ledger: ReportLedger,
+    config_filename: str,
+    output: str,
+    start_date: Optional[Date],
+    end_date: Optional[Date],
+    Q: Decimal,
+    use_snapshots: bool = True,
+    chart: bool = True,
+    charts: Optional[List[ChartJob]] = None,
+    pdf: bool = False,
+    page_rows: Optional[int] = None,
+    export_formats: Sequence[str] = (),
+    granularity: str = "month",
+    depth: Optional[int] = None,
+):
+    """Compute and write a single income vs expenses report.
+
+    Unless `use_snapshots` is false, the monthly values are frozen in a
+    snapshot store in the output directory, and only the months whose inputs
+    changed are recomputed on later runs. Unless `chart` is false, the page
+    includes a chart of the monthly totals, which is deferred to `charts` if
+    given (see `write_html`). If `pdf` is true, the report is written as a
+    PDF instead of HTML, otherwise tables longer than `page_rows` are split
+    in pages, and followed by the trend tables of `compute_trends`. The
+    computed tables are also exported in `export_formats`, as files named
+    after their account type and granularity.
+
+    The tables have a column per period of `granularity`, a key of
+    `olap_cube.LEVELS`, and a row per account, rolled up to its ancestor with
+    `depth` components if given.
+    """
+    config = read_config(config_filename)
+    os.makedirs(output, exist_ok=True)
+    with open(path.join(output, "config.pbtxt"), "w") as efile:
         print(config, file=efile)
+    # Posting stores are aggregated as a whole, without snapshots.
+    if isinstance(ledger.account_index, PostingStore):
+        use_snapshots = False
+    snapshots = SnapshotStore.in_dir(output) if use_snapshots else None
+
+    report = compute_report(
+        ledger,
+        config,
+        start_date,
+        end_date,
+        Q,
+        snapshots,
+        (granularity,),
+        depth,
+        trends=not pdf,
+    )
+    if snapshots is not None:
+        snapshots.save()
+        snapshots.log_stats()
+    with stage("export"):
+        for (acctype, table_granularity), table in report.tables.items():
+            basename = "{}-{}".format(acctype.lower(), table_granularity)
+            export_table(path.join(output, basename), table, export_formats)
+    title = "Income vs Expenses"
+    income_table = report.tables[(ledger.acctypes.income, granularity)]
+    expense_table = report.tables[(ledger.acctypes.expenses, granularity)]
+    if pdf:
+        write_pdf(
+            output,
+            title,
+            report.start_date,
+            report.end_date,
+            income_table,
+            expense_table,
+            charts,
+        )
+    else:
+        write_html(
+            output,
+            title,
+            report.start_date,
+            report.end_date,
+            income_table,
+            expense_table,
+            chart,
+            charts,
+            page_rows,
+            report.trends,
+        )
+
 
-    pruned_entries: List[data.Transaction] = data.filter_txns(entries)
-    pruned_entries = prune_date_range(pruned_entries, start_date, end_date)
-    pruned_entries = prune_non_budget_transactions(pruned_entries, config)
+def compute_report(
+    ledger: ReportLedger,
+    config: IncomeExpenseConfig,
+    start_date: Optional[Date],
+    end_date: Optional[Date],
+    Q: Decimal,
+    snapshots: Optional[SnapshotStore] = None,
+    granularities: Tuple[str, ...] = ("month",),
+    depth: Optional[int] = None,
+    trends: bool = True,
+) -> Report:
+    """Compute the income and expense tables of a report, and its trend
+    tables unless `trends` is false."""
+    acctypes = ledger.acctypes
+    converter = PriceConverter(ledger.price_map)
 
-    income_table = compute_monthly_income(
-        pruned_entries, acctypes, price_map, Q
+    # Figure out start and end date.
+    start_date = start_date or ledger.first_date
+    end_date = end_date or datetime.date.today()
+
+    with stage("prune"):
+        span = ledger.txn_index.span(start_date, end_date)
+        pruned_entries = prune_non_budget_transactions(
+            ledger.account_index, config, span
+        )
+
+    tables = compute_tables(
+        pruned_entries,
+        acctypes,
+        ledger.price_map,
+        Q,
+        [acctypes.income, acctypes.expenses],
+        granularities,
+        mapper=AccountMapper.from_config(config, MAPS),
+        converter=converter,
+        snapshots=snapshots,
+        depth=depth,
     )
-    expense_table = compute_monthly_expenses(
-        pruned_entries, acctypes, price_map, Q
+    trend_tables: List[Tuple[str, Table]] = []
+    if trends:
+        trend_tables = compute_trends(ledger, config, end_date, Q)
+    converter.log_stats()
+    return Report(start_date, end_date, tables, trend_tables)
+
+
+def compute_trends(
+    ledger: ReportLedger,
+    config: IncomeExpenseConfig,
+    end_date: Date,
+    Q: Decimal,
+) -> List[Tuple[str, Table]]:
+    """Compute the trailing monthly averages of the income and expenses up
+    to the end of a report, and their change over the last year, with their
+    headings.
+
+    Every cell is a range query on the prefix sums of the budget
+    transactions of `range_index`. Like the tables, only the units in USD
+    are counted, and the signs are flipped as in the summary table, to show
+    inflows as positive numbers. The totals come first, then the accounts of
+    depth TREND_DEPTH.
+    """
+    roots = (ledger.acctypes.income, ledger.acctypes.expenses)
+    next_day = end_date + datetime.timedelta(days=1)
+    index = range_index(ledger, config)
+
+    # The (months, months before the end) of each window, then the previous
+    # and last years.
+    windows = [(months, 0) for months in TRAILING_MONTHS] + [(12, 12), (12, 0)]
+    starts = [
+        months_before(next_day, months + offset) for months, offset in windows
+    ]
+    ends = [
+        months_before(next_day, offset) - datetime.timedelta(days=1)
+        for _, offset in windows
+    ]
+
+    def totals(name: str) -> List[Decimal]:
+        scaled = index.totals(name + SUBTREE_SUFFIX, "USD", starts, ends)
+        return [-to_decimal(total, index.places) for total in scaled]
+
+    with stage("rollup"):
+        income, expenses = (totals(root) for root in roots)
+        rows = [
+            ("Income", income),
+            ("Expense", expenses),
+            ("total", [a + b for a, b in zip(income, expenses)]),
+        ]
+        for name in sorted(index.ids):
+            parent = name[: -len(SUBTREE_SUFFIX)]
+            if (
+                name.endswith(SUBTREE_SUFFIX)
+                and len(account.split(parent)) == TREND_DEPTH
+                and account.root(1, parent) in roots
+            ):
+                rows.append((parent, totals(parent)))
+
+    averages = Table(
+        ["account"]
+        + ["{} months".format(months) for months in TRAILING_MONTHS],
+        [
+            [label]
+            + [
+                str((total / months).quantize(Q))
+                for total, months in zip(values, TRAILING_MONTHS)
+            ]
+            for label, values in rows
+        ],
     )
-    write_html(
-        args.output,
-        "Income vs Expenses",
-        start_date,
-        end_date,
-        income_table,
-        expense_table,
+    changes = Table(
+        ["account", "previous 12 months", "last 12 months", "change"],
+        [
+            [
+                label,
+                str(previous.quantize(Q)),
+                str(last.quantize(Q)),
+                float(last / previous - 1) if previous else "",
+            ]
+            for label, (*_, previous, last) in rows
+        ],
     )
+    return [
+        ("Trailing monthly averages", averages),
+        ("Year over year", changes),
+    ]
 
 
 def prune_date_range(
-    entries: List[data.Transaction], start: Date, end: Date
+    entries: Union[List[data.Transaction], DateIndex],
+    start: Date,
+    end: Date,
 ) -> List[data.Transaction]:
     """Prune the entriet to contain only those that fall within date range"""
-    return [
-        entry for entry in entries if entry.date >= start and entry.date <= end
-    ]
+    if not isinstance(entries, DateIndex):
+        entries = DateIndex(entries)
+    return entries.slice(start, end)
 
 
 def prune_non_budget_transactions(
-    txns: List[data.Transaction], config: IncomeExpenseConfig
-) -> List[data.Transaction]:
+    txns: Union[List[data.Transaction], AccountIndex, PostingStore],
+    config: IncomeExpenseConfig,
+    span: Optional[Span] = None,
+) -> Union[List[data.Transaction], PostingStore]:
     """Prune the entriet to contain only those that include an account from
-    the budget accounts"""
-    accounts = set()
-    accounts.update(config.budget_accounts)
-    return [
-        txn
-        for txn in txns
-        if any(posting.account in accounts for posting in txn.postings)
-    ]
+    the budget accounts, optionally within a span of the indexed transactions.
+    Budget accounts ending with ":*" include their whole subtree. A posting
+    store is pruned to the postings of these transactions."""
+    if not isinstance(txns, (AccountIndex, PostingStore)):
+        txns = AccountIndex(txns)
+    return txns.select(config.budget_accounts, span)
 
 
 def write_month_file(
@@ -196,122 +596,269 @@ RETURNS_TEMPLATE_POST = """
 </html>
 """
 
-Table = NamedTuple("Table", [("header", List[str]), ("rows", List[List[Any]])])
-
 
 def render_table(
     table: Table, floatfmt: Optional[str] = None, classes: Optional[str] = None
 ) -> str:
     """Render a simple data table to HTML."""
     oss = io.StringIO()
-    fprint = partial(print, file=oss)
-    fprint('<table class="{}">'.format(" ".join(classes or [])))
-    fprint("<tr>")
-    for heading in table.header:
-        fprint("<th>{}</th>".format(heading))
-    fprint("</tr>")
-    for row in table.rows:
-        fprint("<tr>")
-        for value in row:
-            if isinstance(value, float) and floatfmt:
-                value = floatfmt.format(value)
-            fprint("<td>{}</td>".format(value))
-        fprint("</tr>")
-    fprint("</table>")
+    write_table(oss, table.header, table.rows, floatfmt, classes)
     return oss.getvalue()
 
 
+def with_total_row(table: PivotTable, label: str, totals: np.ndarray) -> Table:
+    """Format a pivot table for rendering, with an extra row of totals."""
+    return Table(
+        table.header, table.rows + [[label] + table.format_values(totals)]
+    )
+
+
 def write_html(
     dirname: str,
     title: str,
     start_date: datetime.date,
     end_date: datetime.date,
-    income_table: Table,
-    expense_table: Table,
+    income_table: PivotTable,
+    expense_table: PivotTable,
+    chart: bool = True,
+    charts: Optional[List[ChartJob]] = None,
+    page_rows: Optional[int] = None,
+    sections: Sequence[Tuple[str, Table]] = (),
 ):
+    """Write the page of a report and its chart to a directory.
+
+    If a `charts` list is given, the chart is appended to it to be rendered
+    later along with others, instead of being rendered right away. Tables
+    longer than `page_rows`, if given, are split in pages (see `write_page`).
+    The `sections` tables follow the income and expense tables.
+    """
     logging.info("Writing returns dir for %s: %s", title, dirname)
     os.makedirs(dirname, exist_ok=True)
-    with open(path.join(dirname, "index.html"), "w") as indexfile:
-        fprint = partial(print, file=indexfile)
-        fprint(RETURNS_TEMPLATE_PRE.format(style=STYLE, title=title))
-        fprint("<h2>Income vs Expenses</h2>")
-        plot = plot_inc_vs_expenses(
+    plot = None
+    if chart:
+        job = inc_vs_expenses_chart(
             dirname, start_date, end_date, income_table, expense_table
         )
+        if charts is None:
+            render_charts([job])
+        else:
+            charts.append(job)
+        plot = path.basename(job.filename)
+    with stage("render"):
+        with open(path.join(dirname, "index.html"), "w") as indexfile:
+            write_page(
+                indexfile,
+                title,
+                income_table,
+                expense_table,
+                plot,
+                dirname if page_rows else None,
+                page_rows,
+                sections,
+            )
+
+
+def render_html(
+    title: str,
+    income_table: PivotTable,
+    expense_table: PivotTable,
+    plot: Optional[str],
+    sections: Sequence[Tuple[str, Table]] = (),
+) -> str:
+    """Render the page of a report, showing the chart at URL `plot` if any."""
+    oss = io.StringIO()
+    write_page(
+        oss,
+        title,
+        income_table,
+        expense_table,
+        plot,
+        sections=sections,
+    )
+    return oss.getvalue()
+
+
+def write_page(
+    outfile: IO,
+    title: str,
+    income_table: PivotTable,
+    expense_table: PivotTable,
+    plot: Optional[str],
+    dirname: Optional[str] = None,
+    page_rows: Optional[int] = None,
+    sections: Sequence[Tuple[str, Table]] = (),
+):
+    """Stream the page of a report to a file.
+
+    If `dirname` and `page_rows` are given, only the first `page_rows` rows of
+    each table are on the page, and the next ones on pages of their own in
+    `dirname`, linked from it. The `sections` tables, with their headings, are
+    written whole after the others.
+    """
+    fprint = partial(print, file=outfile)
+    fprint(RETURNS_TEMPLATE_PRE.format(style=STYLE, title=title))
+    fprint("<h2>Income vs Expenses</h2>")
+    if plot:
         fprint('<img src={} style="width: 100%"/>'.format(plot))
 
-        total_income = np.zeros(len(income_table.header[1:]))
-        for account in income_table.rows:
-            index = 0
-            for month in account[1:]:
-                if month != "":
-                    total_income[index] += -float(month)
-                index += 1
-        total_income_row = ["Total"]
-        for item in total_income:
-            total_income_row.append(str(round(item, 2)))
-        income_table.rows.append(total_income_row)
-
-        total_expenses = np.zeros(len(income_table.header[1:]))
-        for account in expense_table.rows:
-            index = 0
-            for month in account[1:]:
-                if month != "":
-                    total_expenses[index] += -float(month)
-                index += 1
-        total_expense_row = ["Total"]
-        for item in total_expenses:
-            total_expense_row.append(str(round(item, 2)))
-        expense_table.rows.append(total_expense_row)
-
-        fprint("<h2>table</h2>")
-        total_income_row[0] = "Income"
-        total_expense_row[0] = "Expense"
-        total_total_row = ["total"]
-        for i in range(len(total_income_row) - 1):
-            total_total_row.append(
-                str(
-                    round(
-                        float(total_income_row[i + 1])
-                        + float(total_expense_row[i + 1]),
-                        2,
+    for heading, table in report_tables(income_table, expense_table):
+        pages = paginate(table.rows, page_rows if dirname else None)
+        fprint("<h2>{}</h2>".format(heading))
+        if len(pages) > 1:
+            filenames = ["index.html"] + [
+                "{}-{}.html".format(heading.lower(), number)
+                for number in range(2, len(pages) + 1)
+            ]
+            for number in range(1, len(pages)):
+                with open(path.join(dirname, filenames[number]), "w") as pfile:
+                    pprint = partial(print, file=pfile)
+                    pprint(
+                        RETURNS_TEMPLATE_PRE.format(
+                            style=STYLE, title="{}: {}".format(title, heading)
+                        )
                     )
-                )
+                    _write_page_links(pfile, filenames, number)
+                    write_table(pfile, table.header, pages[number], "{:.2%}")
+                    pprint(RETURNS_TEMPLATE_POST)
+            _write_page_links(outfile, filenames, 0)
+        fprint("<p>", end=" ")
+        write_table(outfile, table.header, pages[0], "{:.2%}")
+        fprint(" </p>")
+    for heading, table in sections:
+        fprint("<h2>{}</h2>".format(heading))
+        fprint("<p>", end=" ")
+        write_table(outfile, table.header, table.rows, "{:.2%}")
+        fprint(" </p>")
+    fprint(RETURNS_TEMPLATE_POST)
+
+
+def _write_page_links(outfile: IO, filenames: List[str], current: int):
+    links = [
+        "<b>{}</b>".format(number)
+        if number == current + 1
+        else '<a href="{}">{}</a>'.format(filename, number)
+        for number, filename in enumerate(filenames, 1)
+    ]
+    print("<p>Pages: {}</p>".format(" ".join(links)), file=outfile)
+
+
+def report_tables(
+    income_table: PivotTable, expense_table: PivotTable
+) -> List[Tuple[str, Table]]:
+    """Format the summary, income and expense tables of a report, with
+    their headings."""
+    fmt = income_table.format_values
+
+    # The tables hold account balances; flip the sign to show inflows
+    # as positive numbers.
+    total_income = -income_table.column_totals()
+    total_expenses = -expense_table.column_totals()
+    income_table = with_total_row(income_table, "Total", total_income)
+    expense_table = with_total_row(expense_table, "Total", total_expenses)
+
+    summary = Table(
+        expense_table.header,
+        [
+            ["Income"] + fmt(total_income),
+            ["Expense"] + fmt(total_expenses),
+            ["total"] + fmt(total_income + total_expenses),
+        ],
+    )
+    return [
+        ("table", summary),
+        ("Income", income_table),
+        ("Expenses", expense_table),
+    ]
+
+
+def write_pdf(
+    dirname: str,
+    title: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    income_table: PivotTable,
+    expense_table: PivotTable,
+    charts: Optional[List[ChartJob]] = None,
+):
+    """Write a report as a single PDF, deferred to `charts` if given (see
+    `write_html`)."""
+    logging.info("Writing PDF for %s: %s", title, dirname)
+    job = ChartJob(
+        path.join(dirname, "index.pdf"),
+        draw_pdf,
+        (
+            title,
+            start_date,
+            end_date,
+            income_table,
+            expense_table,
+            CHART_STYLE,
+        ),
+    )
+    if charts is None:
+        render_charts([job])
+    else:
+        charts.append(job)
+
+
+def _table_pages(table: Table) -> Iterator[Table]:
+    """Split a table in pages of rows and columns, repeating the first
+    column on every page."""
+    columns = len(table.header) - 1
+    for row in range(0, max(len(table.rows), 1), PDF_ROWS_PER_PAGE):
+        rows = table.rows[row:row + PDF_ROWS_PER_PAGE]
+        for col in range(1, max(columns, 1) + 1, PDF_COLUMNS_PER_PAGE):
+            cols = slice(col, col + PDF_COLUMNS_PER_PAGE)
+            yield Table(
+                table.header[:1] + table.header[cols],
+                [r[:1] + r[cols] for r in rows],
             )
-        fprint(
-            "<p>",
-            render_table(
-                Table(
-                    income_table.header,
-                    [total_income_row, total_expense_row, total_total_row],
-                ),
-                floatfmt="{:.2%}",
-            ),
-            "</p>",
-        )
-        fprint("<h2>Income</h2>")
-        fprint(
-            "<p>",
-            render_table(
-                income_table,
-                floatfmt="{:.2%}",
-            ),
-            "</p>",
-        )
-        fprint("<h2>Expenses</h2>")
-        fprint(
-            "<p>",
-            render_table(
-                expense_table,
-                floatfmt="{:.2%}",
-            ),
-            "</p>",
+
+
+def draw_pdf(
+    outfile: Union[str, IO],
+    title: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    income_table: PivotTable,
+    expense_table: PivotTable,
+    style: str = CHART_STYLE,
+):
+    """Save a report as a multi-page vector PDF: the chart first, then the
+    tables, split in pages."""
+    plt = load_pyplot()
+    from matplotlib.backends.backend_pdf import PdfPages
+
+    plt.style.use(style)
+    with PdfPages(outfile, metadata={"Title": title}) as pdf:
+        fig, ax = plt.subplots(figsize=PDF_PAGE_SIZE)
+        fig.suptitle(title)
+        plot_axes_inc_vs_expenses(
+            ax, start_date, end_date, income_table, expense_table
         )
-        fprint(RETURNS_TEMPLATE_POST)
+        pdf.savefig(fig)
+        plt.close(fig)
+
+        for heading, table in report_tables(income_table, expense_table):
+            for page in _table_pages(table):
+                fig, ax = plt.subplots(figsize=PDF_PAGE_SIZE)
+                fig.suptitle(heading)
+                ax.axis("off")
+                text = [[str(value) for value in row] for row in page.rows]
+                cells = ax.table(
+                    cellText=text or None,
+                    colLabels=page.header,
+                    loc="upper center",
+                )
+                cells.auto_set_font_size(False)
+                cells.set_fontsize(PDF_FONT_SIZE)
+                pdf.savefig(fig)
+                plt.close(fig)
 
 
 def set_axis(ax_, date_min, date_max):
     """Setup X axis for dates."""
+    import matplotlib.dates as mdates
 
     years = mdates.YearLocator()
     years_fmt = mdates.DateFormatter("%Y")
@@ -336,39 +883,73 @@ def plot_inc_vs_expenses(
     dirname: str,
     start_date: datetime.date,
     end_date: datetime.date,
-    income_data: Table,
-    expense_data: Table,
+    income_data: PivotTable,
+    expense_data: PivotTable,
 ) -> str:
-    filename = "inc_exp.svg"
-    filename_path = path.join(dirname, "inc_exp.svg")
+    job = inc_vs_expenses_chart(
+        dirname, start_date, end_date, income_data, expense_data
+    )
+    render_charts([job])
+    return path.basename(job.filename)
+
+
+def inc_vs_expenses_chart(
+    dirname: str,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    income_data: PivotTable,
+    expense_data: PivotTable,
+) -> ChartJob:
+    """Describe the income vs expenses chart of a report directory."""
+    return ChartJob(
+        path.join(dirname, "inc_exp.svg"),
+        draw_inc_vs_expenses,
+        (start_date, end_date, income_data, expense_data, CHART_STYLE),
+    )
+
+
+def draw_inc_vs_expenses(
+    outfile: Union[str, IO],
+    start_date: datetime.date,
+    end_date: datetime.date,
+    income_data: PivotTable,
+    expense_data: PivotTable,
+    style: str = CHART_STYLE,
+):
+    """Save the income vs expenses chart as SVG to a filename or file."""
+    plt = load_pyplot()
+    plt.style.use(style)
     fig, ax = plt.subplots(figsize=[10, 4])
+    plot_axes_inc_vs_expenses(
+        ax, start_date, end_date, income_data, expense_data
+    )
+    fig.savefig(outfile, format="svg")
+    plt.close(fig)
+
+
+def plot_axes_inc_vs_expenses(
+    ax,
+    start_date: datetime.date,
+    end_date: datetime.date,
+    income_data: PivotTable,
+    expense_data: PivotTable,
+):
+    """Draw the income minus expenses of each period and cumulative on axes."""
     ax.set_title("Income vs Expenses")
-    all_months = expense_data.header[1:]
-
-    inc_vs_exp = np.zeros(len(all_months))
-    for account in expense_data[1]:
-        index = 0
-        for month in account[1:]:
-            if month != "":
-                inc_vs_exp[index] += -float(month)
-            index += 1
-    for account in income_data[1]:
-        index = 0
-        for month in account[1:]:
-            if month != "":
-                inc_vs_exp[index] += -float(month)
-            index += 1
+    all_months = expense_data.periods
+
+    totals = income_data.column_totals() + expense_data.column_totals()
+    inc_vs_exp = -income_data.to_float(totals)
 
     # calculate cumulitive total
-    cum_total = float(0.0)
-    cum_total_list = np.zeros(len(all_months))
-    for index in range(len(inc_vs_exp)):
-        cum_total = cum_total + inc_vs_exp[index]
-        cum_total_list[index] = cum_total
+    cum_total_list = np.cumsum(inc_vs_exp)
 
     date_start = start_date if start_date else None
     date_end = end_date if end_date else None
-    dates_all = [datetime.datetime.strptime(x, "%Y-%m") for x in all_months]
+    dates_all = [
+        datetime.datetime.combine(period_start(x), datetime.time())
+        for x in all_months
+    ]
     set_axis(
         ax,
         date_start,
@@ -378,9 +959,6 @@ def plot_inc_vs_expenses(
     ax.axhline(0, color="#000", linewidth=lw)
     ax.bar(dates_all, inc_vs_exp)
     ax.plot(dates_all, cum_total_list)
-    plt.savefig(filename_path)
-    plt.close(fig)
-    return filename
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+"""Bisect-based date index over date-sorted entries.
+
+Beancount returns its entries sorted by date, so the entries of any date range
+are a contiguous span of the list which can be found in O(log n).
+"""
+
+import bisect
+import datetime
+from typing import Generic, Iterator, List, Optional, Sequence, Tuple, TypeVar
+
+Entry = TypeVar("Entry")
+
+# A half-open [start, stop) range of positions in the indexed entries.
+Span = Tuple[int, int]
+
+
+class DateIndex(Generic[Entry]):
+    """Index a list of entries, sorted by date, by their dates."""
+
+    def __init__(self, entries: Sequence[Entry]):
+        self.entries = entries
+        self.dates: List[datetime.date] = [entry.date for entry in entries]
+        assert all(
+            prev <= date for prev, date in zip(self.dates, self.dates[1:])
+        ), "Entries must be sorted by date"
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def span(
+        self,
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+    ) -> Span:
+        """Return the span of the entries between two dates, inclusive."""
+        lo = 0 if start is None else bisect.bisect_left(self.dates, start)
+        hi = (
+            len(self.dates)
+            if end is None
+            else bisect.bisect_right(self.dates, end)
+        )
+        return lo, max(lo, hi)
+
+    def slice(
+        self,
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+    ) -> List[Entry]:
+        """Return the entries between two dates, inclusive."""
+        lo, hi = self.span(start, end)
+        return list(self.entries[lo:hi])
+
+    def iter_span(self, span: Span) -> Iterator[Entry]:
+        """Iterate over a span of the entries without copying them."""
+        return map(self.entries.__getitem__, range(*span))
+
+    def period_spans(self, dates: Sequence[datetime.date]) -> List[Span]:
+        """Split the entries along a sorted grid of dates.
+
+        The span of each grid date holds the entries strictly before it and on
+        or after the previous grid date, i.e., the entries to add to the
+        balance at the previous date to get the balance at this one.
+        """
+        spans = []
+        lo = 0
+        for date in dates:
+            hi = max(lo, bisect.bisect_left(self.dates, date))
+            spans.append((lo, hi))
+            lo = hi
+        return spans
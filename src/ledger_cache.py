@@ -0,0 +1,175 @@
+"""Persistent on-disk cache for loaded beancount ledgers.
+
+The cache stores the `entries`, `errors` and `options_map` returned by
+`beancount.loader.load_file`, along with a stamp (mtime, size and content
+hash) of every file the ledger included. A cached ledger is reused only if
+every one of those files is unchanged.
+"""
+
+import hashlib
+import logging
+import os
+import pickle
+from os import path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import beancount
+from beancount import loader
+from beancount.core import data
+
+from atomic_file import write_pickle
+
+# Bump this whenever the layout of the pickled payload changes.
+CACHE_VERSION = 1
+
+Ledger = Tuple[data.Entries, List[Any], Dict[str, Any]]
+
+FileStamp = NamedTuple(
+    "FileStamp", [("mtime_ns", int), ("size", int), ("digest", str)]
+)
+
+
+def default_cache_dir() -> str:
+    """Return the per-user directory where ledger caches are stored."""
+    base = os.environ.get("XDG_CACHE_HOME") or path.expanduser("~/.cache")
+    return path.join(base, "beancount_reports")
+
+
+def file_digest(filename: str) -> str:
+    """Return the hex SHA-256 digest of the contents of a file."""
+    hasher = hashlib.sha256()
+    with open(filename, "rb") as infile:
+        for chunk in iter(lambda: infile.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def stamp_file(filename: str) -> FileStamp:
+    """Stamp a file with its modification time, size and content digest."""
+    stat = os.stat(filename)
+    return FileStamp(stat.st_mtime_ns, stat.st_size, file_digest(filename))
+
+
+def is_unchanged(filename: str, stamp: FileStamp) -> bool:
+    """Check a file against its stamp.
+
+    The content digest is only computed if the mtime or size differ, so that
+    a file that was merely touched does not invalidate the cache.
+    """
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return False
+    if stat.st_mtime_ns == stamp.mtime_ns and stat.st_size == stamp.size:
+        return True
+    return stat.st_size == stamp.size and file_digest(filename) == stamp.digest
+
+
+def cache_filename(cache_dir: str, filename: str) -> str:
+    """Compute the cache filename for a top-level ledger filename."""
+    key = "{}\0{}\0{}".format(
+        path.abspath(filename), beancount.__version__, CACHE_VERSION
+    )
+    digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+    return path.join(cache_dir, "ledger-{}.pickle".format(digest))
+
+
+def ledger_files(options_map: Dict[str, Any], filename: str) -> List[str]:
+    """Return the list of all files a loaded ledger was read from."""
+    files = list(options_map.get("include") or [])
+    top = path.abspath(filename)
+    if top not in files:
+        files.insert(0, top)
+    return files
+
+
+def ledger_fingerprint(stamps: Dict[str, FileStamp]) -> str:
+    """Combine the stamps of all ledger files into a single fingerprint."""
+    hasher = hashlib.sha256()
+    for filename, stamp in sorted(stamps.items()):
+        hasher.update(filename.encode("utf-8"))
+        hasher.update(stamp.digest.encode("ascii"))
+    return hasher.hexdigest()
+
+
+def _read_cache(
+    cache_path: str,
+) -> Optional[Tuple[Dict[str, FileStamp], Ledger]]:
+    try:
+        with open(cache_path, "rb") as infile:
+            payload = pickle.load(infile)
+    except FileNotFoundError:
+        return None
+    except Exception as exc:  # pylint: disable=broad-except
+        logging.warning(
+            "Ignoring unreadable ledger cache %s: %s", cache_path, exc
+        )
+        return None
+    if payload.get("version") != CACHE_VERSION:
+        return None
+    return payload["stamps"], payload["ledger"]
+
+
+def _write_cache(
+    cache_path: str,
+    stamps: Dict[str, FileStamp],
+    ledger: Ledger,
+):
+    payload = {"version": CACHE_VERSION, "stamps": stamps, "ledger": ledger}
+    write_pickle(cache_path, payload)
+
+
+def load_ledger(
+    filename: str,
+    cache_dir: Optional[str] = None,
+    use_cache: bool = True,
+) -> Ledger:
+    """Load a ledger, reusing the on-disk cache if none of its files changed.
+
+    Args:
+      filename: The top-level beancount ledger filename.
+      cache_dir: Directory holding the cache files, defaults to
+        `default_cache_dir()`.
+      use_cache: If false, always load from scratch and don't write a cache.
+    Returns:
+      The (entries, errors, options_map) triple from `loader.load_file`.
+    """
+    if not use_cache:
+        return loader.load_file(filename)
+
+    cache_path = cache_filename(cache_dir or default_cache_dir(), filename)
+    cached = _read_cache(cache_path)
+    if cached is not None:
+        stamps, ledger = cached
+        changed = [
+            name
+            for name, stamp in stamps.items()
+            if not is_unchanged(name, stamp)
+        ]
+        if not changed:
+            logging.info("Ledger cache hit: %s", cache_path)
+            return ledger
+        logging.info(
+            "Ledger cache miss: %d changed file(s), e.g. %s",
+            len(changed),
+            changed[0],
+        )
+    else:
+        logging.info("Ledger cache miss: no cache at %s", cache_path)
+
+    ledger = loader.load_file(filename)
+    _, _, options_map = ledger
+    stamps = {}
+    for name in ledger_files(options_map, filename):
+        try:
+            stamps[name] = stamp_file(name)
+        except OSError:
+            # A file that cannot be stamped cannot be validated later, so don't
+            # cache this ledger at all.
+            logging.info("Ledger cache disabled, cannot stamp %s", name)
+            return ledger
+    try:
+        _write_cache(cache_path, stamps, ledger)
+    except (OSError, pickle.PicklingError) as exc:
+        logging.warning("Could not write ledger cache %s: %s", cache_path, exc)
+    return ledger
@@ -6,13 +6,20 @@ __license__ = "GNU GPLv2"
 
 import collections
 import datetime
-import logging
-import re
-from typing import Any, List, NamedTuple, Set, Tuple
+import itertools
+from typing import (Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple,
+                    Union)
 
-from beancount.core import account_types, convert, data, inventory
+import numpy as np
+from beancount.core import account_types, data, inventory
 
-Table = NamedTuple("Table", [("header", List[str]), ("rows", List[List[Any]])])
+from account_mapping import AccountMapper
+from pivot_table import PivotTable
+from olap_cube import LEVELS, Cube, TimeLevel
+from posting_store import PostingStore, date_to_day
+from price_converter import PriceConverter
+from profiling import stage
+from snapshot_store import SnapshotStore, fingerprint
 
 MAPS = [
     # (re.compile("Expenses:Online:Media"), "Expenses:Online:Media"),
@@ -45,125 +52,326 @@ MAPS = [
 ]
 
 
-def compute_monthly_expenses(
-    entries: List[data.Transaction],
+# A period number of a level of `olap_cube.LEVELS`, e.g. the months since
+# 1970-01.
+Period = int
+
+# The inventories of each account type, account and period.
+Balances = Dict[str, Dict[str, Dict[Period, inventory.Inventory]]]
+
+# The section of the snapshot store holding the monthly tables.
+SNAPSHOT_SECTION = "monthly_tables"
+
+# The levels of `olap_cube.LEVELS` which the monthly balances can be folded
+# into. Tables at the other levels are rolled up from a cube instead.
+FOLDED_LEVELS = ("month", "quarter", "year")
+
+
+def compute_tables(
+    entries: Union[List[data.Transaction], PostingStore],
     acctypes,
     price_map,
     Q,
-) -> Table:
+    types: Iterable[str],
+    granularities: Iterable[str] = ("month",),
+    mapper: Optional[AccountMapper] = None,
+    converter: Optional[PriceConverter] = None,
+    snapshots: Optional[SnapshotStore] = None,
+    depth: Optional[int] = None,
+) -> Dict[Tuple[str, str], PivotTable]:
+    """Compute pivot tables for several account types in a single pass.
 
-    # Accumulate expenses for the period.
-    balances = collections.defaultdict(
-        lambda: collections.defaultdict(inventory.Inventory)
+    Args:
+      entries: The transactions to aggregate, or a store of their postings.
+      acctypes: The account types from the options map.
+      price_map: The price map used to convert the balances to USD.
+      Q: The quantization for the table cells.
+      types: The account types to tabulate, e.g. `acctypes.expenses`.
+      granularities: The time levels to tabulate, keys of `olap_cube.LEVELS`.
+      mapper: The account rollups to apply, defaults to `MAPS`.
+      converter: A converter to share conversions with other reports,
+        defaults to a new one over `price_map`.
+      snapshots: A store of frozen months. If given and only the month
+        granularity is requested, only the months whose transactions or
+        prices changed since the last run are aggregated.
+      depth: If given, roll the accounts up to their ancestors with at most
+        this many components.
+    Returns:
+      A dict of (account type, granularity) to its pivot table.
+    """
+    types = set(types)
+    granularities = list(granularities)
+    if mapper is None:
+        mapper = AccountMapper(MAPS)
+    if converter is None:
+        converter = PriceConverter(price_map)
+
+    # Posting stores, and the time levels and depths which the monthly
+    # balances cannot be folded into, are rolled up from a cube.
+    if (
+        isinstance(entries, PostingStore)
+        or depth
+        or not set(granularities) <= set(FOLDED_LEVELS)
+    ):
+        with stage("aggregate"):
+            if not isinstance(entries, PostingStore):
+                entries = PostingStore.from_entries(entries)
+            cube = Cube(entries, types, mapper)
+        with stage("rollup"):
+            return {
+                (acctype, name): cube.table(acctype, name, Q, converter, depth)
+                for name in granularities
+                for acctype in types
+            }
+
+    if snapshots is not None and granularities == ["month"]:
+        sbalances, all_months = _snapshot_month_balances(
+            entries, types, mapper, converter, snapshots
+        )
+        return {
+            (acctype, "month"): _pivot(
+                sbalances[acctype], all_months, LEVELS["month"], Q
+            )
+            for acctype in types
+        }
+
+    with stage("aggregate"):
+        balances, all_months = accumulate_balances(entries, types, mapper)
+
+    # Fold the months into each granularity and pivot.
+    tables = {}
+    with stage("convert"):
+        for name in granularities:
+            level = LEVELS[name]
+            all_periods = set(month_periods(all_months, level).values())
+            for acctype in types:
+                period_balances = fold_periods(balances[acctype], level)
+                tables[(acctype, name)] = _pivot(
+                    reduce_balances(period_balances, level, converter),
+                    all_periods,
+                    level,
+                    Q,
+                )
+    return tables
+
+
+def _month(entry: data.Transaction) -> Period:
+    return (entry.date.year - 1970) * 12 + entry.date.month - 1
+
+
+def month_periods(
+    months: Iterable[Period], level: TimeLevel
+) -> Dict[Period, Period]:
+    """Return the period of a coarser time level of each month."""
+    months = sorted(set(months))
+    month_start = LEVELS["month"].start
+    days = np.array(
+        [date_to_day(month_start(month)) for month in months], dtype=np.int64
     )
-    all_months: Set[Tuple[int, int]] = set()
-    for entry in data.filter_txns(entries):
+    return dict(zip(months, level.period(days).tolist()))
 
-        month: Tuple[int, int] = (entry.date.year, entry.date.month)
-        all_months.add(month)
+
+def _contributing_postings(
+    entries: Iterable[data.Transaction],
+    types: Set[str],
+    mapper: AccountMapper,
+) -> Iterator[Tuple[data.Transaction, str, str, data.Posting]]:
+    """Yield the postings to tabulate, with their account type and mapped
+    account."""
+    type_cache: Dict[str, str] = {}
+    for entry in entries:
         for posting in entry.postings:
-            if (
-                account_types.get_account_type(posting.account)
-                != acctypes.expenses
-            ):
+            account = posting.account
+            acctype = type_cache.get(account)
+            if acctype is None:
+                acctype = type_cache[account] = account_types.get_account_type(
+                    account
+                )
+            if acctype not in types:
                 continue
             if posting.units.currency != "USD":
                 continue
-            account = posting.account
-            for regexp, target_account in MAPS:
-                if regexp.match(account):
-                    account = target_account
-                    break
-            balances[account][month].add_position(posting)
+            yield entry, acctype, mapper(account), posting
 
-    # Reduce the final balances to numbers.
-    sbalances = collections.defaultdict(dict)
-    for account, months in sorted(balances.items()):
-        for month, balance in sorted(months.items()):
-            year, mth = month
-            date = datetime.date(year, mth, 1)
-            balance = balance.reduce(convert.get_value, price_map, date)
-            balance = balance.reduce(
-                convert.convert_position, "USD", price_map, date
-            )
-            try:
-                pos = balance.get_only_position()
-            except AssertionError:
-                print(balance)
-                raise
-            total = pos.units.number if pos and pos.units else None
-            sbalances[account][month] = total
 
-    # Pivot the table.
-    header_months = sorted(all_months)
-    header = ["account"] + ["{}-{:02d}".format(*m) for m in header_months]
-    rows: List[List[str]] = []
-    for account in sorted(sbalances.keys()):
-        row = [account]
-        for month in header_months:
-            total = sbalances[account].get(month, None)
-            row.append(str(total.quantize(Q)) if total else "")
-        rows.append(row)
-    return Table(header, rows)
+def accumulate_balances(
+    entries: Iterable[data.Transaction],
+    types: Set[str],
+    mapper: AccountMapper,
+) -> Tuple[Balances, Set[Period]]:
+    """Accumulate the balances of every requested account type per month."""
+    balances: Balances = {
+        acctype: collections.defaultdict(
+            lambda: collections.defaultdict(inventory.Inventory)
+        )
+        for acctype in types
+    }
+    entries = list(data.filter_txns(entries))
+    all_months: Set[Period] = {_month(entry) for entry in entries}
+    for entry, acctype, account, posting in _contributing_postings(
+        entries, types, mapper
+    ):
+        balances[acctype][account][_month(entry)].add_position(posting)
+    return balances, all_months
 
 
-def compute_monthly_income(
+def _month_fingerprint(
     entries: List[data.Transaction],
-    acctypes,
-    price_map,
-    Q,
-) -> Table:
+    types: Set[str],
+    mapper: AccountMapper,
+    converter: PriceConverter,
+    date: datetime.date,
+) -> str:
+    """Fingerprint the inputs of the tables of one month: the tabulated
+    postings, their mapped accounts and the rates used to convert them."""
+    parts: List[Any] = [sorted(types)]
+    for _, acctype, account, posting in _contributing_postings(
+        entries, types, mapper
+    ):
+        rates = ()
+        if posting.cost is not None:
+            currency = posting.cost.currency
+            rates = (
+                converter.get_rate(posting.units.currency, currency, date),
+                converter.get_rate(currency, "USD", date),
+            )
+        parts.append((acctype, account, posting.units, posting.cost, rates))
+    return fingerprint(parts)
 
-    # Accumulate income for the period.
-    balances = collections.defaultdict(
+
+def _snapshot_month_balances(
+    entries: List[data.Transaction],
+    types: Set[str],
+    mapper: AccountMapper,
+    converter: PriceConverter,
+    snapshots: SnapshotStore,
+) -> Tuple[Dict[str, Dict[str, Dict[Period, Any]]], Set[Period]]:
+    """Reduce the monthly balances, reusing the snapshots of the months whose
+    fingerprint is unchanged."""
+    level = LEVELS["month"]
+    sbalances = {acctype: collections.defaultdict(dict) for acctype in types}
+    all_months: Set[Period] = set()
+    stale: Dict[Period, Tuple[str, List[data.Transaction]]] = {}
+    with stage("snapshot"):
+        for month, month_entries in itertools.groupby(
+            data.filter_txns(entries), key=_month
+        ):
+            month_entries = list(month_entries)
+            all_months.add(month)
+            digest = _month_fingerprint(
+                month_entries,
+                types,
+                mapper,
+                converter,
+                level.start(month),
+            )
+            values = snapshots.get(SNAPSHOT_SECTION, month, digest)
+            if values is None:
+                stale[month] = (digest, month_entries)
+                continue
+            for acctype, accounts in values.items():
+                for account, total in accounts.items():
+                    sbalances[acctype][account][month] = total
+
+    if stale:
+        stale_entries = [
+            entry
+            for _, month_entries in stale.values()
+            for entry in month_entries
+        ]
+        with stage("aggregate"):
+            balances, _ = accumulate_balances(stale_entries, types, mapper)
+        with stage("convert"):
+            for acctype in types:
+                reduced = reduce_balances(balances[acctype], level, converter)
+                for account, months in reduced.items():
+                    sbalances[acctype][account].update(months)
+        for month, (digest, _) in stale.items():
+            values = {
+                acctype: {
+                    account: months[month]
+                    for account, months in sbalances[acctype].items()
+                    if month in months
+                }
+                for acctype in types
+            }
+            snapshots.put(SNAPSHOT_SECTION, month, digest, values)
+    return sbalances, all_months
+
+
+def fold_periods(
+    balances: Dict[str, Dict[Period, inventory.Inventory]],
+    level: TimeLevel,
+) -> Dict[str, Dict[Period, inventory.Inventory]]:
+    """Merge the monthly inventories of each account into the periods of a
+    coarser time level."""
+    periods = month_periods(
+        (month for months in balances.values() for month in months), level
+    )
+    folded = collections.defaultdict(
         lambda: collections.defaultdict(inventory.Inventory)
     )
-    all_months = set()
-    for entry in data.filter_txns(entries):
+    for account, months in balances.items():
+        for month, balance in months.items():
+            folded[account][periods[month]].add_inventory(balance)
+    return folded
 
-        month = (entry.date.year, entry.date.month)
-        all_months.add(month)
-        for posting in entry.postings:
-            if (
-                account_types.get_account_type(posting.account)
-                != acctypes.income
-            ):
-                continue
-            if posting.units.currency != "USD":
-                continue
-            account = posting.account
-            for regexp, target_account in MAPS:
-                if regexp.match(account):
-                    account = target_account
-                    break
-            balances[account][month].add_position(posting)
 
-    # Reduce the final balances to numbers.
+def reduce_balances(
+    balances: Dict[str, Dict[Period, inventory.Inventory]],
+    level: TimeLevel,
+    converter: PriceConverter,
+) -> Dict[str, Dict[Period, Any]]:
+    """Reduce the balances to their USD numbers at the start of their
+    periods."""
     sbalances = collections.defaultdict(dict)
-    for account, months in sorted(balances.items()):
-        for month, balance in sorted(months.items()):
-            year, mth = month
-            date = datetime.date(year, mth, 1)
-            balance = balance.reduce(convert.get_value, price_map, date)
-            balance = balance.reduce(
-                convert.convert_position, "USD", price_map, date
-            )
+    for account, periods in sorted(balances.items()):
+        for period, balance in sorted(periods.items()):
+            date = level.start(period)
+            balance = converter.convert_inventory(balance, "USD", date)
             try:
                 pos = balance.get_only_position()
             except AssertionError:
                 print(balance)
                 raise
             total = pos.units.number if pos and pos.units else None
-            sbalances[account][month] = total
-
-    # Pivot the table.
-    header_months = sorted(all_months)
-    header = ["account"] + ["{}-{:02d}".format(*m) for m in header_months]
-    rows: List[List[str]] = []
-    for account in sorted(sbalances.keys()):
-        row = [account]
-        for month in header_months:
-            total = sbalances[account].get(month, None)
-            row.append(str(total.quantize(Q)) if total else "")
-        rows.append(row)
-    return Table(header, rows)
+            sbalances[account][period] = total
+    return sbalances
+
+
+def _pivot(
+    sbalances: Dict[str, Dict[Period, Any]],
+    all_periods: Set[Period],
+    level: TimeLevel,
+    Q,
+) -> PivotTable:
+    """Pivot the table."""
+    header_periods = sorted(all_periods)
+    return PivotTable.from_balances(
+        sbalances,
+        header_periods,
+        [level.label(p) for p in header_periods],
+        Q,
+    )
+
+
+def compute_monthly_expenses(
+    entries: List[data.Transaction],
+    acctypes,
+    price_map,
+    Q,
+) -> PivotTable:
+    types = [acctypes.expenses]
+    tables = compute_tables(entries, acctypes, price_map, Q, types)
+    return tables[(acctypes.expenses, "month")]
+
+
+def compute_monthly_income(
+    entries: List[data.Transaction],
+    acctypes,
+    price_map,
+    Q,
+) -> PivotTable:
+    types = [acctypes.income]
+    tables = compute_tables(entries, acctypes, price_map, Q, types)
+    return tables[(acctypes.income, "month")]
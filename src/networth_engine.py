@@ -0,0 +1,794 @@
+"""Vectorized net worth over a grid of dates.
+
+Instead of growing a single inventory and reducing it at every date, the
+asset and liability postings are bucketed into cumulative quantity series, one
+per (commodity, cost currency) pair, over the whole date grid. Prices are
+looked up as series over the same grid, so that the net worth in a currency
+is a row-wise dot product of a quantity matrix and a rate matrix. Both hold
+Decimals, so that the values are those of converting an inventory.
+
+The balances at the start of every month can also be kept as checkpoints, so
+that the balances at any dates are those of the nearest earlier checkpoints
+plus the postings since, instead of a replay from the first entry.
+
+Long grids can be computed in a process pool, split into contiguous chunks of
+dates: the postings of the chunks are summed in parallel, each chunk starts
+from the running total of the previous ones, and each chunk is converted to
+each currency in a task of its own.
+"""
+
+import bisect
+import collections
+import datetime
+import itertools
+import logging
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+import numpy as np
+from beancount.core import account_types, data, prices
+from beancount.core.data import Currency
+from beancount.core.number import ONE, ZERO, Decimal
+
+from date_index import DateIndex
+from posting_store import PostingStore, to_decimal
+from profiling import stage
+from snapshot_store import SnapshotStore, fingerprint
+from worker_pool import fork_pool, worker_count, worker_state
+
+# A (commodity, cost currency or None) pair. Positions with the same key are
+# converted at the same rate, so only their total quantity matters.
+Key = Tuple[Currency, Optional[Currency]]
+
+# The prefix of the sections of the snapshot store holding net worths, one per
+# currency.
+SNAPSHOT_SECTION = "net_worth"
+
+# The section of the snapshot store holding the balance checkpoints.
+CHECKPOINT_SECTION = "balance_checkpoints"
+
+# The minimum number of dates per chunk computed in parallel.
+MIN_CHUNK_DATES = 256
+
+
+def projection_paths(
+    price_map: prices.PriceMap,
+    currencies: Set[Currency],
+    target_currency: Currency,
+) -> Dict[Currency, List[Currency]]:
+    """Find through which currencies each currency can be projected.
+
+    For example, TWD has prices in USD, but we want to convert to CAD. Its
+    TWD/USD prices can be "projected" to TWD/CAD via the USD/CAD prices, see
+    `prices.project()`, so the path of TWD to CAD goes through USD.
+
+    Args:
+      price_map: The original price map to probe.
+      currencies: The currencies you'd like to eventually convert.
+      target_currency: The currency to which you'd like to convert them.
+    Returns:
+      A dict of each currency which can be projected to the sorted list of its
+      intermediate currencies.
+    """
+    # Get a dictionary of which currency is priced in which other. This works
+    # because price maps are symmetrical.
+    priced_currencies = collections.defaultdict(set)
+    for base, quote in price_map.keys():
+        priced_currencies[base].add(quote)
+    available_currencies = priced_currencies[target_currency]
+
+    paths = {}
+    for currency in currencies:
+        if currency == target_currency:
+            continue
+        inter_currencies = priced_currencies[currency] & available_currencies
+        if inter_currencies:
+            paths[currency] = sorted(inter_currencies)
+    return paths
+
+
+def project_paths(
+    price_map: prices.PriceMap,
+    paths: Dict[Currency, List[Currency]],
+    target_currency: Currency,
+) -> prices.PriceMap:
+    """Apply `prices.project()` along projection paths, once per intermediate
+    currency. The original price map is kept intact."""
+    commodities = collections.defaultdict(set)
+    for currency, inter_currencies in paths.items():
+        for inter_currency in inter_currencies:
+            commodities[inter_currency].add(currency)
+
+    proj_price_map = price_map
+    for inter_currency, currencies in sorted(commodities.items()):
+        proj_price_map = prices.project(
+            proj_price_map, inter_currency, target_currency, currencies
+        )
+    return proj_price_map
+
+
+class NetWorthEngine:
+    """Net worth of the assets and liabilities of a ledger over a date grid.
+
+    As with replaying the entries into an inventory, the balance at a date
+    includes all the entries strictly before that date. The postings may also
+    come from a posting store instead of the entries. Given checkpoints of the
+    entries, only the postings since the nearest earlier checkpoint of each
+    date are replayed.
+    """
+
+    def __init__(
+        self,
+        entries: Union[data.Entries, PostingStore],
+        acctypes,
+        price_map: prices.PriceMap,
+        dates: Sequence[datetime.date],
+        checkpoints: Optional["BalanceCheckpoints"] = None,
+    ):
+        self._set_grid(price_map, dates)
+        with stage("aggregate"):
+            self.keys, self.quantities = self._build_quantities(
+                entries, acctypes, checkpoints
+            )
+
+    @classmethod
+    def from_quantities(
+        cls,
+        price_map: prices.PriceMap,
+        dates: Sequence[datetime.date],
+        keys: List[Key],
+        quantities: np.ndarray,
+    ) -> "NetWorthEngine":
+        """Create an engine over already bucketed quantities."""
+        engine = cls.__new__(cls)
+        engine._set_grid(price_map, dates)
+        engine.keys, engine.quantities = keys, quantities
+        return engine
+
+    def _set_grid(
+        self, price_map: prices.PriceMap, dates: Sequence[datetime.date]
+    ):
+        self.price_map = price_map
+        self.dates = list(dates)
+        self.grid = np.array(self.dates, dtype="datetime64[D]")
+        self._series: Dict[Tuple[Currency, Currency], np.ndarray] = {}
+
+    def _build_quantities(
+        self,
+        entries: Union[data.Entries, PostingStore],
+        acctypes,
+        checkpoints: Optional["BalanceCheckpoints"] = None,
+    ) -> Tuple[List[Key], np.ndarray]:
+        """Bucket postings into cumulative per-key quantities over the grid,
+        as a Decimal array of shape (dates, keys)."""
+        if isinstance(entries, PostingStore):
+            return self._store_quantities(entries, acctypes)
+        index = DateIndex(list(data.filter_txns(entries)))
+        if checkpoints is not None:
+            return checkpoints.quantities(index, acctypes, self.dates)
+        keys, deltas = _span_deltas(
+            index, acctypes, index.period_spans(self.dates)
+        )
+        return keys, np.cumsum(deltas, axis=0)
+
+    def _store_quantities(
+        self, store: PostingStore, acctypes
+    ) -> Tuple[List[Key], np.ndarray]:
+        """Bucket the postings of a posting store, like `_build_quantities`,
+        summing them as scaled integers."""
+        balance_types = (acctypes.assets, acctypes.liabilities)
+        accounts = np.array(
+            [acctype in balance_types for acctype in store.account_types()],
+            dtype=bool,
+        ).reshape(len(store.accounts))
+        selected = np.flatnonzero(accounts[store.account])
+        rows = self.grid.astype(np.int64).searchsorted(
+            store.day[selected], side="right"
+        )
+        in_grid = rows < len(self.dates)
+        selected, rows = selected[in_grid], rows[in_grid]
+
+        # Number the keys in order of first appearance, as for the entries.
+        width = len(store.commodities) + 1
+        codes = store.currency[selected].astype(np.int64) * width + (
+            store.cost_currency[selected] + 1
+        )
+        codes, first, inverse = np.unique(
+            codes, return_index=True, return_inverse=True
+        )
+        order = np.argsort(first)
+        columns = np.empty(len(codes), dtype=np.int64)
+        columns[order] = np.arange(len(codes))
+        keys = [
+            (
+                store.commodities[code // width],
+                store.commodities[code % width - 1] if code % width else None,
+            )
+            for code in codes[order].tolist()
+        ]
+
+        deltas = np.zeros((len(self.dates), len(keys)), dtype=np.int64)
+        np.add.at(deltas, (rows, columns[inverse]), store.number[selected])
+        unit = to_decimal(1, store.places)
+        return keys, np.cumsum(deltas, axis=0).astype(object) * unit
+
+    def rate_series(
+        self,
+        base: Currency,
+        quote: Currency,
+        price_map: Optional[prices.PriceMap] = None,
+    ) -> np.ndarray:
+        """Return the Decimal rate of `base` in `quote` at each grid date, or
+        None.
+
+        The series are looked up in the original price map, or in `price_map`
+        if given, in which case they aren't remembered.
+        """
+        if base == quote:
+            return np.full(len(self.dates), ONE)
+        if price_map is None:
+            try:
+                return self._series[(base, quote)]
+            except KeyError:
+                pass
+        series = np.full(len(self.dates), None)
+        price_list = (price_map or self.price_map).get((base, quote))
+        if price_list:
+            price_dates = np.array(
+                [date for date, _ in price_list], dtype="datetime64[D]"
+            )
+            rates = np.array([rate for _, rate in price_list], dtype=object)
+            index = np.searchsorted(price_dates, self.grid, side="right") - 1
+            valid = index >= 0
+            series[valid] = rates[index[valid]]
+        if price_map is None:
+            self._series[(base, quote)] = series
+        return series
+
+    def _target_series(self, currency: Currency) -> Dict[Currency, np.ndarray]:
+        """Compute the rate series of every currency to `currency`.
+
+        A currency of the balance at market value (i.e., its commodity, or its
+        cost currency for a commodity priced in it) which has no direct rate
+        at some date is projected through intermediate currencies, as if
+        projecting the prices for each date separately.
+        """
+        nowhere = np.zeros(len(self.dates), dtype=bool)
+        value_currencies: Dict[Currency, np.ndarray] = {}
+        for column, (commodity, cost_currency) in enumerate(self.keys):
+            held = self.quantities[:, column] != 0
+            at_value = nowhere
+            if cost_currency is not None:
+                rates = self.rate_series(commodity, cost_currency)
+                at_value = _known(rates)
+                value_currencies[cost_currency] = (
+                    value_currencies.get(cost_currency, nowhere)
+                    | held & at_value
+                )
+            value_currencies[commodity] = (
+                value_currencies.get(commodity, nowhere) | held & ~at_value
+            )
+
+        currencies = {commodity for commodity, _ in self.keys}
+        currencies.update(cost for _, cost in self.keys if cost is not None)
+        series = {cur: self.rate_series(cur, currency) for cur in currencies}
+
+        # Project the prices once, for the currencies which need it on any
+        # date, and use the projections only on the dates that need them.
+        missing = {
+            cur: held & ~_known(series[cur])
+            for cur, held in value_currencies.items()
+            if (held & ~_known(series[cur])).any()
+        }
+        paths = projection_paths(self.price_map, set(missing), currency)
+        if paths:
+            logging.info("Projecting to %s: %s", currency, paths)
+            proj_price_map = project_paths(self.price_map, paths, currency)
+            for cur in paths:
+                projected = self.rate_series(cur, currency, proj_price_map)
+                series[cur] = np.where(missing[cur], projected, series[cur])
+        return series
+
+    def _key_rates(self, currency: Currency) -> np.ndarray:
+        """Rates of each key to `currency`, as in `convert.convert_position`.
+
+        The direct rate is used if available, else a rate implied through the
+        cost currency. Missing rates are None.
+        """
+        target_series = self._target_series(currency)
+        rates = np.full(self.quantities.shape, None)
+        for column, (commodity, cost_currency) in enumerate(self.keys):
+            rate = target_series[commodity]
+            if cost_currency is not None and cost_currency != currency:
+                to_cost = self.rate_series(commodity, cost_currency)
+                from_cost = target_series[cost_currency]
+                implied = ~_known(rate) & _known(to_cost) & _known(from_cost)
+                rate = rate.copy()
+                rate[implied] = to_cost[implied] * from_cost[implied]
+            rates[:, column] = rate
+        return rates
+
+    def net_worth(
+        self, currency: Currency
+    ) -> List[Tuple[datetime.date, Decimal]]:
+        """Compute the net worth in `currency` at every grid date."""
+        with stage("convert"):
+            return self._net_worth(currency)
+
+    def _net_worth(
+        self, currency: Currency
+    ) -> List[Tuple[datetime.date, Decimal]]:
+        rates = self._key_rates(currency)
+        held = self.quantities != 0
+        missing = held & ~_known(rates)
+        for column in np.flatnonzero(missing.any(axis=0)):
+            rows = np.flatnonzero(missing[:, column])
+            logging.error(
+                "Could not convert %s to %s on %d date(s) from %s to %s",
+                _key_name(self.keys[column]),
+                currency,
+                len(rows),
+                self.dates[rows[0]],
+                self.dates[rows[-1]],
+            )
+
+        # Only the positions held are converted, as in an inventory.
+        converted = held & ~missing
+        values = np.full(self.quantities.shape, ZERO)
+        values[converted] = self.quantities[converted] * rates[converted]
+        return list(zip(self.dates, values.sum(axis=1, initial=ZERO)))
+
+
+class BalanceCheckpoints:
+    """The balances of the assets and liabilities of the entries at the start
+    of every month.
+
+    Attributes:
+      dates: The sorted first days of the months, from the month of the first
+        transaction to the month after the last one.
+      keys: The keys of the balances, in order of first appearance.
+      balances: A Decimal array of shape (dates, keys), the balance of each key
+        strictly before each date.
+    """
+
+    def __init__(
+        self,
+        dates: List[datetime.date],
+        keys: List[Key],
+        balances: np.ndarray,
+    ):
+        self.dates = dates
+        self.keys = keys
+        self.balances = balances
+
+    @classmethod
+    def from_entries(
+        cls,
+        entries: data.Entries,
+        acctypes,
+        frozen: Sequence[Dict[Key, Decimal]] = (),
+    ) -> "BalanceCheckpoints":
+        """Compute the checkpoints of sorted entries, in a single pass.
+
+        The balances of the first checkpoints may be given in `frozen`, as
+        dicts of key to number, in which case only the transactions since the
+        last of them are replayed.
+        """
+        index = DateIndex(list(data.filter_txns(entries)))
+        dates = _checkpoint_dates(index)
+        if not dates:
+            return cls(dates, [], np.full((0, 0), ZERO))
+
+        # Nothing is held before the first checkpoint.
+        frozen = list(frozen) or [{}]
+        start = len(frozen)
+        spans = index.period_spans(dates)[start:]
+        delta_keys, deltas = _span_deltas(index, acctypes, spans)
+        key_index: Dict[Key, int] = {}
+        for key in itertools.chain(*frozen, delta_keys):
+            key_index.setdefault(key, len(key_index))
+
+        balances = np.full((len(dates), len(key_index)), ZERO)
+        for row, balance in enumerate(frozen):
+            for key, number in balance.items():
+                balances[row, key_index[key]] = number
+        if len(dates) > start:
+            running = np.full((len(deltas), len(key_index)), ZERO)
+            running[:, [key_index[key] for key in delta_keys]] = deltas
+            running[0] += balances[start - 1]
+            balances[start:] = np.cumsum(running, axis=0)
+        return cls(dates, list(key_index), balances)
+
+    def quantities(
+        self,
+        index: DateIndex,
+        acctypes,
+        dates: Sequence[datetime.date],
+    ) -> Tuple[List[Key], np.ndarray]:
+        """Return the keys and the balance of each key strictly before each of
+        sorted dates, replaying only the indexed transactions since the
+        nearest earlier checkpoint of each date."""
+        keys = list(self.keys)
+        key_index = {key: column for column, key in enumerate(keys)}
+        rows: List[List[Decimal]] = []
+        balance: List[Decimal] = []
+        checkpoint = start = None
+        for date in dates:
+            row = bisect.bisect_right(self.dates, date) - 1
+            if row != checkpoint:
+                checkpoint = row
+                start = self.dates[row] if row >= 0 else None
+                # Keys seen since the checkpoints were computed start at zero.
+                balance = [ZERO] * len(keys)
+                if row >= 0:
+                    balance[: len(self.keys)] = self.balances[row]
+            # Add the postings from the last date of this checkpoint.
+            span = index.span(start, date - datetime.timedelta(days=1))
+            for key, number in _balance_postings(
+                index.iter_span(span), acctypes
+            ):
+                column = key_index.get(key)
+                if column is None:
+                    column = key_index[key] = len(keys)
+                    keys.append(key)
+                    balance.append(ZERO)
+                balance[column] += number
+            start = date
+            rows.append(list(balance))
+
+        quantities = np.full((len(dates), len(keys)), ZERO)
+        for row, row_balance in enumerate(rows):
+            quantities[row, : len(row_balance)] = row_balance
+        return keys, quantities
+
+
+def load_checkpoints(
+    entries: data.Entries,
+    acctypes,
+    snapshots: Optional[SnapshotStore] = None,
+) -> BalanceCheckpoints:
+    """Return the checkpoints of the entries, reusing those frozen in a
+    snapshot store.
+
+    Each checkpoint is frozen with the fingerprint of the months before it,
+    chained as for the net worths (see `_month_chain`), so that a change to
+    the entries of a month only recomputes the checkpoints after it, starting
+    from the last unchanged one.
+    """
+    frozen: List[Dict[Key, Decimal]] = []
+    digests: List[str] = []
+    if snapshots is not None:
+        with stage("snapshot"):
+            months, month_digests = _month_chain(entries, acctypes)
+            index = DateIndex(list(data.filter_txns(entries)))
+            for row, date in enumerate(_checkpoint_dates(index)):
+                last = date - datetime.timedelta(days=1)
+                digest = _month_digest(
+                    months, month_digests, (last.year, last.month)
+                )
+                digests.append(digest)
+                balance = snapshots.get(CHECKPOINT_SECTION, date, digest)
+                if balance is not None and len(frozen) == row:
+                    frozen.append(balance)
+
+    with stage("aggregate"):
+        checkpoints = BalanceCheckpoints.from_entries(
+            entries,
+            acctypes,
+            frozen,
+        )
+    if snapshots is not None:
+        for row in range(len(frozen), len(checkpoints.dates)):
+            balance = dict(zip(checkpoints.keys, checkpoints.balances[row]))
+            date = checkpoints.dates[row]
+            snapshots.put(CHECKPOINT_SECTION, date, digests[row], balance)
+    return checkpoints
+
+
+def _checkpoint_dates(index: DateIndex) -> List[datetime.date]:
+    """Return the first days of the months from the month of the first indexed
+    transaction to the month after the last one."""
+    dates: List[datetime.date] = []
+    if index.dates:
+        date = index.dates[0].replace(day=1)
+        while not dates or dates[-1] <= index.dates[-1]:
+            dates.append(date)
+            date = (date + datetime.timedelta(days=31)).replace(day=1)
+    return dates
+
+
+def _balance_postings(
+    entries: Iterable[data.Transaction], acctypes
+) -> Iterator[Tuple[Key, Decimal]]:
+    """Yield the key and number of units of the asset and liability postings
+    of transactions."""
+    for entry in entries:
+        for posting in entry.postings:
+            acctype = account_types.get_account_type(posting.account)
+            if acctype not in (acctypes.assets, acctypes.liabilities):
+                continue
+            cost = posting.cost
+            key = (posting.units.currency, cost.currency if cost else None)
+            yield key, posting.units.number
+
+
+def _span_deltas(
+    index: DateIndex, acctypes, spans: Sequence[Tuple[int, int]]
+) -> Tuple[List[Key], np.ndarray]:
+    """Sum the units of the asset and liability postings of each span of the
+    indexed transactions, per key.
+
+    Returns the keys, in order of first appearance, and a Decimal array of
+    shape (spans, keys).
+    """
+    key_index: Dict[Key, int] = {}
+    deltas: Dict[Tuple[int, int], Decimal] = collections.defaultdict(Decimal)
+    for row, span in enumerate(spans):
+        for key, number in _balance_postings(index.iter_span(span), acctypes):
+            column = key_index.setdefault(key, len(key_index))
+            deltas[(row, column)] += number
+    matrix = np.full((len(spans), len(key_index)), ZERO)
+    for (row, column), number in deltas.items():
+        matrix[row, column] += number
+    return list(key_index), matrix
+
+
+def _known(rates: np.ndarray) -> np.ndarray:
+    """Return whether each rate of a Decimal array is available."""
+    return np.not_equal(rates, None)
+
+
+def _key_name(key: Key) -> str:
+    """Format a key as its commodity, followed by its cost currency in
+    braces."""
+    commodity, cost_currency = key
+    return "{} {{{}}}".format(*key) if cost_currency else commodity
+
+
+def _month_chain(
+    entries: data.Entries, acctypes
+) -> Tuple[List[Tuple[int, int]], List[str]]:
+    """Fingerprint the inputs of the net worth up to the end of each month.
+
+    Each month's fingerprint chains the previous one with the asset and
+    liability postings and the prices of the month, so that it changes
+    whenever anything that the net worth within the month depends on changes.
+    Returns the sorted months which have entries and their fingerprints.
+    """
+    months: List[Tuple[int, int]] = []
+    digests: List[str] = []
+    digest = ""
+    for month, month_entries in itertools.groupby(
+        entries, key=lambda entry: (entry.date.year, entry.date.month)
+    ):
+        parts: List[Any] = [digest]
+        for entry in month_entries:
+            if isinstance(entry, data.Price):
+                parts.append((entry.date, entry.currency, entry.amount))
+            elif isinstance(entry, data.Transaction):
+                for posting in entry.postings:
+                    acctype = account_types.get_account_type(posting.account)
+                    if acctype in (acctypes.assets, acctypes.liabilities):
+                        parts.append((entry.date, posting.units, posting.cost))
+        digest = fingerprint(parts)
+        months.append(month)
+        digests.append(digest)
+    return months, digests
+
+
+def _month_digest(
+    months: List[Tuple[int, int]], digests: List[str], month: Tuple[int, int]
+) -> str:
+    """Return the fingerprint of the chain of months up to the end of a month,
+    from the results of `_month_chain`."""
+    index = bisect.bisect_right(months, month)
+    return digests[index - 1] if index else ""
+
+
+def compute_net_worths(
+    entries: Union[data.Entries, PostingStore],
+    acctypes,
+    price_map: prices.PriceMap,
+    dates: Sequence[datetime.date],
+    currencies: Sequence[Currency],
+    snapshots: Optional[SnapshotStore] = None,
+    checkpoints: Optional[BalanceCheckpoints] = None,
+    max_workers: Optional[int] = 1,
+) -> Dict[Currency, List[Tuple[datetime.date, Decimal]]]:
+    """Compute the net worth in each currency at every date.
+
+    If a snapshot store is given, the values of the months whose inputs are
+    unchanged since they were stored are reused, and only the other dates are
+    computed. If checkpoints of the entries are given, the balances start from
+    them. Neither is used with a posting store. Otherwise, with more than one
+    worker process, or None for one per CPU, the dates are computed by
+    `parallel_net_worths`.
+    """
+    if isinstance(entries, PostingStore):
+        snapshots = checkpoints = None
+    if snapshots is None:
+        if checkpoints is None and max_workers != 1:
+            return parallel_net_worths(
+                entries, acctypes, price_map, dates, currencies, max_workers
+            )
+        engine = NetWorthEngine(
+            entries, acctypes, price_map, dates, checkpoints
+        )
+        return {code: engine.net_worth(code) for code in currencies}
+
+    with stage("snapshot"):
+        months, digests = _month_chain(entries, acctypes)
+
+    def month_digest(month: Tuple[int, int]) -> str:
+        return _month_digest(months, digests, month)
+
+    # Reuse the frozen values of the unchanged months.
+    values: Dict[Currency, Dict[datetime.date, Decimal]] = {}
+    frozen: Dict[Tuple[Currency, Tuple[int, int]], Dict] = {}
+    stale: Set[datetime.date] = set()
+    for currency in currencies:
+        section = "{}:{}".format(SNAPSHOT_SECTION, currency)
+        values[currency] = {}
+        for month, month_dates in itertools.groupby(
+            dates, key=lambda date: (date.year, date.month)
+        ):
+            month_values = (
+                snapshots.get(section, month, month_digest(month)) or {}
+            )
+            frozen[(currency, month)] = month_values
+            for date in month_dates:
+                if date in month_values:
+                    values[currency][date] = month_values[date]
+                else:
+                    stale.add(date)
+
+    # Compute the other dates and freeze them with their month.
+    if stale:
+        engine = NetWorthEngine(
+            entries, acctypes, price_map, sorted(stale), checkpoints
+        )
+        for currency in currencies:
+            section = "{}:{}".format(SNAPSHOT_SECTION, currency)
+            computed = collections.defaultdict(dict)
+            for date, value in engine.net_worth(currency):
+                values[currency][date] = value
+                computed[(date.year, date.month)][date] = value
+            for month, month_values in computed.items():
+                month_values.update(frozen[(currency, month)])
+                digest = month_digest(month)
+                snapshots.put(section, month, digest, month_values)
+
+    return {
+        currency: [(date, values[currency][date]) for date in dates]
+        for currency in currencies
+    }
+
+
+def parallel_net_worths(
+    entries: Union[data.Entries, PostingStore],
+    acctypes,
+    price_map: prices.PriceMap,
+    dates: Sequence[datetime.date],
+    currencies: Sequence[Currency],
+    max_workers: Optional[int] = None,
+) -> Dict[Currency, List[Tuple[datetime.date, Decimal]]]:
+    """Compute the net worth in each currency at every date, in a process
+    pool.
+
+    The dates are split into contiguous chunks of at least MIN_CHUNK_DATES.
+    The postings of each chunk are summed in a task of their own, unless they
+    come from a posting store, which is bucketed at once. Each chunk then
+    starts from the running total of the previous ones, and is converted to
+    each currency in a task of its own. The results are the same as those of
+    `NetWorthEngine`, which computes grids of a single task in this process.
+    """
+    dates = list(dates)
+    chunks = max(1, worker_count(max_workers, len(dates) // MIN_CHUNK_DATES))
+    workers = worker_count(max_workers, chunks * len(currencies))
+    if workers <= 1:
+        engine = NetWorthEngine(entries, acctypes, price_map, dates)
+        return {code: engine.net_worth(code) for code in currencies}
+    bounds = [len(dates) * chunk // chunks for chunk in range(chunks + 1)]
+    chunk_dates = [dates[lo:hi] for lo, hi in zip(bounds, bounds[1:])]
+
+    postings: Union[DateIndex, PostingStore] = entries
+    if not isinstance(entries, PostingStore):
+        postings = DateIndex(list(data.filter_txns(entries)))
+
+    # Forked workers inherit the postings instead of unpickling a copy. Their
+    # tasks read the postings, the account types and the price map from their
+    # worker state.
+    state = (postings, acctypes, price_map)
+    with fork_pool(workers, state) as executor:
+        if isinstance(postings, PostingStore):
+            engine = NetWorthEngine(postings, acctypes, price_map, dates)
+            keys = engine.keys
+            quantities = [
+                engine.quantities[lo:hi] for lo, hi in zip(bounds, bounds[1:])
+            ]
+        else:
+            with stage("aggregate"):
+                starts = [None] + [chunk[-1] for chunk in chunk_dates[:-1]]
+                futures = [
+                    executor.submit(_chunk_deltas, start, chunk)
+                    for start, chunk in zip(starts, chunk_dates)
+                ]
+                keys, quantities = _running_totals(
+                    [future.result() for future in futures]
+                )
+
+        with stage("convert"):
+            tasks = {
+                (currency, chunk): executor.submit(
+                    _chunk_net_worth,
+                    chunk_dates[chunk],
+                    keys,
+                    quantities[chunk],
+                    currency,
+                )
+                for currency in currencies
+                for chunk in range(chunks)
+            }
+            return {
+                currency: [
+                    value
+                    for chunk in range(chunks)
+                    for value in tasks[(currency, chunk)].result()
+                ]
+                for currency in currencies
+            }
+
+
+def _chunk_deltas(
+    start: Optional[datetime.date], dates: List[datetime.date]
+) -> Tuple[List[Key], np.ndarray]:
+    """Sum the postings before each date of a chunk and on or after the
+    previous one, starting from the last date of the previous chunk."""
+    index, acctypes, _ = worker_state()
+    if start is None:
+        return _span_deltas(index, acctypes, index.period_spans(dates))
+    spans = index.period_spans([start] + dates)[1:]
+    return _span_deltas(index, acctypes, spans)
+
+
+def _running_totals(
+    chunk_deltas: List[Tuple[List[Key], np.ndarray]],
+) -> Tuple[List[Key], List[np.ndarray]]:
+    """Accumulate the deltas of consecutive chunks into the quantities of
+    each chunk, over the keys of all the chunks in order of first
+    appearance."""
+    key_index: Dict[Key, int] = {}
+    for keys, _ in chunk_deltas:
+        for key in keys:
+            key_index.setdefault(key, len(key_index))
+    balance = np.full(len(key_index), ZERO)
+    quantities = []
+    for keys, deltas in chunk_deltas:
+        running = np.full((len(deltas), len(key_index)), ZERO)
+        running[:, [key_index[key] for key in keys]] = deltas
+        running[0] += balance
+        running = np.cumsum(running, axis=0)
+        balance = running[-1]
+        quantities.append(running)
+    return list(key_index), quantities
+
+
+def _chunk_net_worth(
+    dates: List[datetime.date],
+    keys: List[Key],
+    quantities: np.ndarray,
+    currency: Currency,
+) -> List[Tuple[datetime.date, Decimal]]:
+    _, _, price_map = worker_state()
+    engine = NetWorthEngine.from_quantities(price_map, dates, keys, quantities)
+    return engine.net_worth(currency)
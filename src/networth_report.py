@@ -3,35 +3,37 @@ from: https://github.com/beancount/beanlabs/blob/master/beanlabs/compensation/ne
 """
 
 from beancount.parser import options
-from beancount.core.number import ZERO
-from beancount.core.data import Currency
 from beancount.core import prices
-from beancount.core import inventory
 from beancount.core import data
-from beancount.core import convert
-from beancount.core import account_types
-from beancount import loader
 import numpy
-from matplotlib import pyplot
 __copyright__ = "Copyright (C) 2015-2016  Martin Blais"
 __license__ = "GNU GPLv2"
 
 import argparse
 import logging
-import collections
 import csv
 import datetime
 import logging
 import time
 import pprint
-from typing import Any, List, Set, Tuple
+from typing import Any, List, Tuple
 
 from dateutil import rrule
 from dateutil.parser import parse
-import matplotlib
-matplotlib.use("Qt5Agg")
+from ledger_cache import load_ledger
+from chart_render import ChartJob, render_charts
+from networth_engine import compute_net_worths, load_checkpoints
+from plotting import load_pyplot
+from posting_store import PostingStore
+from profiling import add_profile_arguments, profiled, stage
+from snapshot_store import SnapshotStore
+from table_export import DEFAULT_FORMATS, FORMATS as EXPORT_FORMATS
+from table_export import export_series, parse_formats
+from watch import run_watch
 
 
+PERIODS = ['daily', 'weekly', 'monthly', 'quarterly', 'annually']
+
 EXTRAPOLATE_WORTHS = 1000000, 1500000, 2000000, 2500000, 3000000, 4000000, 5000000, 6000000
 
 
@@ -91,78 +93,6 @@ def extrapolate(
     return lines
 
 
-def project_missing_currencies(price_map: prices.PriceMap,
-                               date: datetime.date,
-                               currencies: Set[Currency],
-                               target_currency: Currency) -> prices.PriceMap:
-    """Project missing currencies to convert `commodities` to `target_currency`.
-    We want to convert `currencies` to the currency `target_currency`, but the
-    price_map may not contain all the necessary prices. For example, TWD has
-    prices in USD, but we want to convert to CAD. TWD being a currency, it
-    doesn't have a cost, so routines that convert from cost (e.g.,
-    convert.get_value()) will not do their job. What we need to do is convert
-    TWD to CAD via USD. The way we do this is by "projecting" the TWD/USD prices
-    to TWD/CAD via USD/CAD. This is done iva prices.project().
-    We don't want to project any more prices than we need to, howerver. This
-    routine is very conservative and automatically finds the subset of
-    commodities which will require projection, and automatically infers through
-    which currencies it has the opportunity to project.
-    Note that this function does not use date/time; if no rates are available to
-    at the date required for conversion, the projection will have no effect.
-    Therefore, projecting in this way does not guarantee that projection will
-    completely success using the returned price map (you should assert). If it
-    fails to do so, the solution is to ensure that the ledger contains all
-    necessary prices.
-    Args:
-      price_map: The original price map to probe.
-      date: The date at which to convert.
-      currencies: The set of currencies you'd like to eventually convert, the
-        subject of conversion.
-      target_currency: The target currency to which you'd like to convert them.
-    Returns:
-      An updated price map containing projections to make this possible.
-    """
-    logging.debug("MISSING %s", currencies)
-
-    # Get a dictionary of which currency is priced in which other.
-    priced_currencies = collections.defaultdict(set)
-    for base, quote in price_map.keys():
-        priced_currencies[base].add(quote)
-
-    # Get a list of the currencies which have prices to the target currency.
-    # This works partly because price maps are symmetrical (e.g., "USD" will
-    # have all the currencies that are converted to it).
-    available_currencies = priced_currencies[target_currency]
-    logging.debug("  AVAIL %s", sorted(available_currencies))
-
-    # For all those remaining commodities, ensure that rates exist to
-    # convert by value to the target currency, by projecting through
-    # an available price conversion.
-    projections = collections.defaultdict(list)
-    for pos_currency in currencies:
-        logging.debug("  POS %s", pos_currency)
-        rate_date, rate = prices.get_price(
-            price_map, (pos_currency, target_currency), date)
-        if rate is None:
-            # Find the available prices for this position.
-            quote_currencies = priced_currencies[pos_currency]
-            inter_currencies = available_currencies & quote_currencies
-            logging.debug("    QUOTE %s %s",
-                          quote_currencies, inter_currencies)
-            for inter_currency in inter_currencies:
-                projections[inter_currency].append(pos_currency)
-
-    logging.debug("  PROJ %s", projections)
-
-    # Apply the projections.
-    proj_price_map = price_map
-    for inter_currency, commodities in projections.items():
-        proj_price_map = prices.project(proj_price_map, inter_currency, target_currency,
-                                        commodities)
-
-    return proj_price_map
-
-
 def main():
     logging.basicConfig(level=logging.INFO,
                         format='%(levelname)-8s: %(message)s')
@@ -181,100 +111,119 @@ def main():
     parser.add_argument('--output-csv', action='store',
                         help="Save the CSV time series to the given file")
 
+    parser.add_argument('--show', action='store_true',
+                        help="Show the graph in a window; by default it is "
+                        "only saved with --output")
+
+    parser.add_argument('--export', action='store',
+                        help="Export the time series of all operating "
+                        "currencies to files with this base name")
+
+    parser.add_argument('--export-formats', action='store', type=parse_formats,
+                        default=DEFAULT_FORMATS,
+                        help="Comma-separated formats for --export, out of "
+                        "{}".format(",".join(EXPORT_FORMATS)))
+
     parser.add_argument('--hide', action='store_true',
                         help="Mask out the vertical axis")
 
-    parser.add_argument('--period', choices=['daily', 'weekly', 'monthly',
-                                             'quarterly', 'annually'],
-                        default='weekly',
+    parser.add_argument('--period', choices=PERIODS, default='weekly',
                         help="Period of aggregation")
 
+    parser.add_argument('--cache-dir', action='store',
+                        help="Directory for the parsed ledger cache")
+
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Always parse the ledger from scratch")
+
+    parser.add_argument('--snapshots', action='store',
+                        help="Reuse and update the net worths of unchanged "
+                        "months in the given snapshot file")
+
+    parser.add_argument('--checkpoints', action='store',
+                        help="Keep the balances at the start of every month "
+                        "in the given file, and reuse those which only "
+                        "depend on unchanged months")
+
+    parser.add_argument('--at', action='append',
+                        type=lambda string: parse(string).date(),
+                        help="Print the net worths at this date instead of "
+                        "over the periods; may be repeated")
+
+    parser.add_argument('--compact', action='store_true',
+                        help="Keep only a compact store of the postings after "
+                        "loading, and free the entries; --snapshots and "
+                        "--checkpoints are not used")
+
+    parser.add_argument('-j', '--workers', action='store', type=int,
+                        default=1,
+                        help="Number of worker processes for the dates and "
+                        "currencies without --snapshots or --checkpoints, or "
+                        "0 for one per CPU. Default is to compute in this "
+                        "process; a pool only pays off on long daily grids")
+
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running and re-render the outputs whenever "
+                        "a file of the ledger changes")
+
+    parser.add_argument('--interval', action='store', type=float, default=0.5,
+                        help="Polling interval in seconds for --watch, when "
+                        "file change notifications are unavailable")
+
+    add_profile_arguments(parser)
+
     parser.add_argument('filename', help='Beancount input filename')
     args = parser.parse_args()
 
-    entries, errors, options_map = loader.load_file(args.filename)
-    acctypes = options.get_account_types(options_map)
-    price_map = prices.build_price_map(entries)
-    operating_currencies = options_map['operating_currency']
-
-    if args.min_date:
-        dtstart = args.min_date
+    show = args.show and not args.watch
+    if show:
+        load_pyplot(interactive=True)
+
+    def load():
+        with stage('load'):
+            return load_ledger(args.filename, args.cache_dir,
+                               not args.no_cache)
+
+    with profiled(args):
+        if args.watch:
+            run_watch(args.filename, load,
+                      lambda ledger: render(ledger, args, show=False),
+                      args.interval)
+        else:
+            render(load(), args, show)
+
+
+def period_dates(entries, min_date, period):
+    """Return the dates at which to compute the net worth."""
+    if min_date:
+        dtstart = min_date
+    elif isinstance(entries, PostingStore):
+        dtstart = entries.first_date()
     else:
         for entry in entries:
             if isinstance(entry, data.Transaction):
                 dtstart = entry.date
                 break
 
-    net_worths_dict = collections.defaultdict(list)
-    index = 0
-
     dtend = datetime.date.today()
     kw = dict(dtstart=dtstart, until=dtend)
-    if args.period == 'daily':
-        period = rrule.rrule(rrule.DAILY, **kw)
-    elif args.period == 'weekly':
-        period = rrule.rrule(rrule.WEEKLY, byweekday=rrule.FR, **kw)
-    elif args.period == 'monthly':
-        period = rrule.rrule(rrule.MONTHLY, bymonthday=1, **kw)
-    elif args.period == 'quarterly':
-        period = rrule.rrule(rrule.MONTHLY, interval=3, bymonthday=1, **kw)
-    elif args.period == 'annually':
-        period = rrule.rrule(rrule.MONTHLY, interval=12, bymonthday=1, **kw)
-
-    balance = inventory.Inventory()
-    for dtime in period:
-        date = dtime.date()
-        logging.info("===== {}".format(date))
-
-        # Append new entries until the given date.
-        new_entries = []
-        while index < len(entries):
-            entry = entries[index]
-            if entry.date >= date:
-                break
-            new_entries.append(entry)
-            index += 1
-
-        # Simple global aggregation of all intervening postings to a single
-        # inventory.
-        for entry in data.filter_txns(new_entries):
-            for posting in entry.postings:
-                acctype = account_types.get_account_type(posting.account)
-                if acctype in (acctypes.assets, acctypes.liabilities):
-                    balance.add_position(posting)
-
-        for i, currency in enumerate(operating_currencies):
-            logging.debug("------------------------- %s", currency)
-
-            # Compute balance at market price values. This will convert all
-            # commodities held at cost to their cost value, and others to the
-            # priced value, if relevant prices exist. Only commodities which
-            # aren't held at cost or which have no price conversion information
-            # providing a conversion currency will remain.
-            value_balance = balance.reduce(convert.get_value, price_map, date)
-            logging.debug("BAL %s", value_balance.to_string())
-
-            # Convert all contents to destination currency.
-            proj_price_map = project_missing_currencies(
-                price_map, date, {pos.units.currency for pos in value_balance}, currency)
-            converted_balance = balance.reduce(convert.convert_position,
-                                               currency, proj_price_map, date)
-
-            # Collect result.
-            per_currency_dict = converted_balance.split()
-            pos = per_currency_dict.pop(currency).get_only_position()
-            assert pos.cost is None
-
-            # If some conversions failed, log an error.
-            if per_currency_dict:
-                logging.error("Could not convert all positions at date %s, to %s: %s",
-                              date, currency, per_currency_dict)
-            net_worths_dict[currency].append((date, pos.units.number))
+    if period == 'daily':
+        rule = rrule.rrule(rrule.DAILY, **kw)
+    elif period == 'weekly':
+        rule = rrule.rrule(rrule.WEEKLY, byweekday=rrule.FR, **kw)
+    elif period == 'monthly':
+        rule = rrule.rrule(rrule.MONTHLY, bymonthday=1, **kw)
+    elif period == 'quarterly':
+        rule = rrule.rrule(rrule.MONTHLY, interval=3, bymonthday=1, **kw)
+    elif period == 'annually':
+        rule = rrule.rrule(rrule.MONTHLY, interval=12, bymonthday=1, **kw)
+    return [dtime.date() for dtime in rule]
 
-    # Extrapolate milestones in various currencies.
-    lines = extrapolate(net_worths_dict, args.days_interp, args.period)
 
-    # Plot each operating currency as a separate curve.
+def plot_net_worths(net_worths_dict, lines, hide=False):
+    """Plot each operating currency as a separate curve, on a new figure."""
+    pyplot = load_pyplot()
+    figure = pyplot.figure()
     for currency, currency_data in net_worths_dict.items():
         dates = [date for date, _ in currency_data]
         values = [float(value) for _, value in currency_data]
@@ -283,25 +232,91 @@ def main():
     pyplot.tight_layout()
     pyplot.title("Net Worth")
     pyplot.legend(loc=2)
-    if args.hide:
+    if hide:
         pyplot.yticks([])
 
     for dates, amounts in lines:
         pyplot.plot(dates, amounts, 'k--')
+    return figure
+
 
-    # Output the CSV file.
-    if args.output_csv:
-        main_currency = operating_currencies[0]
-        time_series = net_worths_dict[main_currency]
-        with open(args.output_csv, "w") as outfile:
-            wr = csv.writer(outfile)
-            wr.writerows(time_series)
+def draw_net_worths(outfile, net_worths_dict, lines, hide=False):
+    """Save the plot of the net worths to a file."""
+    figure = plot_net_worths(net_worths_dict, lines, hide)
+    figure.set_size_inches(11, 8)
+    figure.savefig(outfile, dpi=600)
+    load_pyplot().close(figure)
+
+
+def render(ledger, args, show):
+    """Compute the net worths of a loaded ledger and output them."""
+    entries, errors, options_map = ledger
+    acctypes = options.get_account_types(options_map)
+    with stage('price_map'):
+        price_map = prices.build_price_map(entries)
+    if args.compact:
+        # Keep only the postings, and let the entries be freed.
+        with stage('index'):
+            entries = PostingStore.from_entries(entries)
+        del ledger
+    operating_currencies = options_map['operating_currency']
+
+    # Start from the monthly balances frozen for the unchanged months.
+    checkpoints = None
+    if args.checkpoints and not args.compact:
+        store = SnapshotStore(args.checkpoints)
+        checkpoints = load_checkpoints(entries, acctypes, store)
+        store.save()
+        store.log_stats()
+
+    # Compute the net worth at every period date in each currency.
+    if args.at:
+        dates = sorted(set(args.at))
+    else:
+        dates = period_dates(entries, args.min_date, args.period)
+    snapshots = (SnapshotStore(args.snapshots)
+                 if args.snapshots and not args.compact else None)
+    net_worths_dict = compute_net_worths(entries, acctypes, price_map, dates,
+                                         operating_currencies, snapshots,
+                                         checkpoints, args.workers)
+    if snapshots is not None:
+        snapshots.save()
+        snapshots.log_stats()
+
+    if args.at:
+        for currency, time_series in net_worths_dict.items():
+            for date, value in time_series:
+                print('{} {:.2f} {}'.format(date, value, currency))
+        return
+
+    # Extrapolate milestones in various currencies.
+    lines = extrapolate(net_worths_dict, args.days_interp, args.period)
 
-    # Output the plot.
+    with stage('export'):
+        # Output the CSV file.
+        if args.output_csv:
+            main_currency = operating_currencies[0]
+            time_series = net_worths_dict[main_currency]
+            with open(args.output_csv, "w") as outfile:
+                wr = csv.writer(outfile)
+                wr.writerows(time_series)
+
+        # Export the time series of all the currencies.
+        if args.export:
+            export_series(args.export, net_worths_dict, args.export_formats)
+
+    # Output the plot, skipping it if its data did not change, and only
+    # loading the plotting library if it is needed.
     if args.output:
-        pyplot.savefig(args.output, figsize=(11, 8), dpi=600)
-    logging.info("Showing graph")
-    pyplot.show()
+        render_charts([ChartJob(args.output, draw_net_worths,
+                                (net_worths_dict, lines, args.hide))])
+    if show:
+        with stage('plot'):
+            figure = plot_net_worths(net_worths_dict, lines, args.hide)
+        logging.info("Showing graph")
+        pyplot = load_pyplot()
+        pyplot.show()
+        pyplot.close(figure)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,255 @@
+"""Pre-aggregated cube of amounts by account and day, with rollups.
+
+The cube is built once from a posting store and holds the sum of the units of
+every contributing account on every day with transactions, as scaled
+integers. Tables at any time level, from days to years, and at any depth of
+the account hierarchy are derived from it by vectorized rollups of its rows
+and columns, without another pass over the postings.
+
+Positions held at cost cannot be summed before they are valued, so they are
+kept aside and valued at the start of each period of a table, like the
+inventories of the monthly tables.
+"""
+
+import collections
+import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+
+import numpy as np
+from beancount.core import inventory
+from beancount.core.amount import Amount
+from beancount.core.number import Decimal
+from beancount.core.position import Cost, Position
+
+from account_mapping import AccountMapper
+from pivot_table import PivotTable
+from posting_store import NO_ID, PostingStore, day_to_date, to_decimal
+from price_converter import PriceConverter
+
+# How to bucket days into periods: the period number of each of an array of
+# day numbers, which must not decrease with the days, and the first day and
+# the column label of a period number.
+TimeLevel = NamedTuple(
+    "TimeLevel",
+    [
+        ("period", Callable[[np.ndarray], np.ndarray]),
+        ("start", Callable[[int], datetime.date]),
+        ("label", Callable[[int], str]),
+    ],
+)
+
+
+def _months(days: np.ndarray) -> np.ndarray:
+    """Return the months since 1970-01 of day numbers."""
+    months = days.astype("datetime64[D]").astype("datetime64[M]")
+    return months.astype(np.int64)
+
+
+def _week_label(week: int) -> str:
+    return "{}-W{:02d}".format(*day_to_date(week * 7 - 3).isocalendar()[:2])
+
+
+# Weeks start on Mondays, and 1970-01-01 was a Thursday.
+LEVELS: Dict[str, TimeLevel] = {
+    "day": TimeLevel(
+        lambda days: days.astype(np.int64),
+        day_to_date,
+        lambda day: day_to_date(day).isoformat(),
+    ),
+    "week": TimeLevel(
+        lambda days: (days.astype(np.int64) + 3) // 7,
+        lambda week: day_to_date(week * 7 - 3),
+        _week_label,
+    ),
+    "month": TimeLevel(
+        _months,
+        lambda month: datetime.date(1970 + month // 12, month % 12 + 1, 1),
+        lambda month: "{}-{:02d}".format(1970 + month // 12, month % 12 + 1),
+    ),
+    "quarter": TimeLevel(
+        lambda days: _months(days) // 3,
+        lambda quarter: datetime.date(
+            1970 + quarter // 4, quarter % 4 * 3 + 1, 1
+        ),
+        lambda quarter: "{}-Q{}".format(1970 + quarter // 4, quarter % 4 + 1),
+    ),
+    "year": TimeLevel(
+        lambda days: _months(days) // 12,
+        lambda year: datetime.date(1970 + year, 1, 1),
+        lambda year: "{}".format(1970 + year),
+    ),
+}
+
+
+def period_start(label: str) -> datetime.date:
+    """Return the first day of a period from its label, at any level."""
+    if "-W" in label:
+        return datetime.datetime.strptime(label + "-1", "%G-W%V-%u").date()
+    if "-Q" in label:
+        year, quarter = label.split("-Q")
+        return datetime.date(int(year), int(quarter) * 3 - 2, 1)
+    fields = [int(field) for field in label.split("-")]
+    return datetime.date(*(fields + [1, 1])[:3])
+
+
+def ancestor(account: str, depth: Optional[int]) -> str:
+    """Return the ancestor of an account with at most `depth` components."""
+    if not depth:
+        return account
+    return ":".join(account.split(":")[:depth])
+
+
+class Cube:
+    """Sums of the units of accounts per day.
+
+    Attributes:
+      acctypes: The account type of each row.
+      accounts: The mapped account of each row.
+      days: The sorted day numbers of the columns.
+      values: An int64 array of shape (rows, days), in units of 10**-places.
+      places: The number of decimal places of the stored values.
+      currency: The currency of the units.
+      cost: A store of the postings held at cost, and cost_rows and
+        cost_columns the cell of each.
+    """
+
+    def __init__(
+        self,
+        store: PostingStore,
+        types: Set[str],
+        mapper: AccountMapper,
+        currency: str = "USD",
+    ):
+        acctypes = store.account_types()
+        in_types = np.array(
+            [acctype in types for acctype in acctypes], dtype=bool
+        ).reshape(len(acctypes))
+        selected = np.flatnonzero(
+            in_types[store.account]
+            & (store.currency == store.commodity_id(currency))
+        )
+
+        # A row per account type and mapped account with postings.
+        rows: Dict[Tuple[str, str], int] = {}
+        account_row = np.full(len(store.accounts), NO_ID, dtype=np.int64)
+        for account_id in np.unique(store.account[selected]).tolist():
+            account_row[account_id] = rows.setdefault(
+                (acctypes[account_id], mapper(store.accounts[account_id])),
+                len(rows),
+            )
+        self.acctypes = [acctype for acctype, _ in rows]
+        self.accounts = [account for _, account in rows]
+
+        # A column per day with transactions.
+        self.days, columns = np.unique(store.day, return_inverse=True)
+        row = account_row[store.account[selected]]
+        column = columns.reshape(len(store))[selected]
+        at_cost = store.cost_currency[selected] != NO_ID
+
+        self.values = np.zeros((len(rows), len(self.days)), dtype=np.int64)
+        np.add.at(
+            self.values,
+            (row[~at_cost], column[~at_cost]),
+            store.number[selected[~at_cost]],
+        )
+        self.places = store.places
+        self.currency = currency
+        self.cost = store.take(selected[at_cost])
+        self.cost_rows = row[at_cost]
+        self.cost_columns = column[at_cost]
+
+    def table(
+        self,
+        acctype: str,
+        level: str,
+        Q: Decimal,
+        converter: PriceConverter,
+        depth: Optional[int] = None,
+    ) -> PivotTable:
+        """Roll up the accounts of a type to a depth and the days to a time
+        level, as a table quantized to `Q`."""
+        rows = [
+            row
+            for row, row_type in enumerate(self.acctypes)
+            if row_type == acctype
+        ]
+        names = sorted({ancestor(self.accounts[row], depth) for row in rows})
+        index = {name: position for position, name in enumerate(names)}
+        row_group = np.full(len(self.accounts), NO_ID, dtype=np.int64)
+        for row in rows:
+            row_group[row] = index[ancestor(self.accounts[row], depth)]
+        values = np.zeros((len(names), len(self.days)), dtype=np.int64)
+        np.add.at(values, row_group[rows], self.values[rows])
+
+        time_level = LEVELS[level]
+        day_periods = time_level.period(self.days)
+        changes = day_periods[1:] != day_periods[:-1]
+        starts = np.flatnonzero(
+            np.concatenate([[len(day_periods) > 0], changes])
+        )
+        periods = day_periods[starts]
+        if len(starts):
+            values = np.add.reduceat(values, starts, axis=1)
+
+        places = -Q.as_tuple().exponent
+        mask = values != 0
+        scaled = _rescale(values, self.places, places)
+
+        # Value the positions held at cost with the other units of their cell.
+        cells: Dict[Tuple[int, int], List[int]] = collections.defaultdict(list)
+        groups = row_group[self.cost_rows]
+        columns = periods.searchsorted(day_periods[self.cost_columns])
+        for position, (group, column) in enumerate(
+            zip(groups.tolist(), columns.tolist())
+        ):
+            if group != NO_ID:
+                cells[(group, column)].append(position)
+        for (group, column), positions in cells.items():
+            balance = inventory.Inventory()
+            if values[group, column]:
+                balance.add_amount(
+                    Amount(
+                        to_decimal(values[group, column], self.places),
+                        self.currency,
+                    )
+                )
+            for position in positions:
+                balance.add_position(self._cost_position(position))
+            balance = converter.convert_inventory(
+                balance, self.currency, time_level.start(int(periods[column]))
+            )
+            pos = balance.get_only_position()
+            total = pos.units.number if pos and pos.units else None
+            mask[group, column] = bool(total)
+            scaled[group, column] = (
+                int(total.quantize(Q).scaleb(places)) if total else 0
+            )
+
+        labels = [time_level.label(period) for period in periods.tolist()]
+        return PivotTable(names, labels, scaled, mask, places)
+
+    def _cost_position(self, position: int) -> Position:
+        store = self.cost
+        return Position(
+            Amount(
+                to_decimal(store.number[position], store.places),
+                self.currency,
+            ),
+            Cost(
+                to_decimal(store.cost_number[position], store.cost_places),
+                store.commodities[store.cost_currency[position]],
+                None,
+                None,
+            ),
+        )
+
+
+def _rescale(values: np.ndarray, places: int, to_places: int) -> np.ndarray:
+    """Change the decimal places of scaled integers, rounding half to even
+    like `Decimal.quantize`."""
+    if to_places >= places:
+        return values * 10 ** (to_places - places)
+    unit = 10 ** (places - to_places)
+    quotient, remainder = np.divmod(values, unit)
+    up = (2 * remainder > unit) | (2 * remainder == unit) & (quotient % 2 == 1)
+    return quotient + up
@@ -0,0 +1,117 @@
+"""Columnar account x period pivot table backed by NumPy arrays.
+
+Cells are stored as scaled integers (e.g. cents for a "0.00" quantization)
+along with a mask of the cells that hold a value, and are only formatted to
+strings when rendered.
+"""
+
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+
+class PivotTable:
+    """A table of amounts with one row per account and one column per period.
+
+    Attributes:
+      accounts: The row labels.
+      periods: The column labels.
+      values: An int64 array of shape (accounts, periods), in units of
+        10**-places.
+      mask: A bool array of the same shape, true where a cell has a value.
+      places: The number of decimal places of the stored values.
+    """
+
+    def __init__(
+        self,
+        accounts: List[str],
+        periods: List[str],
+        values: np.ndarray,
+        mask: np.ndarray,
+        places: int,
+    ):
+        self.accounts = accounts
+        self.periods = periods
+        self.values = values
+        self.mask = mask
+        self.places = places
+
+    @classmethod
+    def from_balances(
+        cls,
+        balances: Dict[str, Dict[Any, Optional[Decimal]]],
+        periods: Sequence[Any],
+        labels: Sequence[str],
+        Q: Decimal,
+    ) -> "PivotTable":
+        """Build a table from a dict of account to period to number.
+
+        Args:
+          balances: The numbers per account and period; missing, None and zero
+            numbers are left empty.
+          periods: The period keys, in column order.
+          labels: The column label of each period.
+          Q: The quantization of the cells.
+        """
+        places = -Q.as_tuple().exponent
+        accounts = sorted(balances.keys())
+        columns = {period: index for index, period in enumerate(periods)}
+        values = np.zeros((len(accounts), len(periods)), dtype=np.int64)
+        mask = np.zeros(values.shape, dtype=bool)
+        for row, account in enumerate(accounts):
+            for period, total in balances[account].items():
+                if not total:
+                    continue
+                column = columns[period]
+                values[row, column] = int(total.quantize(Q).scaleb(places))
+                mask[row, column] = True
+        return cls(accounts, list(labels), values, mask, places)
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def row_totals(self) -> np.ndarray:
+        """Return the scaled total of each account."""
+        return self.values.sum(axis=1)
+
+    def column_totals(self) -> np.ndarray:
+        """Return the scaled total of each period."""
+        return self.values.sum(axis=0)
+
+    def grand_total(self) -> int:
+        """Return the scaled total of the whole table."""
+        return int(self.values.sum())
+
+    def cumulative_totals(self) -> np.ndarray:
+        """Return the running scaled total over the periods."""
+        return np.cumsum(self.column_totals())
+
+    def to_float(self, values: np.ndarray) -> np.ndarray:
+        """Unscale an array of values from this table, e.g. for plotting."""
+        return values / float(10**self.places)
+
+    def format_value(self, value: int) -> str:
+        """Format a single scaled value."""
+        return str(Decimal(int(value)).scaleb(-self.places))
+
+    def format_values(self, values: Iterable[int]) -> List[str]:
+        """Format a row of scaled values."""
+        return [self.format_value(value) for value in values]
+
+    @property
+    def header(self) -> List[str]:
+        return ["account"] + self.periods
+
+    @property
+    def rows(self) -> List[List[str]]:
+        """Format the table as rows of strings, with "" for empty cells."""
+        rows = []
+        cells = zip(self.accounts, self.values, self.mask)
+        for account, values, mask in cells:
+            row = [account]
+            for value, present in zip(values.tolist(), mask.tolist()):
+                row.append(self.format_value(value) if present else "")
+            rows.append(row)
+        return rows
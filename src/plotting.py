@@ -0,0 +1,31 @@
+"""Lazy loading of the plotting stack.
+
+Importing matplotlib takes longer than loading a cached ledger, so the report
+modules only import it when they actually draw a chart. Charts are drawn with
+a non-interactive backend, which works without a display, unless a caller asks
+for an interactive one to show them.
+"""
+
+import os
+import sys
+
+HEADLESS_BACKEND = "Agg"
+INTERACTIVE_BACKEND = "Qt5Agg"
+
+
+def load_pyplot(interactive: bool = False):
+    """Import and return pyplot.
+
+    The backend is selected on the first call only, and the MPLBACKEND
+    environment variable takes precedence over it.
+    """
+    if "matplotlib.pyplot" not in sys.modules and not os.environ.get(
+        "MPLBACKEND"
+    ):
+        import matplotlib
+
+        backend = INTERACTIVE_BACKEND if interactive else HEADLESS_BACKEND
+        matplotlib.use(backend)
+    from matplotlib import pyplot
+
+    return pyplot
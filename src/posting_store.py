@@ -0,0 +1,236 @@
+"""Compact columnar store of the postings of a ledger.
+
+The reports only need the date, account, units, cost and price of each
+posting, not the entries with their metadata, tags, links and narrations.
+`PostingStore` extracts these into NumPy arrays: interned account and
+commodity ids, int32 day numbers and int64 scaled-integer amounts, so that the
+entries can be freed once the store and the price map are built.
+"""
+
+import datetime
+import logging
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from beancount.core import account_types, data
+
+from account_index import SUBTREE_SUFFIX
+
+# The id of a missing cost or price currency.
+NO_ID = -1
+
+# The maximum number of decimal places kept for the amounts of a column.
+MAX_PLACES = 9
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+class PostingStore:
+    """The postings of the transactions of a ledger, in date order.
+
+    Attributes:
+      accounts: The account names, by account id.
+      commodities: The commodity names, by commodity id.
+      txn: int32, the number of the transaction of each posting.
+      day: int32, the date of each posting, in days since 1970-01-01.
+      account: int32, the account id of each posting.
+      currency: int32, the commodity id of the units.
+      number: int64, the units, in units of 10**-places.
+      cost_currency: int32, the commodity id of the cost, or NO_ID.
+      cost_number: int64, the cost per unit, in units of 10**-cost_places.
+      price_currency: int32, the commodity id of the price, or NO_ID.
+      price_number: int64, the price per unit, in units of 10**-price_places.
+      places, cost_places, price_places: The decimal places of each amount.
+    """
+
+    COLUMNS = (
+        "txn",
+        "day",
+        "account",
+        "currency",
+        "number",
+        "cost_currency",
+        "cost_number",
+        "price_currency",
+        "price_number",
+    )
+
+    def __init__(
+        self,
+        accounts: List[str],
+        commodities: List[str],
+        columns: Dict[str, np.ndarray],
+        places: Tuple[int, int, int],
+    ):
+        self.accounts = accounts
+        self.commodities = commodities
+        for name in self.COLUMNS:
+            setattr(self, name, columns[name])
+        self.places, self.cost_places, self.price_places = places
+
+    @classmethod
+    def from_entries(cls, entries: data.Entries) -> "PostingStore":
+        """Extract the postings of the transactions of sorted entries."""
+        account_ids: Dict[str, int] = {}
+        commodity_ids: Dict[str, int] = {}
+        lists: Dict[str, List] = {name: [] for name in cls.COLUMNS}
+        epoch = EPOCH.toordinal()
+
+        def commodity_id(currency: str) -> int:
+            return commodity_ids.setdefault(currency, len(commodity_ids))
+
+        for txn, entry in enumerate(data.filter_txns(entries)):
+            day = entry.date.toordinal() - epoch
+            for posting in entry.postings:
+                units, cost, price = posting.units, posting.cost, posting.price
+                lists["txn"].append(txn)
+                lists["day"].append(day)
+                lists["account"].append(
+                    account_ids.setdefault(posting.account, len(account_ids))
+                )
+                lists["currency"].append(commodity_id(units.currency))
+                lists["number"].append(units.number)
+                lists["cost_currency"].append(
+                    commodity_id(cost.currency) if cost else NO_ID
+                )
+                lists["cost_number"].append(cost.number if cost else None)
+                lists["price_currency"].append(
+                    commodity_id(price.currency) if price else NO_ID
+                )
+                lists["price_number"].append(price.number if price else None)
+
+        columns = {}
+        places = []
+        for name in cls.COLUMNS:
+            if name.endswith("number"):
+                column_places = _places(name, lists[name])
+                columns[name] = _scale(lists[name], column_places)
+                places.append(column_places)
+            else:
+                columns[name] = np.array(lists[name], dtype=np.int32)
+        return cls(list(account_ids), list(commodity_ids), columns, places)
+
+    def __len__(self) -> int:
+        return len(self.day)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in self.COLUMNS)
+
+    def take(self, positions: np.ndarray) -> "PostingStore":
+        """Return a store of some of the postings, sharing the names."""
+        return PostingStore(
+            self.accounts,
+            self.commodities,
+            {name: getattr(self, name)[positions] for name in self.COLUMNS},
+            (self.places, self.cost_places, self.price_places),
+        )
+
+    def commodity_id(self, currency: str) -> int:
+        try:
+            return self.commodities.index(currency)
+        except ValueError:
+            return NO_ID
+
+    def first_date(self) -> Optional[datetime.date]:
+        """Return the date of the first transaction, if any."""
+        return day_to_date(self.day[0]) if len(self) else None
+
+    def months(self) -> np.ndarray:
+        """Return the month of each posting, in months since 1970-01."""
+        return (
+            self.day.astype("datetime64[D]")
+            .astype("datetime64[M]")
+            .astype(np.int64)
+        )
+
+    def account_types(self) -> List[str]:
+        """Return the account type of each account id."""
+        return [account_types.get_account_type(name) for name in self.accounts]
+
+    def match_accounts(self, names: Iterable[str]) -> np.ndarray:
+        """Return a mask of the account ids matching any of `names`. Names
+        ending with ":*" select a whole subtree."""
+        exact, prefixes = set(), []
+        for name in names:
+            if name.endswith(SUBTREE_SUFFIX):
+                name = name[: -len(SUBTREE_SUFFIX)]
+                prefixes.append(name + ":")
+            exact.add(name)
+        return np.array(
+            [
+                name in exact or name.startswith(tuple(prefixes))
+                for name in self.accounts
+            ],
+            dtype=bool,
+        ).reshape(len(self.accounts))
+
+    def span(
+        self,
+        start: Optional[datetime.date] = None,
+        end: Optional[datetime.date] = None,
+    ) -> Tuple[int, int]:
+        """Return the span of the postings between two dates, inclusive, like
+        `DateIndex.span`."""
+        lo = 0 if start is None else self.day.searchsorted(date_to_day(start))
+        hi = (
+            len(self)
+            if end is None
+            else self.day.searchsorted(date_to_day(end), side="right")
+        )
+        return int(lo), int(max(lo, hi))
+
+    def select(
+        self,
+        accounts: Sequence[str],
+        span: Optional[Tuple[int, int]] = None,
+    ) -> "PostingStore":
+        """Return all the postings of the transactions which post to any of
+        `accounts`, optionally within a span, like `AccountIndex.select`."""
+        lo, hi = span if span is not None else (0, len(self))
+        txn = self.txn[lo:hi]
+        touching = self.match_accounts(accounts)[self.account[lo:hi]]
+        selected = np.isin(txn, np.unique(txn[touching]))
+        return self.take(lo + np.flatnonzero(selected))
+
+
+def date_to_day(date: datetime.date) -> int:
+    return date.toordinal() - EPOCH.toordinal()
+
+
+def day_to_date(day: int) -> datetime.date:
+    return datetime.date.fromordinal(int(day) + EPOCH.toordinal())
+
+
+def to_decimal(value: int, places: int) -> Decimal:
+    """Unscale a single scaled integer to a decimal."""
+    return Decimal(int(value)).scaleb(-places)
+
+
+def _places(name: str, numbers: List[Optional[Decimal]]) -> int:
+    """Choose the decimal places of a column of numbers, so that they are
+    exact if possible and that sums over the whole column fit in an int64."""
+    exponents = [
+        number.as_tuple().exponent for number in numbers if number is not None
+    ]
+    places = min(max([0] + [-exponent for exponent in exponents]), MAX_PLACES)
+    largest = max((abs(number) for number in numbers if number), default=0)
+    limit = (2**63 - 1) // max(len(numbers), 1)
+    while places > 0 and largest * 10**places > limit:
+        places -= 1
+    if any(-exponent > places for exponent in exponents):
+        logging.warning(
+            "Rounding the posting %ss to %d decimal places", name, places
+        )
+    return places
+
+
+def _scale(numbers: List[Optional[Decimal]], places: int) -> np.ndarray:
+    return np.array(
+        [
+            int(number.scaleb(places).to_integral_value()) if number else 0
+            for number in numbers
+        ],
+        dtype=np.int64,
+    ).reshape(len(numbers))
@@ -0,0 +1,104 @@
+"""Price conversions with a bounded cache of price lookups.
+
+The functions of `beancount.core.convert` look up the price map again for
+every position they convert, even though a report converts the same few
+commodities at the same few dates over and over. `PriceConverter` offers the
+same conversions, with every (base, quote, date) rate looked up only once.
+"""
+
+import functools
+import logging
+from typing import Optional, Sequence
+
+from beancount.core import inventory, prices
+from beancount.core.amount import Amount
+from beancount.core.position import Cost
+
+# The default maximum number of cached (base, quote, date) rates.
+DEFAULT_MAXSIZE = 1 << 16
+
+
+class PriceConverter:
+    """Convert positions and amounts using a price map.
+
+    The conversion methods take the same arguments as their counterparts in
+    `beancount.core.convert`, minus the price map, so that they can be passed
+    to `Inventory.reduce()`, e.g.:
+
+      balance.reduce(converter.convert_position, "USD", date)
+    """
+
+    def __init__(self, price_map: prices.PriceMap, maxsize=DEFAULT_MAXSIZE):
+        self.price_map = price_map
+        self.get_rate = functools.lru_cache(maxsize=maxsize)(self._get_rate)
+
+    def _get_rate(self, base: str, quote: str, date):
+        """Return the rate of `base` in `quote` at `date`, or None."""
+        return prices.get_price(self.price_map, (base, quote), date)[1]
+
+    def cache_info(self):
+        return self.get_rate.cache_info()
+
+    def log_stats(self, name: str = "Price"):
+        info = self.cache_info()
+        logging.info(
+            "%s conversion cache: %d hits, %d misses, %d cached rates",
+            name,
+            info.hits,
+            info.misses,
+            info.currsize,
+        )
+
+    def get_value(self, pos, date=None) -> Amount:
+        """Return the market value of a position, see `convert.get_value`."""
+        units = pos.units
+        value_currency = _value_currency(pos)
+        if isinstance(value_currency, str):
+            rate = self.get_rate(units.currency, value_currency, date)
+            if rate is not None:
+                return Amount(units.number * rate, value_currency)
+        return units
+
+    def convert_position(self, pos, target_currency: str, date=None) -> Amount:
+        """Convert a position to a currency, see `convert.convert_position`."""
+        return self.convert_amount(
+            pos.units, target_currency, date, via=(_value_currency(pos),)
+        )
+
+    def convert_amount(
+        self,
+        amt: Amount,
+        target_currency: str,
+        date=None,
+        via: Optional[Sequence[str]] = None,
+    ) -> Amount:
+        """Convert an amount to a currency, see `convert.convert_amount`."""
+        rate = self.get_rate(amt.currency, target_currency, date)
+        if rate is not None:
+            return Amount(amt.number * rate, target_currency)
+        for implied_currency in via or ():
+            if implied_currency == target_currency:
+                continue
+            rate1 = self.get_rate(amt.currency, implied_currency, date)
+            if rate1 is not None:
+                rate2 = self.get_rate(implied_currency, target_currency, date)
+                if rate2 is not None:
+                    return Amount(amt.number * rate1 * rate2, target_currency)
+        return amt
+
+    def convert_inventory(
+        self, balance: inventory.Inventory, target_currency: str, date=None
+    ) -> inventory.Inventory:
+        """Value an inventory at market and convert it to a currency."""
+        balance = balance.reduce(self.get_value, date)
+        return balance.reduce(self.convert_position, target_currency, date)
+
+
+def _value_currency(pos) -> Optional[str]:
+    """Infer the cost or price currency of a position or posting."""
+    cost = pos.cost
+    return (
+        (isinstance(cost, Cost) and cost.currency)
+        or (getattr(pos, "price", None) and pos.price.currency)
+        or None
+    )
@@ -0,0 +1,293 @@
+"""Timing, memory and profiling instrumentation of the pipeline stages.
+
+The reports mark their stages with `stage(name)`, which does nothing unless a
+profiler is enabled, e.g. with --profile. An enabled profiler records the wall
+time, the CPU time of this process and the peak RSS at the end of every run of
+a stage. It can also record the peak of the memory allocated by Python while a
+stage runs (with tracemalloc) and a cProfile of some of the stages. Stages may
+be nested, in which case the times of the outer stage include those of the
+inner one.
+
+The trace is written as JSON in the Chrome trace event format, which can be
+loaded in chrome://tracing or Perfetto, with a summary per stage.
+"""
+
+import argparse
+import contextlib
+import cProfile
+import json
+import os
+import sys
+import time
+import tracemalloc
+from os import path
+from typing import IO, Any, Dict, Iterator, List, Optional, Sequence
+
+try:
+    import resource
+except ImportError:  # Not on Unix.
+    resource = None
+
+# The stages marked in the reports.
+STAGES = (
+    "load",
+    "price_map",
+    "index",
+    "prune",
+    "snapshot",
+    "aggregate",
+    "convert",
+    "rollup",
+    "render",
+    "plot",
+    "export",
+)
+
+_NULL_STAGE = contextlib.nullcontext()
+
+_profiler: Optional["Profiler"] = None
+
+
+def peak_rss() -> Optional[int]:
+    """Return the peak resident set size of this process so far, in bytes."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class Profiler:
+    """Records the runs of the stages."""
+
+    def __init__(
+        self, memory: bool = False, cprofile_stages: Sequence[str] = ()
+    ):
+        self.memory = memory
+        self.cprofile_stages = set(cprofile_stages)
+        self.profiles: Dict[str, cProfile.Profile] = {}
+        self.events: List[Dict[str, Any]] = []
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        # The peak of traced memory of each running stage, innermost last.
+        self._traced_peaks: List[int] = []
+        self._depth = 0
+        self._cprofiling = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        profile = None
+        if name in self.cprofile_stages and not self._cprofiling:
+            profile = self.profiles.setdefault(name, cProfile.Profile())
+        if self.memory:
+            if self._traced_peaks:
+                _, peak = tracemalloc.get_traced_memory()
+                self._traced_peaks[-1] = max(self._traced_peaks[-1], peak)
+            tracemalloc.reset_peak()
+            self._traced_peaks.append(0)
+
+        depth = self._depth
+        self._depth += 1
+        start_cpu = time.process_time()
+        start = time.perf_counter()
+        if profile is not None:
+            self._cprofiling = True
+            profile.enable()
+        try:
+            yield
+        finally:
+            self._depth -= 1
+            if profile is not None:
+                profile.disable()
+                self._cprofiling = False
+            wall = time.perf_counter() - start
+            cpu = time.process_time() - start_cpu
+            event = {
+                "name": name,
+                "start": start - self.start,
+                "wall": wall,
+                "cpu": cpu,
+                "peak_rss": peak_rss(),
+                "depth": depth,
+            }
+            if self.memory:
+                _, peak = tracemalloc.get_traced_memory()
+                peak = max(self._traced_peaks.pop(), peak)
+                if self._traced_peaks:
+                    self._traced_peaks[-1] = max(self._traced_peaks[-1], peak)
+                event["traced_peak"] = peak
+            self.events.append(event)
+
+    def stop(self):
+        self.end = time.perf_counter()
+        if self.memory:
+            tracemalloc.stop()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        """Aggregate the runs of each stage, in the order of their first
+        run."""
+        stages: Dict[str, Dict[str, Any]] = {}
+        for event in sorted(self.events, key=lambda event: event["start"]):
+            totals = stages.setdefault(
+                event["name"],
+                {
+                    "name": event["name"],
+                    "calls": 0,
+                    "wall": 0.0,
+                    "cpu": 0.0,
+                    "peak_rss": None,
+                    "traced_peak": None,
+                },
+            )
+            totals["calls"] += 1
+            totals["wall"] += event["wall"]
+            totals["cpu"] += event["cpu"]
+            for key in "peak_rss", "traced_peak":
+                if event.get(key) is not None:
+                    totals[key] = max(totals[key] or 0, event[key])
+        return list(stages.values())
+
+    def total_wall(self) -> float:
+        return (self.end or time.perf_counter()) - self.start
+
+    def print_summary(self, outfile: IO = sys.stderr):
+        """Print a table of the totals of each stage."""
+        mega = 1024.0 * 1024.0
+        print(
+            "{:<12} {:>6} {:>9} {:>9} {:>10} {:>11}".format(
+                "stage", "calls", "wall s", "cpu s", "rss MiB", "traced MiB"
+            ),
+            file=outfile,
+        )
+        for totals in self.summary():
+            print(
+                "{:<12} {:>6} {:>9.3f} {:>9.3f} {:>10} {:>11}".format(
+                    totals["name"],
+                    totals["calls"],
+                    totals["wall"],
+                    totals["cpu"],
+                    _format_size(totals["peak_rss"], mega),
+                    _format_size(totals["traced_peak"], mega),
+                ),
+                file=outfile,
+            )
+        print(
+            "{:<12} {:>6} {:>9.3f}".format("total", "", self.total_wall()),
+            file=outfile,
+        )
+
+    def write_trace(self, filename: str) -> List[str]:
+        """Write the JSON trace, and the cProfile of the profiled stages
+        next to it, named <trace>-<stage>.prof. Returns the filenames."""
+        pid = os.getpid()
+        trace = {
+            "command": sys.argv,
+            "total_wall": self.total_wall(),
+            "stages": self.summary(),
+            "traceEvents": [
+                {
+                    "name": event["name"],
+                    "ph": "X",
+                    "ts": event["start"] * 1e6,
+                    "dur": event["wall"] * 1e6,
+                    "pid": pid,
+                    "tid": 0,
+                    "args": {
+                        key: value
+                        for key, value in event.items()
+                        if key not in ("name", "start", "wall")
+                    },
+                }
+                for event in self.events
+            ],
+        }
+        with open(filename, "w") as outfile:
+            json.dump(trace, outfile, indent=1)
+        filenames = [filename]
+        basename = path.splitext(filename)[0]
+        for name, profile in sorted(self.profiles.items()):
+            prof_filename = "{}-{}.prof".format(basename, name)
+            profile.dump_stats(prof_filename)
+            filenames.append(prof_filename)
+        return filenames
+
+
+def _format_size(size: Optional[int], unit: float) -> str:
+    return "-" if size is None else "{:.1f}".format(size / unit)
+
+
+def stage(name: str):
+    """Mark a stage of a report, recorded if a profiler is enabled."""
+    if _profiler is None:
+        return _NULL_STAGE
+    return _profiler.stage(name)
+
+
+def enable(profiler: Profiler):
+    global _profiler  # pylint: disable=global-statement
+    _profiler = profiler
+
+
+def disable():
+    global _profiler  # pylint: disable=global-statement
+    _profiler = None
+
+
+def parse_stages(string: str) -> List[str]:
+    """Parse a comma-separated list of stages, for argparse."""
+    if string == "all":
+        return list(STAGES)
+    stages = [name.strip() for name in string.split(",") if name.strip()]
+    for name in stages:
+        if name not in STAGES:
+            raise argparse.ArgumentTypeError(
+                "unknown stage {!r}, expected all or some of {}".format(
+                    name, ",".join(STAGES)
+                )
+            )
+    return stages
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--profile",
+        action="store",
+        metavar="TRACE",
+        help="Record the time and memory use of each stage, print a summary "
+        "and write a JSON trace to this file.",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="With --profile, also record the peak of the memory allocated "
+        "by each stage, which slows down the run.",
+    )
+    parser.add_argument(
+        "--profile-stages",
+        action="store",
+        type=parse_stages,
+        default=[],
+        help="With --profile, run these comma-separated stages, or all, "
+        "under cProfile and write their profiles next to the trace. Out of "
+        "{}.".format(",".join(STAGES)),
+    )
+
+
+@contextlib.contextmanager
+def profiled(args: argparse.Namespace) -> Iterator[Optional[Profiler]]:
+    """Profile the stages run within the block, as configured by the
+    arguments added by `add_profile_arguments`."""
+    if not args.profile:
+        yield None
+        return
+    profiler = Profiler(args.profile_memory, args.profile_stages)
+    enable(profiler)
+    try:
+        yield profiler
+    finally:
+        disable()
+        profiler.stop()
+        profiler.print_summary()
+        profiler.write_trace(args.profile)
@@ -0,0 +1,553 @@
+"""Serve the reports of a ledger over HTTP, rendering them on demand.
+
+The ledger stays loaded in memory and is reloaded when one of its files
+changes. The pages are:
+
+  /                                   Index of the configured reports.
+  /income?config=NAME&start=&end=     Income vs expenses page and chart.
+  /tables?config=NAME&granularity=    Income and expense tables, by day,
+                                      week, month, quarter or year.
+  /networth?period=&min_date=         Net worth page and chart.
+
+Rendered pages and charts are cached in memory by request and fingerprint of
+the ledger and config files, and by the current date for those which default
+to it, and carry an ETag fingerprinting their body, so reloads and concurrent
+viewers of an unchanged report never render it again.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import hashlib
+import html
+import io
+import logging
+import urllib.parse
+from functools import partial
+from os import path
+from typing import IO, Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from beancount.core.number import Decimal
+
+import networth_report
+from compute_income_vs_expenses import (DECIMAL_PRECISION,
+                                        RETURNS_TEMPLATE_POST,
+                                        RETURNS_TEMPLATE_PRE, STYLE, Report,
+                                        ReportLedger, Table, compute_report,
+                                        draw_inc_vs_expenses, prepare_ledger,
+                                        read_config, render_html, render_table,
+                                        with_total_row)
+from ledger_cache import ledger_files, load_ledger, stamp_file
+from networth_engine import (BalanceCheckpoints, compute_net_worths,
+                             load_checkpoints)
+from olap_cube import LEVELS
+from plotting import load_pyplot
+from snapshot_store import fingerprint
+from watch import FileWatcher
+
+# Maximum number of rendered responses and computed reports kept in memory.
+MAX_CACHED = 256
+
+# Interval between checks for changed ledger or config files, in seconds.
+CHECK_INTERVAL = 1.0
+
+Response = NamedTuple(
+    "Response", [("etag", str), ("content_type", str), ("body", bytes)]
+)
+
+
+class HTTPError(Exception):
+    """An error to report to the client with a status code."""
+
+    def __init__(self, status: int, reason: str):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+
+
+def _parse_date(query: Dict[str, str], name: str) -> Optional[datetime.date]:
+    string = query.get(name)
+    if not string:
+        return None
+    try:
+        return datetime.date.fromisoformat(string)
+    except ValueError:
+        raise HTTPError(400, "Invalid {}: {}".format(name, string))
+
+
+def _etag(body: bytes) -> str:
+    return '"{}"'.format(hashlib.sha256(body).hexdigest()[:32])
+
+
+def _render_html(page: Callable[[], str]) -> Response:
+    body = page().encode("utf-8")
+    return Response(_etag(body), "text/html; charset=utf-8", body)
+
+
+def _render_svg(draw: Callable[[IO], None]) -> Response:
+    oss = io.BytesIO()
+    draw(oss)
+    body = oss.getvalue()
+    return Response(_etag(body), "image/svg+xml", body)
+
+
+def _page(title: str, body: str) -> str:
+    return "".join(
+        [
+            RETURNS_TEMPLATE_PRE.format(style=STYLE, title=html.escape(title)),
+            body,
+            RETURNS_TEMPLATE_POST,
+        ]
+    )
+
+
+class ReportServer:
+    """Render and cache the reports of a resident ledger."""
+
+    def __init__(
+        self,
+        filename: str,
+        configs: List[str],
+        cache_dir: Optional[str] = None,
+        use_cache: bool = True,
+    ):
+        self.filename = filename
+        self.configs = {
+            path.splitext(path.basename(config))[0]: config
+            for config in configs
+        }
+        self.cache_dir = cache_dir
+        self.use_cache = use_cache
+        self.Q = Decimal(DECIMAL_PRECISION)
+        self.ledger: Optional[ReportLedger] = None
+        # The monthly balances of the ledger, computed on first use and
+        # shared by the net worths of all periods.
+        self.checkpoints: Optional[BalanceCheckpoints] = None
+        self.version = ""
+        self.watcher: Optional[FileWatcher] = None
+        self.cache: Dict[Tuple, Any] = collections.OrderedDict()
+        self.pending: Dict[Tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        # A single worker renders everything, since neither pyplot nor the
+        # loader are thread-safe; the event loop keeps serving meanwhile.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+    def _load(self) -> Tuple[ReportLedger, str, FileWatcher]:
+        logging.info("Reading ledger: %s", self.filename)
+        entries, _, options_map = load_ledger(
+            self.filename, self.cache_dir, self.use_cache
+        )
+        filenames = ledger_files(options_map, self.filename) + sorted(
+            self.configs.values()
+        )
+        watcher = FileWatcher(filenames, notify=False)
+        version = fingerprint(
+            [(name, stamp_file(name).digest) for name in filenames]
+        )
+        return prepare_ledger(entries, options_map), version, watcher
+
+    async def load(self):
+        """(Re)load the ledger and fingerprint its files and the configs."""
+        loop = asyncio.get_running_loop()
+        loaded = await loop.run_in_executor(self.executor, self._load)
+        self.ledger, self.version, self.watcher = loaded
+        self.checkpoints = None
+        self.cache.clear()
+
+    async def check_files(self):
+        """Reload the ledger whenever one of the watched files changes."""
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            changed = self.watcher.changed()
+            if changed:
+                logging.info("Changed: %s", ", ".join(changed))
+                try:
+                    await self.load()
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception("Could not reload the ledger")
+
+    async def cached(self, key: Tuple, compute: Callable[[], Any]) -> Any:
+        """Return the cached value of a key, or compute it in the worker.
+
+        Concurrent requests for the same key share a single computation.
+        """
+        key = key + (self.version,)
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return self.cache[key]
+        future = self.pending.get(key)
+        if future is None:
+            self.misses += 1
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, compute)
+            self.pending[key] = future
+            try:
+                value = await future
+            finally:
+                del self.pending[key]
+            self.cache[key] = value
+            while len(self.cache) > MAX_CACHED:
+                self.cache.popitem(last=False)
+            return value
+        return await future
+
+    def _config_name(self, query: Dict[str, str]) -> str:
+        name = query.get("config") or next(iter(self.configs), None)
+        if name not in self.configs:
+            raise HTTPError(404, "Unknown config: {}".format(name))
+        return name
+
+    async def report(
+        self,
+        name: str,
+        start: Optional[datetime.date],
+        end: Optional[datetime.date],
+        granularity: str,
+    ) -> Report:
+        def compute() -> Report:
+            config = read_config(self.configs[name])
+            return compute_report(
+                self.ledger, config, start, end, self.Q, None, (granularity,)
+            )
+
+        return await self.cached(
+            ("report", name, start, end, granularity), compute
+        )
+
+    async def net_worths(
+        self,
+        period: str,
+        min_date: Optional[datetime.date],
+        today: datetime.date,
+    ) -> Tuple[Dict[str, List], List]:
+        """Compute the net worths over the dates of a period up to today, and
+        their extrapolations, which are cached for the given day."""
+
+        def compute():
+            ledger = self.ledger
+            if self.checkpoints is None:
+                self.checkpoints = load_checkpoints(
+                    ledger.entries, ledger.acctypes
+                )
+            dates = networth_report.period_dates(
+                ledger.entries, min_date, period
+            )
+            net_worths_dict = compute_net_worths(
+                ledger.entries,
+                ledger.acctypes,
+                ledger.price_map,
+                dates,
+                ledger.options_map["operating_currency"],
+                checkpoints=self.checkpoints,
+            )
+            lines = networth_report.extrapolate(net_worths_dict, 365, period)
+            return net_worths_dict, lines
+
+        return await self.cached(
+            ("net_worths", period, min_date, today), compute
+        )
+
+    async def respond(
+        self, route: str, query: Dict[str, str], if_none_match: str
+    ) -> Tuple[int, Optional[Response]]:
+        """Return the status and the response for a request."""
+        if route == "/":
+            key: Tuple = (route,)
+        elif route in ("/income", "/income.svg"):
+            key = (
+                route,
+                self._config_name(query),
+                _parse_date(query, "start"),
+                _parse_date(query, "end") or datetime.date.today(),
+            )
+        elif route == "/tables":
+            granularity = query.get("granularity", "month")
+            if granularity not in LEVELS:
+                raise HTTPError(
+                    400, "Invalid granularity: {}".format(granularity)
+                )
+            key = (
+                route,
+                self._config_name(query),
+                _parse_date(query, "start"),
+                _parse_date(query, "end") or datetime.date.today(),
+                granularity,
+            )
+        elif route in ("/networth", "/networth.svg"):
+            period = query.get("period", "weekly")
+            if period not in networth_report.PERIODS:
+                raise HTTPError(400, "Invalid period: {}".format(period))
+            min_date = _parse_date(query, "min_date")
+            key = (route, period, min_date, datetime.date.today())
+        else:
+            raise HTTPError(404, "Not found: {}".format(route))
+
+        response = await self.render(key, query)
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        if response.etag in tags:
+            return 304, Response(response.etag, "", b"")
+        return 200, response
+
+    async def render(self, key: Tuple, query: Dict[str, str]) -> Response:
+        """Render the response for a request key, or reuse the cached one."""
+        route, args = key[0], key[1:]
+        query_string = html.escape(urllib.parse.urlencode(query))
+        if route.endswith(".svg"):
+            draw = await self.CHARTS[route](self, *args)
+            render = partial(_render_svg, draw)
+        else:
+            page = await self.PAGES[route](self, query_string, *args)
+            render = partial(_render_html, page)
+            # Pages embed their query string, which the key may not capture.
+            key = (query_string,) + key
+        return await self.cached(("response",) + key, render)
+
+    async def index_page(self, _) -> Callable[[], str]:
+        def page() -> str:
+            links = [
+                '<li><a href="/income?config={0}">{0}</a>: '
+                '<a href="/tables?config={0}&granularity=week">weeks</a>, '
+                '<a href="/tables?config={0}&granularity=month">months</a>, '
+                '<a href="/tables?config={0}&granularity=quarter">quarters</a>'
+                ', <a href="/tables?config={0}&granularity=year">years</a>'
+                "</li>".format(html.escape(name))
+                for name in self.configs
+            ]
+            links.append('<li><a href="/networth">Net Worth</a></li>')
+            return _page("Reports", "<ul>{}</ul>".format("".join(links)))
+
+        return page
+
+    async def income_page(
+        self, query_string: str, name: str, start, end
+    ) -> Callable[[], str]:
+        report = await self.report(name, start, end, "month")
+        acctypes = self.ledger.acctypes
+        return partial(
+            render_html,
+            "Income vs Expenses",
+            report.tables[(acctypes.income, "month")],
+            report.tables[(acctypes.expenses, "month")],
+            '"/income.svg?{}"'.format(query_string),
+            report.trends,
+        )
+
+    async def income_chart(self, name: str, start, end) -> Callable:
+        report = await self.report(name, start, end, "month")
+        acctypes = self.ledger.acctypes
+        return partial(
+            draw_inc_vs_expenses,
+            start_date=report.start_date,
+            end_date=report.end_date,
+            income_data=report.tables[(acctypes.income, "month")],
+            expense_data=report.tables[(acctypes.expenses, "month")],
+        )
+
+    async def tables_page(
+        self, _, name: str, start, end, granularity: str
+    ) -> Callable[[], str]:
+        report = await self.report(name, start, end, granularity)
+        acctypes = self.ledger.acctypes
+
+        def page() -> str:
+            body = []
+            for title, acctype in [
+                ("Income", acctypes.income),
+                ("Expenses", acctypes.expenses),
+            ]:
+                table = report.tables[(acctype, granularity)]
+                table = with_total_row(table, "Total", -table.column_totals())
+                body.append("<h2>{}</h2>".format(title))
+                body.append("<p>{}</p>".format(render_table(table)))
+            return _page(
+                "Income and Expenses by {}".format(granularity),
+                "\n".join(body),
+            )
+
+        return page
+
+    async def networth_page(
+        self, query_string: str, period: str, min_date, today
+    ) -> Callable[[], str]:
+        net_worths_dict, _ = await self.net_worths(period, min_date, today)
+
+        def page() -> str:
+            latest = Table(
+                ["Currency", "Date", "Net Worth"],
+                [
+                    [currency, series[-1][0], "{:,.2f}".format(series[-1][1])]
+                    for currency, series in net_worths_dict.items()
+                    if series
+                ],
+            )
+            return _page(
+                "Net Worth",
+                '<img src="/networth.svg?{}" style="width: 100%"/>'
+                "<p>{}</p>".format(query_string, render_table(latest)),
+            )
+
+        return page
+
+    async def networth_chart(self, period: str, min_date, today) -> Callable:
+        net_worths_dict, lines = await self.net_worths(period, min_date, today)
+
+        def draw(outfile):
+            figure = networth_report.plot_net_worths(net_worths_dict, lines)
+            figure.savefig(outfile, format="svg")
+            load_pyplot().close(figure)
+
+        return draw
+
+    PAGES = {
+        "/": index_page,
+        "/income": income_page,
+        "/tables": tables_page,
+        "/networth": networth_page,
+    }
+    CHARTS = {
+        "/income.svg": income_chart,
+        "/networth.svg": networth_chart,
+    }
+
+    async def handle(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        """Serve a single HTTP/1.1 request on a connection."""
+        try:
+            request_line = await reader.readline()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            try:
+                method, target, _ = request_line.decode("latin-1").split(" ")
+            except ValueError:
+                return
+            url = urllib.parse.urlsplit(target)
+            query = dict(urllib.parse.parse_qsl(url.query))
+            try:
+                if method not in ("GET", "HEAD"):
+                    raise HTTPError(405, "Method not allowed")
+                status, response = await self.respond(
+                    url.path, query, headers.get("if-none-match", "")
+                )
+            except HTTPError as exc:
+                status, response = exc.status, Response(
+                    "", "text/plain", exc.reason.encode("utf-8")
+                )
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Could not render %s", target)
+                status, response = 500, Response(
+                    "", "text/plain", b"Internal server error"
+                )
+            logging.info("%s %s %d", method, target, status)
+            writer.write(_format_response(status, response, method == "HEAD"))
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host: str, port: int):
+        await self.load()
+        server = await asyncio.start_server(self.handle, host, port)
+        checker = asyncio.ensure_future(self.check_files())
+        logging.info("Serving reports on http://%s:%d/", host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            checker.cancel()
+            logging.info(
+                "Render cache: %d hits, %d misses", self.hits, self.misses
+            )
+
+
+STATUS_REASONS = {
+    200: "OK",
+    304: "Not Modified",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+def _format_response(status: int, response: Response, head: bool) -> bytes:
+    lines = ["HTTP/1.1 {} {}".format(status, STATUS_REASONS[status])]
+    if response.etag:
+        lines.append("ETag: {}".format(response.etag))
+        # Let browsers keep the page but revalidate it on every view.
+        lines.append("Cache-Control: no-cache")
+    if status != 304:
+        lines.append("Content-Type: {}".format(response.content_type))
+        lines.append("Content-Length: {}".format(len(response.body)))
+    lines.append("Connection: close")
+    head_bytes = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+    if head or status == 304:
+        return head_bytes
+    return head_bytes + response.body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+
+    parser.add_argument("ledger", help="Beancount ledger file")
+    parser.add_argument(
+        "configs",
+        nargs="*",
+        help="Configurations for accounts and reports, served by the name of "
+        "the file without extension.",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Verbose mode"
+    )
+    parser.add_argument(
+        "--host",
+        action="store",
+        default="127.0.0.1",
+        help="Address to listen on.",
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        action="store",
+        type=int,
+        default=8000,
+        help="Port to listen on.",
+    )
+    parser.add_argument(
+        "--cache-dir",
+        action="store",
+        help="Directory for the parsed ledger cache.",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Always parse the ledger from scratch.",
+    )
+
+    args = parser.parse_args()
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(levelname)-8s: %(message)s",
+    )
+    logging.getLogger("matplotlib.font_manager").disabled = True
+
+    server = ReportServer(
+        args.ledger, args.configs, args.cache_dir, not args.no_cache
+    )
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
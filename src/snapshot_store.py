@@ -0,0 +1,87 @@
+"""Store of frozen per-period results, to regenerate reports incrementally.
+
+Each snapshot holds the aggregated values of one period (e.g., a month) of a
+report section, along with a fingerprint of the inputs it was computed from.
+A snapshot is only reused if the fingerprint of the current inputs for that
+period matches, so that past periods are frozen until their data changes.
+"""
+
+import hashlib
+import logging
+import pickle
+from os import path
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from atomic_file import write_pickle
+
+# Bump this whenever the layout of the pickled store changes.
+STORE_VERSION = 2
+
+# The name of the store file in an output directory.
+FILENAME = "snapshots.pickle"
+
+
+def fingerprint(value: Any) -> str:
+    """Hash a value built of tuples, lists, strings, numbers and dates."""
+    return hashlib.sha256(repr(value).encode("utf-8")).hexdigest()
+
+
+class SnapshotStore:
+    """A pickled dict of (section, period) to (fingerprint, values)."""
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.snapshots: Dict[Tuple[str, Hashable], Tuple[str, Any]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        try:
+            with open(filename, "rb") as infile:
+                payload = pickle.load(infile)
+            if payload.get("version") == STORE_VERSION:
+                self.snapshots = payload["snapshots"]
+        except FileNotFoundError:
+            pass
+        except Exception as exc:  # pylint: disable=broad-except
+            logging.warning(
+                "Ignoring unreadable snapshots %s: %s", filename, exc
+            )
+
+    @classmethod
+    def in_dir(cls, dirname: str) -> "SnapshotStore":
+        return cls(path.join(dirname, FILENAME))
+
+    def get(
+        self,
+        section: str,
+        period: Hashable,
+        digest: str,
+    ) -> Optional[Any]:
+        """Return the values of a period if its fingerprint is unchanged."""
+        snapshot = self.snapshots.get((section, period))
+        if snapshot is not None and snapshot[0] == digest:
+            self.hits += 1
+            return snapshot[1]
+        self.misses += 1
+        return None
+
+    def put(self, section: str, period: Hashable, digest: str, values: Any):
+        """Freeze the values of a period."""
+        self.snapshots[(section, period)] = (digest, values)
+        self.dirty = True
+
+    def log_stats(self):
+        logging.info(
+            "Snapshots %s: %d reused, %d recomputed",
+            self.filename,
+            self.hits,
+            self.misses,
+        )
+
+    def save(self):
+        """Write the store back to disk if anything changed."""
+        if not self.dirty:
+            return
+        payload = {"version": STORE_VERSION, "snapshots": self.snapshots}
+        write_pickle(self.filename, payload)
+        self.dirty = False
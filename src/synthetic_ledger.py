@@ -0,0 +1,228 @@
+"""Generate deterministic synthetic beancount ledgers, e.g. for benchmarks.
+
+The ledger has a checking account and a credit card paying for expenses
+spread over a configurable number of accounts, a monthly salary, monthly
+transfers to a CAD savings account, and monthly purchases of commodities held
+at cost. Prices of the commodities and of CAD are random walks, quoted on a
+configurable fraction of the days. The transactions are spread round-robin by
+month over a number of included files.
+
+The same spec and seed always produce the same files.
+"""
+
+import argparse
+import datetime
+import os
+import random
+from os import path
+from typing import List, NamedTuple
+
+LedgerSpec = NamedTuple(
+    "LedgerSpec",
+    [
+        ("years", int),
+        ("start_year", int),
+        ("accounts", int),
+        ("postings_per_day", int),
+        ("commodities", int),
+        ("price_density", float),
+        ("includes", int),
+        ("seed", int),
+    ],
+)
+
+DEFAULT_SPEC = LedgerSpec(
+    years=3,
+    start_year=2015,
+    accounts=20,
+    postings_per_day=5,
+    commodities=3,
+    price_density=0.5,
+    includes=4,
+    seed=0,
+)
+
+# Number of expense accounts grouped under each parent account.
+ACCOUNTS_PER_CATEGORY = 5
+
+CONFIG = """\
+budget_accounts: "Assets:Bank:Checking"
+budget_accounts: "Liabilities:Card"
+mappings { source: "Expenses:Cat0:.*" dest: "Expenses:Cat0" }
+"""
+
+
+def expense_accounts(spec: LedgerSpec) -> List[str]:
+    return [
+        "Expenses:Cat{}:Sub{}".format(index // ACCOUNTS_PER_CATEGORY, index)
+        for index in range(spec.accounts)
+    ]
+
+
+def commodities(spec: LedgerSpec) -> List[str]:
+    return ["S{:03d}".format(index) for index in range(spec.commodities)]
+
+
+def end_date(spec: LedgerSpec) -> datetime.date:
+    """Return the last day of the ledger."""
+    return datetime.date(
+        spec.start_year + spec.years, 1, 1
+    ) - datetime.timedelta(days=1)
+
+
+def _days(spec: LedgerSpec):
+    date = datetime.date(spec.start_year, 1, 1)
+    last = end_date(spec)
+    while date <= last:
+        yield date
+        date += datetime.timedelta(days=1)
+
+
+def _write_prices(filename: str, spec: LedgerSpec, rng: random.Random):
+    rates = {name: 100.0 for name in commodities(spec)}
+    rates["CAD"] = 0.75
+    first = datetime.date(spec.start_year, 1, 1)
+    with open(filename, "w") as outfile:
+        for date in _days(spec):
+            for name, rate in sorted(rates.items()):
+                rate *= 1.0 + rng.gauss(0.0002, 0.01)
+                rates[name] = rate
+                # Quote everything on the first day, so that all holdings
+                # can be converted.
+                if date == first or rng.random() < spec.price_density:
+                    outfile.write(
+                        "{} price {} {:.4f} USD\n".format(date, name, rate)
+                    )
+
+
+def _transactions(spec: LedgerSpec, rng: random.Random, date: datetime.date):
+    accounts = expense_accounts(spec)
+    for _ in range(spec.postings_per_day):
+        account = rng.choice(accounts)
+        card = rng.random() < 0.7
+        source = "Liabilities:Card" if card else "Assets:Bank:Checking"
+        yield (
+            '{} * "Shop" "Purchase"\n'
+            "  {}  {:.2f} USD\n"
+            "  {}\n".format(date, account, rng.uniform(1, 200), source)
+        )
+    if date.day == 1:
+        yield (
+            '{} * "Employer" "Salary"\n'
+            "  Assets:Bank:Checking  {:.2f} USD\n"
+            "  Income:Salary\n".format(date, 4000 + 100 * rng.random())
+        )
+        yield (
+            '{} * "Transfer to savings"\n'
+            "  Assets:Bank:Savings  500.00 CAD @ {:.4f} USD\n"
+            "  Assets:Bank:Checking\n".format(date, rng.uniform(0.7, 0.8))
+        )
+        for name in commodities(spec):
+            yield (
+                '{} * "Broker" "Buy {}"\n'
+                "  Assets:Broker:{}  {} {} {{{:.2f} USD}}\n"
+                "  Assets:Bank:Checking\n".format(
+                    date,
+                    name,
+                    name,
+                    rng.randint(1, 5),
+                    name,
+                    rng.uniform(80, 120),
+                )
+            )
+    if date.day == 15:
+        yield (
+            '{} * "Pay card"\n'
+            "  Liabilities:Card  {:.2f} USD\n"
+            "  Assets:Bank:Checking\n".format(date, rng.uniform(2000, 3000))
+        )
+
+
+def generate_ledger(dirname: str, spec: LedgerSpec = DEFAULT_SPEC) -> str:
+    """Write a synthetic ledger and a report config to a directory.
+
+    Returns the filename of the top-level ledger file. The config is written
+    as config.pbtxt in the same directory.
+    """
+    rng = random.Random(spec.seed)
+    os.makedirs(dirname, exist_ok=True)
+    start = datetime.date(spec.start_year, 1, 1)
+    includes = ["prices.beancount"] + [
+        "txns-{:02d}.beancount".format(index) for index in range(spec.includes)
+    ]
+
+    filename = path.join(dirname, "main.beancount")
+    with open(filename, "w") as outfile:
+        outfile.write('option "title" "Synthetic ledger"\n')
+        outfile.write('option "operating_currency" "USD"\n')
+        outfile.write('option "operating_currency" "CAD"\n\n')
+        opens = [
+            ("Assets:Bank:Checking", "USD"),
+            ("Assets:Bank:Savings", "CAD"),
+            ("Liabilities:Card", "USD"),
+            ("Income:Salary", "USD"),
+            ("Equity:Opening", ""),
+        ]
+        opens += [(account, "USD") for account in expense_accounts(spec)]
+        opens += [
+            ("Assets:Broker:{}".format(name), name)
+            for name in commodities(spec)
+        ]
+        for account, currency in opens:
+            outfile.write(
+                "{} open {} {}\n".format(start, account, currency).rstrip()
+                + "\n"
+            )
+        outfile.write("\n")
+        for include in includes:
+            outfile.write('include "{}"\n'.format(include))
+
+    _write_prices(path.join(dirname, includes[0]), spec, rng)
+
+    # Without includes, the transactions go to the top-level file.
+    txn_files = [
+        open(path.join(dirname, include), "w") for include in includes[1:]
+    ] or [open(filename, "a")]
+    try:
+        for date in _days(spec):
+            month = (date.year - spec.start_year) * 12 + date.month - 1
+            outfile = txn_files[month % len(txn_files)]
+            for txn in _transactions(spec, rng, date):
+                outfile.write(txn + "\n")
+    finally:
+        for outfile in txn_files:
+            outfile.close()
+
+    with open(path.join(dirname, "config.pbtxt"), "w") as outfile:
+        outfile.write(CONFIG)
+    return filename
+
+
+def add_spec_arguments(parser: argparse.ArgumentParser):
+    """Add an option per field of `LedgerSpec` to a parser."""
+    for field, default in DEFAULT_SPEC._asdict().items():
+        parser.add_argument(
+            "--{}".format(field.replace("_", "-")),
+            action="store",
+            type=type(default),
+            default=default,
+            help="Default is {}.".format(default),
+        )
+
+
+def spec_from_args(args: argparse.Namespace) -> LedgerSpec:
+    return LedgerSpec(*(getattr(args, field) for field in LedgerSpec._fields))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+
+    parser.add_argument("output", help="Directory to write the ledger to.")
+    add_spec_arguments(parser)
+
+    args = parser.parse_args()
+    print(generate_ledger(args.output, spec_from_args(args)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Export computed tables and time series to machine-readable files.
+
+The formats are:
+
+  csv     One row per account, or per date, like the HTML tables.
+  ndjson  One JSON record per non-empty cell, in long format.
+  npz     An uncompressed NumPy archive of the arrays of the table or series.
+  arrow   An Arrow IPC file, which can be memory-mapped. Requires pyarrow.
+
+The values are exact decimals in every format but the npz of a time series,
+which holds them as floats.
+
+Each export writes one file per format, named after a common base name.
+"""
+
+import argparse
+import csv
+import datetime
+import json
+from decimal import Decimal
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from pivot_table import PivotTable
+
+FORMATS = ("csv", "ndjson", "npz", "arrow")
+DEFAULT_FORMATS = ("csv", "ndjson", "npz")
+
+# A time series per currency, as computed for the net worth.
+Series = Dict[str, List[Tuple[datetime.date, Decimal]]]
+
+
+def parse_formats(string: str) -> List[str]:
+    """Parse a comma-separated list of formats, for argparse."""
+    formats = [name.strip() for name in string.split(",") if name.strip()]
+    for name in formats:
+        if name not in FORMATS:
+            raise argparse.ArgumentTypeError(
+                "unknown format {!r}, expected some of {}".format(
+                    name, ",".join(FORMATS)
+                )
+            )
+    if "arrow" in formats:
+        try:
+            import pyarrow  # noqa: F401 pylint: disable=unused-import
+        except ImportError:
+            raise argparse.ArgumentTypeError("arrow format requires pyarrow")
+    return formats
+
+
+def export_table(
+    basename: str, table: PivotTable, formats: Sequence[str]
+) -> List[str]:
+    """Write a pivot table to `basename` plus the extension of each format,
+    returning the filenames written."""
+    filenames = []
+    for name in formats:
+        filename = "{}.{}".format(basename, name)
+        TABLE_WRITERS[name](filename, table)
+        filenames.append(filename)
+    return filenames
+
+
+def export_series(
+    basename: str, series: Series, formats: Sequence[str]
+) -> List[str]:
+    """Write time series sharing the same dates to `basename` plus the
+    extension of each format, returning the filenames written."""
+    currencies = list(series)
+    dates = [date for date, _ in series[currencies[0]]] if currencies else []
+    values = np.array(
+        [[value for _, value in series[currency]] for currency in currencies],
+        dtype=object,
+    ).reshape(len(currencies), len(dates))
+    filenames = []
+    for name in formats:
+        filename = "{}.{}".format(basename, name)
+        SERIES_WRITERS[name](filename, dates, currencies, values)
+        filenames.append(filename)
+    return filenames
+
+
+def _table_csv(filename: str, table: PivotTable):
+    with open(filename, "w", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(table.header)
+        writer.writerows(table.rows)
+
+
+def _table_ndjson(filename: str, table: PivotTable):
+    accounts = [json.dumps(account) for account in table.accounts]
+    periods = [json.dumps(period) for period in table.periods]
+    with open(filename, "w") as outfile:
+        for row, column in zip(*np.nonzero(table.mask)):
+            outfile.write(
+                '{{"account": {}, "period": {}, "value": {}}}\n'.format(
+                    accounts[row],
+                    periods[column],
+                    table.format_value(table.values[row, column]),
+                )
+            )
+
+
+def _table_npz(filename: str, table: PivotTable):
+    np.savez(
+        filename,
+        accounts=np.array(table.accounts, dtype=str),
+        periods=np.array(table.periods, dtype=str),
+        values=table.values,
+        mask=table.mask,
+        places=np.int64(table.places),
+    )
+
+
+def _table_arrow(filename: str, table: PivotTable):
+    import pyarrow as pa
+
+    # Exact decimals, with empty cells as nulls.
+    decimal = pa.decimal128(38, table.places)
+    columns = [pa.array(table.accounts, type=pa.string())]
+    for values, mask in zip(table.values.T.tolist(), table.mask.T.tolist()):
+        cells = [
+            Decimal(value).scaleb(-table.places) if present else None
+            for value, present in zip(values, mask)
+        ]
+        columns.append(pa.array(cells, type=decimal))
+    _write_arrow(filename, pa.Table.from_arrays(columns, names=table.header))
+
+
+def _series_csv(filename, dates, currencies, values):
+    with open(filename, "w", newline="") as outfile:
+        writer = csv.writer(outfile)
+        writer.writerow(["date"] + currencies)
+        for index, date in enumerate(dates):
+            writer.writerow([date] + values[:, index].tolist())
+
+
+def _series_ndjson(filename, dates, currencies, values):
+    names = [json.dumps(currency) for currency in currencies]
+    with open(filename, "w") as outfile:
+        for index, date in enumerate(dates):
+            day = json.dumps(date.isoformat())
+            # The decimals are written as exact JSON numbers.
+            for name, value in zip(names, values[:, index].tolist()):
+                outfile.write(
+                    '{{"date": {}, "currency": {}, "value": {}}}\n'.format(
+                        day, name, value
+                    )
+                )
+
+
+def _series_npz(filename, dates, currencies, values):
+    np.savez(
+        filename,
+        dates=np.array(dates, dtype="datetime64[D]"),
+        currencies=np.array(currencies, dtype=str),
+        values=values.astype(np.float64),
+    )
+
+
+def _series_arrow(filename, dates, currencies, values):
+    import pyarrow as pa
+
+    # Exact decimals, at the largest number of places of the values, in 256
+    # bits if the values need more than 38 digits at that scale.
+    places = max([-value.as_tuple().exponent for value in values.flat] + [0])
+    digits = max([value.adjusted() + 1 for value in values.flat] + [1])
+    if digits + places <= 38:
+        decimal = pa.decimal128(38, places)
+    else:
+        decimal = pa.decimal256(76, places)
+    columns = [pa.array(dates, type=pa.date32())]
+    columns.extend(pa.array(row.tolist(), type=decimal) for row in values)
+    _write_arrow(
+        filename, pa.Table.from_arrays(columns, names=["date"] + currencies)
+    )
+
+
+def _write_arrow(filename: str, arrow_table):
+    import pyarrow as pa
+
+    with pa.OSFile(filename, "wb") as sink:
+        with pa.ipc.new_file(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+
+
+TABLE_WRITERS = {
+    "csv": _table_csv,
+    "ndjson": _table_ndjson,
+    "npz": _table_npz,
+    "arrow": _table_arrow,
+}
+
+SERIES_WRITERS = {
+    "csv": _series_csv,
+    "ndjson": _series_ndjson,
+    "npz": _series_npz,
+    "arrow": _series_arrow,
+}
@@ -0,0 +1,55 @@
+"""Streaming writer for HTML tables.
+
+Rows are formatted with a template compiled once per row width and written to
+the output file in chunks, instead of with one write per cell into an
+in-memory copy of the document. Long tables can also be split in pages.
+"""
+
+from typing import IO, Any, Dict, Iterable, List, Optional, Sequence
+
+# Number of formatted rows buffered between writes to the output file.
+CHUNK_ROWS = 256
+
+
+def row_template(width: int, cell: str = "<td>{}</td>\n") -> str:
+    """Compile the format string of a table row with `width` cells."""
+    return "<tr>\n" + cell * width + "</tr>\n"
+
+
+def write_table(
+    outfile: IO,
+    header: Sequence[Any],
+    rows: Iterable[Sequence[Any]],
+    floatfmt: Optional[str] = None,
+    classes: Optional[str] = None,
+):
+    """Write a simple data table as HTML to a file."""
+    outfile.write('<table class="{}">\n'.format(" ".join(classes or [])))
+    outfile.write(row_template(len(header), "<th>{}</th>\n").format(*header))
+    templates: Dict[int, str] = {}
+    chunk: List[str] = []
+    for row in rows:
+        if floatfmt:
+            row = [
+                floatfmt.format(value) if isinstance(value, float) else value
+                for value in row
+            ]
+        template = templates.get(len(row))
+        if template is None:
+            template = templates[len(row)] = row_template(len(row))
+        chunk.append(template.format(*row))
+        if len(chunk) >= CHUNK_ROWS:
+            outfile.write("".join(chunk))
+            chunk.clear()
+    outfile.write("".join(chunk))
+    outfile.write("</table>\n")
+
+
+def paginate(rows: Sequence[Any], page_rows: Optional[int]) -> List[Sequence]:
+    """Split rows in pages of at most `page_rows` rows, if given."""
+    if not page_rows or len(rows) <= page_rows:
+        return [rows]
+    return [
+        rows[start:start + page_rows]
+        for start in range(0, len(rows), page_rows)
+    ]
@@ -0,0 +1,175 @@
+"""Keep a ledger resident and re-render reports whenever its files change.
+
+Changes are detected by comparing the modification time and size of every
+file of the ledger. On Linux, inotify is used to wake up as soon as one of
+their directories changes; elsewhere the files are polled.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import time
+from os import path
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from ledger_cache import Ledger, ledger_files
+
+# inotify event masks, from <sys/inotify.h>.
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_CHANGE = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE
+IN_MASK = IN_CHANGE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# Time to let a burst of writes settle before checking the files, in seconds.
+SETTLE_DELAY = 0.05
+
+
+def _stat(filename: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(filename)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _inotify_init(directories: Sequence[str]) -> Optional[int]:
+    """Watch directories with inotify, returning its descriptor or None."""
+    if not hasattr(os, "O_NONBLOCK"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        init = libc.inotify_init1
+        add_watch = libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    fd = init(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        return None
+    for directory in directories:
+        if add_watch(fd, os.fsencode(directory), IN_MASK) < 0:
+            os.close(fd)
+            return None
+    return fd
+
+
+Stamps = Dict[str, Optional[Tuple[int, int]]]
+
+
+def stamp_files(filenames: Sequence[str]) -> Stamps:
+    """Return the modification time and size of files, or None if missing."""
+    return {filename: _stat(filename) for filename in filenames}
+
+
+class FileWatcher:
+    """Wait for any of a set of files to change.
+
+    The files are compared with `stamps` if given, e.g. taken before they were
+    read, and otherwise with their current stamps. Unless `notify` is false,
+    inotify is used to wake up on changes where available.
+    """
+
+    def __init__(
+        self,
+        filenames: Sequence[str],
+        interval: float = 0.5,
+        notify: bool = True,
+        stamps: Optional[Stamps] = None,
+    ):
+        self.filenames = list(filenames)
+        self.interval = interval
+        self.stamps = stamp_files(self.filenames)
+        if stamps is not None:
+            self.stamps.update(
+                (filename, stamps[filename])
+                for filename in self.filenames
+                if filename in stamps
+            )
+        directories = sorted({path.dirname(f) or "." for f in self.filenames})
+        self.fd = _inotify_init(directories) if notify else None
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def changed(self) -> List[str]:
+        """Return the files which changed since they were last stamped."""
+        changed = []
+        for filename, stamp in self.stamps.items():
+            new_stamp = _stat(filename)
+            if new_stamp != stamp:
+                self.stamps[filename] = new_stamp
+                changed.append(filename)
+        return changed
+
+    def wait(self) -> List[str]:
+        """Block until some files change and return them."""
+        while True:
+            changed = self.changed()
+            if changed:
+                return changed
+            if self.fd is not None:
+                # Wake up on any event in the directories, but still poll
+                # once in a while in case some event got lost.
+                readable, _, _ = select.select([self.fd], [], [], 10.0)
+                if readable:
+                    time.sleep(SETTLE_DELAY)
+                    try:
+                        while os.read(self.fd, 65536):
+                            pass
+                    except BlockingIOError:
+                        pass
+            else:
+                time.sleep(self.interval)
+
+
+def run_watch(
+    filename: str,
+    load: Callable[[], Ledger],
+    render: Callable[[Ledger], None],
+    interval: float = 0.5,
+    extra_files: Sequence[str] = (),
+):
+    """Load and render a ledger, then again every time one of its files, or
+    of `extra_files` (e.g., configs), changes, until interrupted.
+
+    The files are stamped before they are loaded, so that changes saved while
+    loading trigger another round. If the ledger cannot be loaded, the files
+    of the last loaded ledger are watched until they change again.
+    """
+    filenames = [filename] + list(extra_files)
+    try:
+        while True:
+            start = time.time()
+            stamps = stamp_files(filenames)
+            try:
+                ledger = load()
+            except Exception:  # pylint: disable=broad-except
+                logging.exception("Could not load the ledger")
+            else:
+                _, _, options_map = ledger
+                files = ledger_files(options_map, filename)
+                filenames = files + list(extra_files)
+                try:
+                    render(ledger)
+                except Exception:  # pylint: disable=broad-except
+                    logging.exception("Could not render the reports")
+                logging.info(
+                    "Rendered in %.2fs, watching %d file(s)",
+                    time.time() - start,
+                    len(filenames),
+                )
+            watcher = FileWatcher(filenames, interval, stamps=stamps)
+            try:
+                changed = watcher.wait()
+            finally:
+                watcher.close()
+            logging.info("Changed: %s", ", ".join(changed))
+    except KeyboardInterrupt:
+        pass
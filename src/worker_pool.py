@@ -0,0 +1,49 @@
+"""Process pools whose workers are forked from this process.
+
+Forked workers inherit the already imported modules and the state given to
+the pool, e.g. a loaded ledger, instead of importing and unpickling them
+again. The tasks of a worker read that state with `worker_state()`.
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+from typing import Any, Optional
+
+# The state shared by the tasks of a worker process.
+_STATE: Any = None
+
+
+def set_worker_state(state: Any):
+    """Set the state read by `worker_state()`, e.g. to run the tasks of a
+    pool in this process instead."""
+    global _STATE  # pylint: disable=global-statement
+    _STATE = state
+
+
+def worker_state() -> Any:
+    """Return the state given to the pool of this worker process."""
+    return _STATE
+
+
+def worker_count(max_workers: Optional[int], tasks: int) -> int:
+    """Return the number of workers to run a number of tasks, given a maximum
+    or None or 0 for one per CPU."""
+    return min(max_workers or os.cpu_count() or 1, tasks)
+
+
+def fork_pool(
+    max_workers: int, state: Any = None
+) -> concurrent.futures.ProcessPoolExecutor:
+    """Create a process pool which forks its workers where possible, each
+    starting with `state` as its worker state."""
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context(
+        "fork" if "fork" in methods else None
+    )
+    return concurrent.futures.ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=context,
+        initializer=set_worker_state,
+        initargs=(state,),
+    )
@@ -0,0 +1,74 @@
+"""A small synthetic ledger shared by the tests."""
+
+import pytest
+from beancount import loader
+from beancount.core import data
+
+from synthetic_ledger import LedgerSpec, generate_ledger
+
+SPEC = LedgerSpec(
+    years=2,
+    start_year=2015,
+    accounts=6,
+    postings_per_day=2,
+    commodities=2,
+    price_density=0.3,
+    includes=2,
+    seed=1,
+)
+
+# Gold held at cost and euros held at no cost, neither of which has a price
+# before some dates, so that some positions cannot be converted on those.
+EXTRA_ENTRIES = """
+2015-01-01 open Assets:Gold GLD
+2015-01-01 open Assets:Bank:Euro EUR
+
+2015-02-10 * "Buy gold"
+  Assets:Gold  2 GLD {1200.00 USD}
+  Assets:Bank:Checking
+
+2015-03-05 * "Buy euros"
+  Assets:Bank:Euro  300.00 EUR @ 1.10 USD
+  Assets:Bank:Checking
+
+2015-07-01 price GLD 1250.00 USD
+2015-09-01 price EUR 1.12 USD
+"""
+
+
+@pytest.fixture(scope="session")
+def ledger(tmp_path_factory):
+    """Return the entries, errors and options map of the ledger."""
+    filename = generate_ledger(str(tmp_path_factory.mktemp("ledger")), SPEC)
+    with open(filename, "a") as outfile:
+        outfile.write(EXTRA_ENTRIES)
+    entries, errors, options_map = loader.load_file(filename)
+    assert errors == []
+    return entries, errors, options_map
+
+
+def _edit_month(entries, year, month, account):
+    """Return a copy of the entries with the first posting of a month to an
+    account under `account` increased by one."""
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, data.Transaction):
+            continue
+        if (entry.date.year, entry.date.month) != (year, month):
+            continue
+        for position, posting in enumerate(entry.postings):
+            if posting.account.startswith(account):
+                units = posting.units
+                postings = list(entry.postings)
+                postings[position] = posting._replace(
+                    units=units._replace(number=units.number + 1)
+                )
+                edited = list(entries)
+                edited[index] = entry._replace(postings=postings)
+                return edited
+    raise ValueError("No posting of {} in {}-{}".format(account, year, month))
+
+
+@pytest.fixture
+def edit_month():
+    """Return a function editing a posting of a month of the entries."""
+    return _edit_month
@@ -0,0 +1,13 @@
+"""The report CLIs import quickly and without matplotlib."""
+
+import pytest
+
+import check_import_time
+
+
+@pytest.mark.parametrize("module", check_import_time.MODULES)
+def test_import_time(module):
+    errors = check_import_time.check_module(
+        module, check_import_time.DEFAULT_BUDGET_MS, repeat=3
+    )
+    assert errors == []
@@ -0,0 +1,118 @@
+"""The monthly tables are the same from snapshots and from the cube."""
+
+import collections
+
+import numpy as np
+import pytest
+from beancount.core import account_types, data, inventory, prices
+from beancount.core.number import D
+from beancount.parser import options
+
+from account_mapping import AccountMapper
+from monthly_expenses import (
+    FOLDED_LEVELS,
+    accumulate_balances,
+    compute_tables,
+    fold_periods,
+    reduce_balances,
+)
+from olap_cube import LEVELS, Cube, ancestor
+from pivot_table import PivotTable
+from posting_store import PostingStore, date_to_day
+from price_converter import PriceConverter
+from snapshot_store import SnapshotStore
+
+Q = D("0.01")
+
+MAPPER = AccountMapper([("Expenses:Cat1:.*", "Expenses:Cat1")])
+
+
+def assert_same_table(table, expected):
+    assert table.accounts == expected.accounts
+    assert table.periods == expected.periods
+    assert table.places == expected.places
+    assert (table.values == expected.values).all()
+    assert (table.mask == expected.mask).all()
+
+
+def test_snapshots_reuse_unchanged_months(ledger, edit_month, tmp_path):
+    entries, _, options_map = ledger
+    acctypes = options.get_account_types(options_map)
+    price_map = prices.build_price_map(entries)
+    types = [acctypes.income, acctypes.expenses]
+    filename = str(tmp_path / "snapshots.pickle")
+    store = SnapshotStore(filename)
+    compute_tables(entries, acctypes, price_map, Q, types, snapshots=store)
+    months = store.misses
+    assert store.hits == 0
+    store.save()
+
+    edited = edit_month(entries, 2016, 3, acctypes.expenses)
+    store = SnapshotStore(filename)
+    tables = compute_tables(
+        edited, acctypes, price_map, Q, types, snapshots=store
+    )
+    assert (store.hits, store.misses) == (months - 1, 1)
+
+    expected = compute_tables(edited, acctypes, price_map, Q, types)
+    assert tables.keys() == expected.keys()
+    for key, table in tables.items():
+        assert_same_table(table, expected[key])
+
+
+def _period_balances(txns, acctype, level):
+    """Sum the units of the postings of an account type per period."""
+    balances = collections.defaultdict(
+        lambda: collections.defaultdict(inventory.Inventory)
+    )
+    days = np.array([date_to_day(txn.date) for txn in txns], dtype=np.int64)
+    for txn, period in zip(txns, level.period(days).tolist()):
+        for posting in txn.postings:
+            if (
+                account_types.get_account_type(posting.account) == acctype
+                and posting.units.currency == "USD"
+            ):
+                balances[MAPPER(posting.account)][period].add_position(posting)
+    return balances
+
+
+def folded_table(entries, acctype, name, depth, converter):
+    """Tabulate the entries by folding their monthly balances, or at the time
+    levels finer than a month, by summing them per period."""
+    level = LEVELS[name]
+    txns = list(data.filter_txns(entries))
+    if name in FOLDED_LEVELS:
+        balances, _ = accumulate_balances(txns, {acctype}, MAPPER)
+        balances = fold_periods(balances[acctype], level)
+    else:
+        balances = _period_balances(txns, acctype, level)
+
+    rolled = collections.defaultdict(
+        lambda: collections.defaultdict(inventory.Inventory)
+    )
+    for account, periods in balances.items():
+        for period, balance in periods.items():
+            rolled[ancestor(account, depth)][period].add_inventory(balance)
+    days = np.array([date_to_day(txn.date) for txn in txns], dtype=np.int64)
+    periods = sorted(set(level.period(days).tolist()))
+    return PivotTable.from_balances(
+        reduce_balances(rolled, level, converter),
+        periods,
+        [level.label(period) for period in periods],
+        Q,
+    )
+
+
+@pytest.mark.parametrize("depth", [None, 2])
+@pytest.mark.parametrize("name", list(LEVELS))
+def test_cube_matches_folded_tables(ledger, name, depth):
+    entries, _, options_map = ledger
+    acctypes = options.get_account_types(options_map)
+    converter = PriceConverter(prices.build_price_map(entries))
+    types = {acctypes.income, acctypes.expenses}
+    cube = Cube(PostingStore.from_entries(entries), types, MAPPER)
+    for acctype in types:
+        assert_same_table(
+            cube.table(acctype, name, Q, converter, depth),
+            folded_table(entries, acctype, name, depth, converter),
+        )
@@ -0,0 +1,137 @@
+"""The net worth engine gives the values of replaying an inventory."""
+
+import collections
+import datetime
+
+import pytest
+from beancount.core import account_types, convert, data, inventory, prices
+from beancount.core.number import ZERO, D
+from beancount.parser import options
+
+import networth_report
+from networth_engine import (
+    BalanceCheckpoints,
+    compute_net_worths,
+    load_checkpoints,
+)
+from posting_store import PostingStore
+from snapshot_store import SnapshotStore
+
+TOLERANCE = D("1e-12")
+
+
+def _project_missing(price_map, date, currencies, target_currency):
+    """Project the currencies without a rate to the target currency, as the
+    original report did."""
+    priced_currencies = collections.defaultdict(set)
+    for base, quote in price_map.keys():
+        priced_currencies[base].add(quote)
+    available_currencies = priced_currencies[target_currency]
+    projections = collections.defaultdict(list)
+    for currency in currencies:
+        pair = (currency, target_currency)
+        if prices.get_price(price_map, pair, date)[1] is None:
+            for inter_currency in (
+                priced_currencies[currency] & available_currencies
+            ):
+                projections[inter_currency].append(currency)
+    for inter_currency, commodities in projections.items():
+        price_map = prices.project(
+            price_map, inter_currency, target_currency, commodities
+        )
+    return price_map
+
+
+def baseline_net_worths(entries, acctypes, price_map, dates, currencies):
+    """Replay the postings into an inventory and convert it at every date."""
+    net_worths = collections.defaultdict(list)
+    balance = inventory.Inventory()
+    txns = list(data.filter_txns(entries))
+    index = 0
+    for date in dates:
+        while index < len(txns) and txns[index].date < date:
+            for posting in txns[index].postings:
+                acctype = account_types.get_account_type(posting.account)
+                if acctype in (acctypes.assets, acctypes.liabilities):
+                    balance.add_position(posting)
+            index += 1
+        for currency in currencies:
+            value_balance = balance.reduce(convert.get_value, price_map, date)
+            proj_price_map = _project_missing(
+                price_map,
+                date,
+                {pos.units.currency for pos in value_balance},
+                currency,
+            )
+            converted = balance.reduce(
+                convert.convert_position, currency, proj_price_map, date
+            ).split()
+            number = ZERO
+            if currency in converted:
+                number = converted[currency].get_only_position().units.number
+            net_worths[currency].append((date, number))
+    return net_worths
+
+
+@pytest.mark.parametrize("period", ["daily", "weekly", "monthly"])
+@pytest.mark.parametrize("compact", [False, True])
+def test_matches_baseline(ledger, period, compact):
+    entries, _, options_map = ledger
+    acctypes = options.get_account_types(options_map)
+    price_map = prices.build_price_map(entries)
+    currencies = options_map["operating_currency"]
+    dates = [
+        date
+        for date in networth_report.period_dates(entries, None, period)
+        if date <= datetime.date(2017, 1, 15)
+    ]
+    expected = baseline_net_worths(
+        entries, acctypes, price_map, dates, currencies
+    )
+    postings = PostingStore.from_entries(entries) if compact else entries
+    actual = compute_net_worths(
+        postings, acctypes, price_map, dates, currencies
+    )
+    # The lots of a key are converted together rather than one by one, so
+    # the values may differ in the last digits of the decimal context.
+    assert list(actual) == currencies
+    for currency in currencies:
+        assert [date for date, _ in actual[currency]] == dates
+        for (_, value), (_, expected_value) in zip(
+            actual[currency], expected[currency]
+        ):
+            assert abs(value - expected_value) < TOLERANCE
+
+
+def test_checkpoints_reuse_months_before_edit(ledger, edit_month, tmp_path):
+    entries, _, options_map = ledger
+    acctypes = options.get_account_types(options_map)
+    filename = str(tmp_path / "checkpoints.pickle")
+    store = SnapshotStore(filename)
+    checkpoints = load_checkpoints(entries, acctypes, store)
+    assert (store.hits, store.misses) == (0, len(checkpoints.dates))
+    store.save()
+
+    edited = edit_month(entries, 2016, 3, "Assets:Bank:Checking")
+    store = SnapshotStore(filename)
+    checkpoints = load_checkpoints(edited, acctypes, store)
+    # The checkpoints up to the start of the edited month only depend on the
+    # months before it.
+    unchanged = [
+        date for date in checkpoints.dates if date <= datetime.date(2016, 3, 1)
+    ]
+    assert 0 < len(unchanged) < len(checkpoints.dates)
+    assert store.hits == len(unchanged)
+    assert store.misses == len(checkpoints.dates) - len(unchanged)
+
+    expected = BalanceCheckpoints.from_entries(edited, acctypes)
+    assert checkpoints.dates == expected.dates
+    assert checkpoints.keys == expected.keys
+    assert (checkpoints.balances == expected.balances).all()
+
+    price_map = prices.build_price_map(edited)
+    currencies = options_map["operating_currency"]
+    dates = networth_report.period_dates(edited, None, "weekly")
+    assert compute_net_worths(
+        edited, acctypes, price_map, dates, currencies, checkpoints=checkpoints
+    ) == compute_net_worths(edited, acctypes, price_map, dates, currencies)
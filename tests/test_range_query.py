@@ -0,0 +1,89 @@
+"""Range queries over prefix sums equal sums over the postings."""
+
+import datetime
+
+import pytest
+from beancount.core import data
+from beancount.core.number import ZERO
+
+from posting_store import PostingStore, to_decimal
+from range_query import RangeIndex, months_before
+
+NAMES = [
+    "Assets:Bank:Checking",
+    "Liabilities:Card",
+    "Expenses:Cat0:Sub1",
+    "Expenses:*",
+    "Expenses:Cat1:*",
+    "Assets:*",
+    "Expenses:Unknown",
+    "Expenses:Cat0",
+]
+
+RANGES = [
+    (None, None),
+    (datetime.date(2015, 3, 10), datetime.date(2016, 2, 29)),
+    (None, datetime.date(2015, 6, 30)),
+    (datetime.date(2016, 7, 1), None),
+    # A single day, before the first entry, and empty ranges.
+    (datetime.date(2015, 4, 1), datetime.date(2015, 4, 1)),
+    (datetime.date(2014, 1, 1), datetime.date(2014, 12, 31)),
+    (datetime.date(2016, 2, 1), datetime.date(2016, 1, 31)),
+    (datetime.date(2016, 2, 1), datetime.date(2015, 2, 1)),
+]
+
+
+def direct_total(entries, name, currency, start, end):
+    """Sum the units of the postings of a name between two dates."""
+    if name.endswith(":*"):
+        parent = name[: -len(":*")]
+
+        def matches(account):
+            return account == parent or account.startswith(parent + ":")
+
+    else:
+
+        def matches(account):
+            return account == name
+
+    total = ZERO
+    for entry in data.filter_txns(entries):
+        if (start and entry.date < start) or (end and entry.date > end):
+            continue
+        for posting in entry.postings:
+            if matches(posting.account) and posting.units.currency == currency:
+                total += posting.units.number
+    return total
+
+
+@pytest.mark.parametrize("currency", ["USD", "CAD", "XYZ"])
+@pytest.mark.parametrize("name", NAMES)
+def test_totals_match_direct_sums(ledger, name, currency):
+    entries, _, _ = ledger
+    index = RangeIndex(PostingStore.from_entries(entries))
+    starts, ends = zip(*RANGES)
+    totals = index.totals(name, currency, starts, ends)
+    for total, (start, end) in zip(totals.tolist(), RANGES):
+        expected = direct_total(entries, name, currency, start, end)
+        assert to_decimal(total, index.places) == expected
+        assert index.total(name, currency, start, end) == expected
+
+
+@pytest.mark.parametrize(
+    "date, months, expected",
+    [
+        ("2016-05-15", 0, "2016-05-15"),
+        ("2016-05-15", 1, "2016-04-15"),
+        ("2016-01-15", 1, "2015-12-15"),
+        ("2016-03-15", 15, "2014-12-15"),
+        ("2016-03-31", 1, "2016-02-29"),
+        ("2015-03-31", 1, "2015-02-28"),
+        ("2016-02-29", 12, "2015-02-28"),
+        ("2016-05-31", 1, "2016-04-30"),
+        ("2016-12-31", 12, "2015-12-31"),
+    ],
+)
+def test_months_before(date, months, expected):
+    date = datetime.date.fromisoformat(date)
+    expected = datetime.date.fromisoformat(expected)
+    assert months_before(date, months) == expected